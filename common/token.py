@@ -15,48 +15,88 @@
 
 ACTION = 'action'
 ADC_INPUT = 'adc_input'
+ADC_SAMPLE_RATE = 'adc_sample_rate'
+ALPHA = 'alpha'
 ANALOG_CONTROLLERS = 'analog_controllers'
+ATTACK = 'attack'
 BANK = 'bank'
+BETA = 'beta'
 BUNDLE = 'bundle'
 BYPASS = 'bypass'
 CATEGORY = 'category'
 CHANNEL = 'channel'
+CHANNELS = 'channels'
+CLIP = 'clip'
 COLON_BYPASS = ':bypass'
 COLOR = 'color'
 CONTROL = 'control'
+CONTROLS = 'controls'
+CURVE = 'curve'
 DEBOUNCE_INPUT = 'debounce_input'
+DETECTOR = 'detector'
 DISABLE = 'disable'
 DOWN = 'DOWN'
 ENCODERS = 'encoders'
 EXPRESSION = 'EXPRESSION'
 FOOTSWITCHES = 'footswitches'
+FRAMEBUFFER = 'framebuffer'
 GPIO_INPUT = 'gpio_input'
 GPIO_OUTPUT = 'gpio_output'
 HARDWARE = 'hardware'
+HYSTERESIS = 'hysteresis'
 ID = 'id'
+INDICATORS = 'indicators'
 INPUT = 'input'
+INPUT_PORT = 'input_port'
 KNOB = 'KNOB'
+LAZY_LOAD = 'lazy_load'
+LCD = 'lcd'
 LEDSTRIP_POSITION = 'ledstrip_position'
 LEFT = 'LEFT'
+LEFT_CHANNEL = 'left'
 LEFT_RIGHT = 'LEFT_RIGHT'
 LONGPRESS = 'longpress'
+MAIN_LOOP = 'main_loop'
 MAXIMUM = 'maximum'
+MAX_RATE = 'max_rate'
 MIDI = 'midi'
 MIDI_CC = 'midi_CC'
 MINIMUM = 'minimum'
+MIN_CUTOFF = 'min_cutoff'
+MODUI = 'modui'
 NAME = 'name'
 NONE = 'None'
+NRPN = 'nrpn'
+OFF_WINDOW = 'off_window'
+OVERSAMPLE = 'oversample'
 PARAMETER = 'parameter'
+PEAK_DECAY = 'peak_decay'
+PEAK_HOLD = 'peak_hold'
+PEDALBOARDS = 'pedalboards'
 PORTS = 'ports'
+PREFETCH = 'prefetch'
 PRESET = 'preset'
 RANGES = 'ranges'
+RATES = 'rates'
+RELEASE = 'release'
+RESOLUTION = 'resolution'
 RIGHT = 'RIGHT'
+RIGHT_CHANNEL = 'right'
 SHORTNAME = 'shortName'
+SIGNAL = 'signal'
+SMOOTHING = 'smoothing'
 SYMBOL = 'symbol'
 TAP_TEMPO = 'tap_tempo'
 THRESHOLD = 'threshold'
+THRESHOLDS = 'thresholds'
 TITLE = 'title'
+TRACE = 'trace'
 TYPE = 'type'
 UP = 'UP'
 VERSION = 'version'
 VOLUME = 'VOLUME'
+VU_METER = 'vu_meter'
+WARN = 'warn'
+WIFI = 'wifi'
+WINDOW = 'window'
+WORKERS = 'workers'
@@ -0,0 +1,151 @@
+# This file is part of pi-stomp.
+#
+# pi-stomp is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pi-stomp is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pi-stomp.  If not, see <https://www.gnu.org/licenses/>.
+
+import collections
+import logging
+import threading
+
+# Runs host commands (mod-ui requests) on a background thread so the poll loop never waits on mod-ui.
+#
+# Commands are submitted with a key.  A pending (not yet started) command is replaced by a newer one with the same
+# key, so eg. a burst of value changes for one parameter results in a single request with the latest value.  Commands
+# with a key of None are never coalesced.  Commands run in the order they were first queued.
+#
+# If mod-ui stalls and the queue fills up, the oldest pending command with a key of None is dropped to make room, or
+# if there isn't one the new command is.  Pending keyed commands are never dropped.
+#
+# The optional callback for a command is called with the command's return value (None if it raised).  Callbacks
+# are NOT called on the worker thread, they're collected and called by run_callbacks() which the handler calls
+# from the main loop, so they can safely update the LCD and hardware.
+
+MAX_DEPTH = 64  # pending commands, beyond this commands are dropped (submit() never waits)
+
+
+class CommandQueue:
+
+    def __init__(self, max_depth=MAX_DEPTH):
+        self.max_depth = max_depth
+        self.pending = collections.OrderedDict()  # key to (func, callback)
+        self.completed = collections.deque()      # (callback, result) waiting for run_callbacks
+        self.cond = threading.Condition()
+        self.seq = 0  # used to make unique keys for commands which can't be coalesced
+        self.busy = False
+
+        # metrics
+        self.submitted = 0
+        self.coalesced = 0
+        self.executed = 0
+        self.failed = 0
+        self.dropped = 0
+        self.max_seen_depth = 0
+
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def submit(self, key, func, callback=None):
+        with self.cond:
+            self.submitted += 1
+            if key is not None and key in self.pending:
+                # Superseded, keep the original position in the queue but run the newest command
+                self.pending[key] = (func, callback)
+                self.coalesced += 1
+                return
+            if len(self.pending) >= self.max_depth:
+                self.dropped += 1
+                oldest = next((k for k in self.pending if isinstance(k, tuple) and k[0] is None), None)
+                if oldest is None:
+                    logging.warning("Command queue full (%d), dropping %s" %
+                                    (len(self.pending), getattr(func, '__qualname__', str(key))))
+                    return
+                func_dropped, _ = self.pending.pop(oldest)
+                logging.warning("Command queue full (%d), dropping %s" %
+                                (len(self.pending) + 1, getattr(func_dropped, '__qualname__', str(oldest))))
+            if key is None:
+                self.seq += 1
+                key = (None, self.seq)
+            self.pending[key] = (func, callback)
+            self.max_seen_depth = max(self.max_seen_depth, len(self.pending) + (1 if self.busy else 0))
+            self.cond.notify_all()
+
+    def cancel(self, kinds):
+        # Drop the pending (not yet started) commands whose key, or first element of a tuple key, is in kinds.  Returns how many
+        with self.cond:
+            keys = [k for k in self.pending if (k[0] if isinstance(k, tuple) else k) in kinds]
+            for k in keys:
+                del self.pending[k]
+            self.cond.notify_all()  # for wait_idle
+            return len(keys)
+
+    def depth(self):
+        # Number of commands waiting or running
+        with self.cond:
+            return len(self.pending) + (1 if self.busy else 0)
+
+    def idle(self):
+        with self.cond:
+            return len(self.pending) == 0 and not self.busy and len(self.completed) == 0
+
+    def wait_idle(self, timeout=None):
+        # Block until all submitted commands have run (callbacks may still be waiting for run_callbacks)
+        with self.cond:
+            return self.cond.wait_for(lambda: len(self.pending) == 0 and not self.busy, timeout)
+
+    def run_callbacks(self):
+        # Called from the main loop
+        while True:
+            with self.cond:
+                if len(self.completed) == 0:
+                    return
+                callback, result = self.completed.popleft()
+            try:
+                callback(result)
+            except Exception as e:
+                logging.error("Command callback failed: %s" % str(e))
+
+    def stats(self):
+        with self.cond:
+            return {
+                'depth': len(self.pending) + (1 if self.busy else 0),
+                'max_depth': self.max_seen_depth,
+                'submitted': self.submitted,
+                'coalesced': self.coalesced,
+                'executed': self.executed,
+                'failed': self.failed,
+                'dropped': self.dropped
+            }
+
+    def log_stats(self):
+        logging.info("Command queue: %s" % ", ".join("%s %d" % (k, v) for k, v in self.stats().items()))
+
+    def _run(self):
+        while True:
+            with self.cond:
+                self.cond.wait_for(lambda: len(self.pending) > 0)
+                key, (func, callback) = self.pending.popitem(last=False)
+                self.busy = True
+                self.cond.notify_all()  # for wait_idle
+            result = None
+            try:
+                result = func()
+            except Exception as e:
+                logging.error("Command %s failed: %s" % (getattr(func, '__qualname__', str(key)), str(e)))
+                with self.cond:
+                    self.failed += 1
+            with self.cond:
+                self.executed += 1
+                self.busy = False
+                if callback is not None:
+                    self.completed.append((callback, result))
+                self.cond.notify_all()
@@ -0,0 +1,206 @@
+# This file is part of pi-stomp.
+#
+# pi-stomp is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pi-stomp is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pi-stomp.  If not, see <https://www.gnu.org/licenses/>.
+
+import lilv
+import logging
+import os
+import pickle
+import sys
+import threading
+
+import common.util as util
+
+# A single lilv World is shared by the whole process.  Each pedalboard bundle is loaded into it just long enough
+# to extract the data we need into plain python structures, then unloaded again, so the RDF model never holds
+# more than one pedalboard at a time.
+#
+# The data returned by parse() looks like:
+#   {"bundle": <path>,
+#    "blocks": [{"instance_id": <str>, "uri": <plugin uri or None>,
+#                "ports": [{"symbol": <str>, "value": <float|int|str|None>, "binding": <"chan:cc" or None>}, ...]},
+#               ...]}
+# with blocks in signal chain order (blocks not found by chasing the chain are appended at the end).
+
+_parser = None
+_parser_lock = threading.Lock()
+
+
+def get_parser():
+    # Return the process-wide parser, creating it on first use
+    global _parser
+    with _parser_lock:
+        if _parser is None:
+            _parser = LilvParser()
+        return _parser
+
+
+def parse_bundle(bundlepath):
+    # Module level entry point so bundles can be parsed by worker processes (see PedalboardLoader)
+    return get_parser().parse(bundlepath)
+
+
+class LilvParser:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.world = lilv.World()
+
+        # this is needed when loading specific bundles instead of load_all
+        # (these functions are not exposed via World yet)
+        self.world.load_specifications()
+        self.world.load_plugin_classes()
+
+        self.uri_block = self.world.new_uri("http://drobilla.net/ns/ingen#block")
+        self.uri_head  = self.world.new_uri("http://drobilla.net/ns/ingen#head")
+        self.uri_port  = self.world.new_uri("http://lv2plug.in/ns/lv2core#port")
+        self.uri_tail  = self.world.new_uri("http://drobilla.net/ns/ingen#tail")
+        self.uri_value = self.world.new_uri("http://drobilla.net/ns/ingen#value")
+        self.uri_type  = self.world.new_uri("http://www.w3.org/1999/02/22-rdf-syntax-ns#type")
+
+    def parse(self, bundlepath):
+        # lilv wants the last character as the separator
+        bundle = os.path.abspath(bundlepath)
+        if not bundle.endswith(os.sep):
+            bundle += os.sep
+        # convert bundle string into a lilv node
+        bundlenode = self.world.new_file_uri(None, bundle)
+
+        # lilv worlds are not thread safe
+        with self.lock:
+            self.world.load_bundle(bundlenode)
+            try:
+                plugin = self.get_pedalboard_plugin(bundlenode, bundle)
+                return self.extract(plugin, bundlepath)
+            finally:
+                self.world.unload_bundle(bundlenode)
+
+    def get_pedalboard_plugin(self, bundlenode, bundle):
+        # get the plugins in the bundle (the world only ever has the one bundle loaded, but filter to be sure)
+        ps = [p for p in self.world.get_all_plugins() if str(p.get_bundle_uri()) == str(bundlenode)]
+
+        # make sure the bundle includes 1 and only 1 plugin (the pedalboard)
+        if len(ps) != 1:
+            raise Exception('get_pedalboard_plugin(%s) - bundle has 0 or > 1 plugin' % bundle)
+
+        return ps[0]
+
+    def chase_tail(self, block, conn):
+        if block is None:
+            return
+        conn.append(block)
+
+        ports = self.world.find_nodes(block, self.uri_port, None)
+        for port in ports:
+            tail = self.world.get(None, self.uri_tail, port)
+            if tail is None:
+                continue
+            head = self.world.get(tail, self.uri_head, None)
+            if head is not None:
+                block = self.world.get(None, self.uri_port, head)
+                if block is not None and block not in conn:
+                    self.chase_tail(block, conn)
+            break
+        return conn
+
+    def extract(self, plugin, bundlepath):
+        # check if the plugin is a pedalboard
+        def fill_in_type(node):
+            if node is not None and node.is_uri():
+                return node
+            return None
+
+        plugin_types = [i for i in util.LILV_FOREACH(plugin.get_value(self.uri_type), fill_in_type)]
+        if "http://moddevices.com/ns/modpedal#Pedalboard" not in plugin_types:
+            raise Exception('get_pedalboard_info(%s) - plugin has no mod:Pedalboard type' % bundlepath)
+
+        # Walk ports starting from capture1 to determine general plugin order
+        # TODO can this be generalized to use the chase_tail function?
+        plugin_order = []
+        ports = plugin.get_value(self.uri_port)
+        for port in ports:
+            if port is None:
+                continue
+            tail = self.world.get(None, self.uri_tail, port)   # TODO could end up being capture2
+            if tail is None:
+                continue
+            head = self.world.get(tail, self.uri_head, None)
+            if head is not None:
+                block = self.world.get(None, self.uri_port, head)
+                if block is not None:
+                    self.chase_tail(block, plugin_order)
+            break
+        plugin_order = [str(b) for b in plugin_order]
+
+        # Iterate blocks (plugins)
+        blocks_ordered = {}
+        blocks_extra = []
+        blocks = plugin.get_value(self.uri_block)
+        for block in blocks:
+            if block is None or block.is_blank():
+                continue
+
+            plugin_uri = None
+            prototype = self.world.find_nodes(block, self.world.ns.lv2.prototype, None)
+            if len(prototype) > 0:
+                plugin_uri = str(prototype[0])
+
+            instance_id = str(block.get_path()).replace(bundlepath, "", 1)
+            ports = []
+            for port in self.world.find_nodes(block, self.world.ns.lv2.port, None):
+                param_value = self.world.get(port, self.uri_value, None)
+                binding = None
+                binding_node = self.world.get(port, self.world.ns.midi.binding, None)
+                if binding_node is not None:
+                    controller_num = self.world.get(binding_node, self.world.ns.midi.controllerNumber, None)
+                    channel = self.world.get(binding_node, self.world.ns.midi.channel, None)
+                    if (controller_num is not None) and (channel is not None):
+                        binding = "%d:%d" % (int(channel), int(controller_num))
+                        logging.debug("  MIDI CC binding %s" % binding)
+                value = None
+                if param_value is not None:
+                    if param_value.is_float():
+                        value = float(param_value)
+                    elif param_value.is_int():
+                        value = int(param_value)
+                    else:
+                        value = str(param_value)
+                ports.append({"symbol": os.path.basename(str(port)), "value": value, "binding": binding})
+
+            data = {"instance_id": instance_id, "uri": plugin_uri, "ports": ports}
+            key = str(block)
+            if key in plugin_order:
+                blocks_ordered[plugin_order.index(key)] = data
+            else:
+                blocks_extra.append(data)
+
+        ordered = [blocks_ordered[i] for i in sorted(blocks_ordered)]
+        return {"bundle": bundlepath, "blocks": ordered + blocks_extra}
+
+
+def main():
+    # Worker entry point: python -m modalapi.lilvparser <bundle>...  (see PedalboardLoader)
+    # Writes the pickled list of parse results to stdout, None for each bundle which fails to parse
+    results = []
+    for bundle in sys.argv[1:]:
+        try:
+            results.append(parse_bundle(bundle))
+        except Exception as e:
+            logging.error("Cannot parse pedalboard %s: %s" % (bundle, str(e)))
+            results.append(None)
+    sys.stdout.buffer.write(pickle.dumps(results))
+
+
+if __name__ == '__main__':
+    main()
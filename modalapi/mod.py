@@ -16,17 +16,19 @@
 import json
 import logging
 import os
-import requests as req
 import subprocess
 import sys
 import yaml
 
 import common.token as Token
 import common.util as util
+import modalapi.commandqueue as CommandQueue
 import pistomp.switchstate as switchstate
-import modalapi.pedalboard as Pedalboard
+import modalapi.modclient as ModClient
+import modalapi.pedalboardloader as PedalboardLoader
 import modalapi.parameter as Parameter
 import modalapi.wifi as Wifi
+import pistomp.filewatcher as FileWatcher
 
 from pistomp.analogmidicontrol import AnalogMidiControl
 from pistomp.footswitch import Footswitch
@@ -103,7 +105,8 @@ class Mod(Handler):
         self.audiocard = audiocard
         self.lcd = None
         self.homedir = homedir
-        self.root_uri = "http://localhost:80/"
+        self.client = ModClient.get_client()
+        self.commands = CommandQueue.CommandQueue()  # mod-ui requests which shouldn't block the poll loop
 
         self.pedalboards = {}
         self.pedalboard_list = []  # TODO LAME to have two lists
@@ -116,6 +119,7 @@ class Mod(Handler):
         self.parameter_tweak_amount = 8
 
         self.plugin_dict = {}
+        self.pedalboard_loader = None
 
         self.hardware = None
 
@@ -137,8 +141,7 @@ class Mod(Handler):
 
         # This file is modified when the pedalboard is changed via MOD UI
         self.pedalboard_modification_file = "/home/pistomp/data/last.json"
-        self.pedalboard_change_timestamp = os.path.getmtime(self.pedalboard_modification_file)\
-            if Path(self.pedalboard_modification_file).exists() else 0
+        self.file_watcher = FileWatcher.FileWatcher([self.pedalboard_modification_file])
 
         self.wifi_manager = Wifi.WifiManager()
 
@@ -154,9 +157,19 @@ class Mod(Handler):
         if self.wifi_manager:
             del self.wifi_manager
 
+    def get_stats(self):
+        return {'mod_ui_requests': self.client.stats(), 'command_queue': self.commands.stats(),
+                'file_watcher': self.file_watcher.stats()}
+
     def cleanup(self):
+        self.commands.log_stats()
+        self.client.log_stats()
+        self.client.close()
+        self.file_watcher.close()
         if self.lcd is not None:
             self.lcd.cleanup()
+        if self.hardware is not None:
+            self.hardware.cleanup()
 
     # Container for dynamic data which is unique to the "current" pedalboard
     # The self.current pointed above will point to this object which gets
@@ -308,9 +321,8 @@ class Mod(Handler):
                     self.universal_encoder_mode = UniversalEncoderMode.SYSTEM_MENU
                     self.system_menu_show()
             elif mode == UniversalEncoderMode.PEDALBOARD_SELECT:
-                self.universal_encoder_mode = UniversalEncoderMode.LOADING
-                self.pedalboard_change()
                 self.universal_encoder_mode = UniversalEncoderMode.DEFAULT
+                self.pedalboard_change()  # goes to LOADING until the load completes
             elif mode == UniversalEncoderMode.PRESET_SELECT:
                 self.universal_encoder_mode = UniversalEncoderMode.LOADING
                 self.preset_change()
@@ -431,6 +443,7 @@ class Mod(Handler):
 
     def poll_controls(self):
         # this is called many times per second.  Only critical updates should be here
+        self.commands.run_callbacks()
         if self.universal_encoder_mode is not UniversalEncoderMode.LOADING:
             self.hardware.poll_controls()
 
@@ -447,17 +460,12 @@ class Mod(Handler):
 
         # Look for a change of pedalboard
         #
-        # If the pedalboard_modification_file timestamp has changed, extract the bundle path and set current pedalboard
+        # If the pedalboard_modification_file has changed (see filewatcher.py), extract the bundle path and set
+        # current pedalboard
         #
         # TODO this is an interim solution until better MOD-UI to pi-stomp event communication is added
         #
-        if Path(self.pedalboard_modification_file).exists():
-            ts = os.path.getmtime(self.pedalboard_modification_file)
-            if ts == self.pedalboard_change_timestamp:
-                return
-
-            # Timestamp changed
-            self.pedalboard_change_timestamp = ts
+        if self.pedalboard_modification_file in self.file_watcher.changed():
             self.lcd.draw_info_message("Loading...")
             mod_bundle = self.get_pedalboard_bundle_from_mod()
             if mod_bundle:
@@ -470,11 +478,11 @@ class Mod(Handler):
     # Pedalboard Stuff
     #
 
-    def load_pedalboards(self):
-        url = self.root_uri + "pedalboard/list"
+    def load_pedalboards(self, cfg=None, rebuild_cache=False):
+        url = "pedalboard/list"
 
         try:
-            resp = req.get(url)
+            resp = self.client.get(url)
         except:  # TODO
             logging.error("Cannot connect to mod-host")
             sys.exit()
@@ -483,14 +491,12 @@ class Mod(Handler):
             logging.error("Cannot connect to mod-host.  Status: %s" % resp.status_code)
             sys.exit()
 
+        self.pedalboard_loader = PedalboardLoader.PedalboardLoader(self.plugin_dict, cfg, rebuild_cache)
+
         pbs = json.loads(resp.text)
-        for pb in pbs:
-            logging.info("Loading pedalboard info: %s" % pb[Token.TITLE])
-            bundle = pb[Token.BUNDLE]
-            title = pb[Token.TITLE]
-            pedalboard = Pedalboard.Pedalboard(title, bundle)
-            pedalboard.load_bundle(bundle, self.plugin_dict)
-            self.pedalboards[bundle] = pedalboard
+        pedalboards = self.pedalboard_loader.load_all([(pb[Token.TITLE], pb[Token.BUNDLE]) for pb in pbs])
+        for pedalboard in pedalboards:
+            self.pedalboards[pedalboard.bundle] = pedalboard
             self.pedalboard_list.append(pedalboard)
             #logging.debug("dump: %s" % pedalboard.to_json())
 
@@ -515,6 +521,9 @@ class Mod(Handler):
         return mod_bundle
 
     def set_current_pedalboard(self, pedalboard):
+        # Make sure the pedalboard data is loaded (it might just be a stub if lazy loading)
+        self.pedalboard_loader.ensure_loaded(pedalboard)
+
         # Delete previous "current"
         del self.current
 
@@ -548,6 +557,13 @@ class Mod(Handler):
         self.selectable_index = 0
         self.selected_preset_index = 0
 
+        # Get the neighboring pedalboards ready in the background (if lazy loading)
+        if pedalboard in self.pedalboard_list:
+            idx = self.pedalboard_list.index(pedalboard)
+            num = len(self.pedalboard_list)
+            self.pedalboard_loader.prefetch([self.pedalboard_list[(idx + 1) % num],
+                                             self.pedalboard_list[(idx - 1) % num]])
+
     def bind_current_pedalboard(self):
         # "current" being the pedalboard mod-host says is current
         # The pedalboard data has already been loaded, but this will overlay
@@ -600,29 +616,42 @@ class Mod(Handler):
         if self.selected_pedalboard_index < len(self.pedalboard_list):
             self.lcd.draw_info_message("Loading...")
 
-            resp1 = req.get(self.root_uri + "reset")
-            if resp1.status_code != 200:
-                logging.error("Bad Reset request")
-
-            uri = self.root_uri + "pedalboard/load_bundle/"
-            bundlepath = self.pedalboard_list[self.selected_pedalboard_index].bundle
-            data = {"bundlepath": bundlepath}
-            resp2 = req.post(uri, data)
-            if resp2.status_code != 200:
-                logging.error("Bad Rest request: %s %s  status: %d" % (uri, data, resp2.status_code))
-
-            # Now that it's presumably changed, load the dynamic "current" data
-            self.set_current_pedalboard(self.pedalboard_list[self.selected_pedalboard_index])
+            # Commands queued for the old pedalboard mustn't run on the new one.  The load goes through the queue
+            # too, so it runs after whatever is running now and before anything submitted later, without the poll
+            # loop waiting.  The encoder stays in LOADING until it's done
+            self.commands.cancel(("preset", "parameter", "bypass"))
+            pedalboard = self.pedalboard_list[self.selected_pedalboard_index]
+            self.universal_encoder_mode = UniversalEncoderMode.LOADING
+            self.commands.submit("pedalboard", lambda: self.pedalboard_load(pedalboard.bundle),
+                                 lambda result: self.pedalboard_loaded(pedalboard))
             self.bot_encoder_mode = BotEncoderMode.DEFAULT
 
+    def pedalboard_load(self, bundlepath):
+        # Runs on the command thread
+        resp1 = self.client.get("reset", timeout=ModClient.LOAD_TIMEOUT)
+        if resp1.status_code != 200:
+            logging.error("Bad Reset request")
+
+        uri = "pedalboard/load_bundle/"
+        data = {"bundlepath": bundlepath}
+        resp2 = self.client.post(uri, data, timeout=ModClient.LOAD_TIMEOUT)
+        if resp2.status_code != 200:
+            logging.error("Bad Rest request: %s %s  status: %d" % (uri, data, resp2.status_code))
+
+    def pedalboard_loaded(self, pedalboard):
+        # Now that it's presumably changed, load the dynamic "current" data
+        self.set_current_pedalboard(pedalboard)
+        if self.universal_encoder_mode == UniversalEncoderMode.LOADING:
+            self.universal_encoder_mode = UniversalEncoderMode.DEFAULT
+
     #
     # Preset Stuff
     #
 
     def load_current_presets(self):
-        url = self.root_uri + "snapshot/list"
+        url = "snapshot/list"
         try:
-            resp = req.get(url)
+            resp = self.client.get(url)
             if resp.status_code == 200:
                 pass
         except:
@@ -670,16 +699,26 @@ class Mod(Handler):
         index = self.selected_preset_index
         logging.info("preset change: %d" % index)
         self.lcd.draw_info_message("Loading...")
-        url = (self.root_uri + "snapshot/load?id=%d" % index)
-        # req.get(self.root_uri + "reset")
-        resp = req.get(url)
+        self.current.preset_index = index
+
+        # Repeated changes before the load starts collapse into loading just the last one
+        pedalboard = self.current.pedalboard
+        self.commands.submit("preset", lambda: self.preset_load(index, pedalboard),
+                             lambda bypass: self.preset_change_plugin_update(pedalboard, bypass))
+        self.bot_encoder_mode = BotEncoderMode.DEFAULT
+
+    def preset_load(self, index, pedalboard):
+        # Runs on the command thread.  Returns a dict of plugin instance_id to bypass state after the load
+        url = "snapshot/load?id=%d" % index
+        # self.client.get("reset")
+        resp = self.client.get(url)
         if resp.status_code != 200:
             logging.error("Bad Rest request: %s status: %d" % (url, resp.status_code))
-        self.current.preset_index = index
 
         #load of the preset might have changed plugin bypass status
-        self.preset_change_plugin_update()
-        self.bot_encoder_mode = BotEncoderMode.DEFAULT
+        # (all fetched at once, values which can't be read are left as they are)
+        values = self.client.get_parameter_values([(p.instance_id, ":bypass") for p in pedalboard.plugins])
+        return {instance_id: (value == "true") for (instance_id, symbol), value in values.items()}
 
     def preset_incr_and_change(self):
         if self.universal_encoder_mode == UniversalEncoderMode.LOADING:
@@ -705,17 +744,14 @@ class Mod(Handler):
             self.preset_change()
         self.universal_encoder_mode = UniversalEncoderMode.DEFAULT
 
-    def preset_change_plugin_update(self):
+    def preset_change_plugin_update(self, pedalboard, bypass):
         # Now that the preset has changed on the host, update plugin bypass indicators
-        for p in self.current.pedalboard.plugins:
-            uri = self.root_uri + "effect/parameter/pi_stomp_get//graph" + p.instance_id + "/:bypass"
-            try:
-                resp = req.get(uri)
-                if resp.status_code == 200:
-                    p.set_bypass(resp.text == "true")
-            except:
-                logging.error("failed to get bypass value for: %s" % p.instance_id)
-                continue
+        if pedalboard is not self.current.pedalboard:
+            return  # pedalboard was changed while the preset was loading
+        if bypass is not None:
+            for p in pedalboard.plugins:
+                if p.instance_id in bypass:
+                    p.set_bypass(bypass[p.instance_id])
         self.lcd.draw_tools(SelectedType.WIFI, SelectedType.EQ, SelectedType.BYPASS, SelectedType.SYSTEM)
         self.lcd.draw_analog_assignments(self.current.analog_controllers)
         self.lcd.draw_plugins(self.current.pedalboard.plugins)
@@ -755,16 +791,22 @@ class Mod(Handler):
                         c.pressed(0)
                         return
             # Regular (non footswitch plugin)
-            url = self.root_uri + "effect/parameter/pi_stomp_set//graph%s/:bypass" % inst.instance_id
+            url = "effect/parameter/pi_stomp_set//graph%s/:bypass" % inst.instance_id
             value = inst.toggle_bypass()
-            code = self.parameter_set_send(url, "1" if value else "0", 200)
-            if (code != 200):
-                inst.toggle_bypass()  # toggle back to original value since request wasn't successful
+            self.commands.submit(("bypass", inst.instance_id),
+                                 lambda: self.parameter_set_send(url, "1" if value else "0", 200),
+                                 lambda code: self.toggle_plugin_bypass_complete(inst, value, code))
 
             #  Indicate change on LCD, and redraw selection(highlight)
             self.update_lcd_plugins()
             self.lcd.draw_plugin_select(inst)  # Not strictly required for original pi-stomp
 
+    def toggle_plugin_bypass_complete(self, inst, value, code):
+        # Toggle back to original value if the request wasn't successful (and the plugin wasn't toggled again since)
+        if code != 200 and bool(inst.is_bypassed()) == bool(value):
+            inst.toggle_bypass()
+            self.update_lcd_plugins()
+
     #
     # Generic Menu functions
     #
@@ -981,9 +1023,10 @@ class Mod(Handler):
         # Figure out how to save preset (host.py:preset_save_replace)
         # TODO this also causes a problem if self.current.pedalboard.title != mod-host title
         # which can happen if the pedalboard is changed via MOD UI, not via hardware
-        url = self.root_uri + "pedalboard/save"
+        url = "pedalboard/save"
         try:
-            resp = req.post(url, data={"asNew": "0", "title": self.current.pedalboard.title})
+            resp = self.client.post(url, data={"asNew": "0", "title": self.current.pedalboard.title},
+                                    timeout=ModClient.LOAD_TIMEOUT)
             if resp.status_code != 200:
                 logging.error("Bad Rest request: %s status: %d" % (url, resp.status_code))
             else:
@@ -1163,11 +1206,14 @@ class Mod(Handler):
         return util.DICT_GET(self.callbacks, callback_name)
 
     def set_mod_tap_tempo(self, bpm):
+        self.commands.submit("bpm", lambda: self.mod_tap_tempo_send(bpm))
+
+    def mod_tap_tempo_send(self, bpm):
         try:
             resp = None
             if bpm is not None:
-                url = self.root_uri + "set_bpm"
-                resp = req.post(url, json={"value": bpm})
+                url = "set_bpm"
+                resp = self.client.post(url, json={"value": bpm})
             if resp.status_code != 200:
                 logging.error("Bad Rest request: %s status: %d" % (url, resp.status_code))
             else:
@@ -1225,24 +1271,27 @@ class Mod(Handler):
 
     def parameter_value_commit(self):
         param = self.deep.selected_parameter
-        url = self.root_uri + "effect/parameter/pi_stomp_set//graph%s/%s" % (self.deep.plugin.instance_id, param.symbol)
+        url = "effect/parameter/pi_stomp_set//graph%s/%s" % (self.deep.plugin.instance_id, param.symbol)
         formatted_value = ("%.1f" % param.value)
-        self.parameter_set_send(url, formatted_value, 200)
+        self.commands.submit(("parameter", self.deep.plugin.instance_id, param.symbol),
+                             lambda: self.parameter_set_send(url, formatted_value, 200))
 
     def parameter_set_send(self, url, value, expect_code):
+        # Returns the response status code or None if the request could not be sent
         logging.debug("request: %s" % url)
+        if value is None:
+            return None
+        logging.debug("value: %s" % value)
         try:
-            resp = None
-            if value is not None:
-                logging.debug("value: %s" % value)
-                resp = req.post(url, json={"value": value})
-            if resp.status_code != expect_code:
-                logging.error("Bad Rest request: %s status: %d" % (url, resp.status_code))
-            else:
-                logging.debug("Parameter changed to: %d" % value)
-        except:
-            logging.debug("status: %s" % resp.status_code)
-            return resp.status_code
+            resp = self.client.post(url, json={"value": value})
+        except Exception as e:
+            logging.error("Rest request failed: %s %s" % (url, str(e)))
+            return None
+        if resp.status_code != expect_code:
+            logging.error("Bad Rest request: %s status: %d" % (url, resp.status_code))
+        else:
+            logging.debug("Parameter changed to: %s" % value)
+        return resp.status_code
 
     #
     # LCD Stuff
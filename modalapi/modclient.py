@@ -0,0 +1,236 @@
+# This file is part of pi-stomp.
+#
+# pi-stomp is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pi-stomp is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pi-stomp.  If not, see <https://www.gnu.org/licenses/>.
+
+import collections
+import concurrent.futures
+import logging
+import requests as req
+import threading
+import time
+
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# All http traffic to mod-ui goes through the one ModClient (see get_client).  The underlying session keeps its
+# connections alive so a footswitch press or parameter change doesn't pay for a new TCP connection each time.
+#
+# Connection failures (request never reached mod-ui) are retried for every method.  Read failures are only
+# retried for GET since repeating a POST (eg. pedalboard/save) might not be harmless, and not at all for slow
+# requests (a timeout longer than the read timeout, eg. reset or load_bundle) since those change state and each
+# attempt could take the whole timeout.  Every request has a timeout so a hung mod-ui can't hang the main loop
+# forever.
+#
+# Latency is recorded per endpoint (the path without query or plugin instance, eg. "snapshot/load" or
+# "effect/parameter/pi_stomp_set") so the cost of each operation can be seen with stats() or log_stats().
+#
+# mod-ui has no request to get many values at once, so get_all() fans a list of GETs out over the pooled
+# connections and get_parameter_values() uses that to get the values of many plugin parameters (eg. the bypass
+# state of every plugin after a snapshot change) in about the time of the slowest one rather than the sum.
+
+ROOT_URI = "http://localhost:80/"
+
+CONNECT_TIMEOUT = 2.0   # seconds
+READ_TIMEOUT = 10.0     # seconds, can be overridden per request for slow operations
+LOAD_TIMEOUT = 60.0     # seconds, for operations which (re)load a whole pedalboard
+RETRIES = 2
+BACKOFF = 0.1           # seconds, doubled for each subsequent retry
+FANOUT = 6              # max concurrent requests for get_all
+POOL_SIZE = FANOUT + 2  # fan out plus the main and prefetch threads
+STATS_WINDOW = 256      # number of recent samples per endpoint used for percentiles
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    # Return the process-wide client, creating it on first use
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = ModClient()
+        return _client
+
+
+def endpoint(path):
+    # Name used to aggregate stats, eg. "effect/parameter/pi_stomp_get//graph/delay_1/:bypass?x=1"
+    # becomes "effect/parameter/pi_stomp_get"
+    name = path.split('?', 1)[0]
+    name = name.split('//graph', 1)[0]
+    return name.strip('/')
+
+
+class EndpointStats:
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.recent = collections.deque(maxlen=STATS_WINDOW)
+
+    def add(self, elapsed, error):
+        self.count += 1
+        if error:
+            self.errors += 1
+        self.total += elapsed
+        if elapsed > self.max:
+            self.max = elapsed
+        self.recent.append(elapsed)
+
+    def percentile(self, pct):
+        if len(self.recent) == 0:
+            return 0.0
+        samples = sorted(self.recent)
+        return samples[min(len(samples) - 1, int(len(samples) * pct / 100))]
+
+    def to_dict(self):
+        # times in milliseconds
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'avg_ms': (self.total / self.count * 1000) if self.count else 0.0,
+            'p50_ms': self.percentile(50) * 1000,
+            'p95_ms': self.percentile(95) * 1000,
+            'max_ms': self.max * 1000
+        }
+
+
+class ModClient:
+
+    def __init__(self, root_uri=ROOT_URI, connect_timeout=CONNECT_TIMEOUT, read_timeout=READ_TIMEOUT,
+                 retries=RETRIES):
+        self.root_uri = root_uri
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+
+        # status=0 since mod-ui error codes are meaningful to the callers (eg. 500 for non pi-stomp mod-ui)
+        self.session = self._session(Retry(total=retries, connect=retries, read=retries, status=0,
+                                           backoff_factor=BACKOFF, allowed_methods=["GET"], raise_on_status=False),
+                                     POOL_SIZE)
+        self.slow_session = self._session(Retry(total=retries, connect=retries, read=0, status=0,
+                                                backoff_factor=BACKOFF, raise_on_status=False), 1)
+
+        self.executor = None  # created when first needed by get_all
+        self.executor_lock = threading.Lock()
+
+        self.stats_lock = threading.Lock()
+        self.endpoint_stats = {}
+
+    @staticmethod
+    def _session(retry, pool_size):
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+        session = req.Session()
+        session.mount("http://", adapter)
+        return session
+
+    def url(self, path):
+        return self.root_uri + path
+
+    def get(self, path, timeout=None, **kwargs):
+        return self.request("GET", path, timeout, **kwargs)
+
+    def post(self, path, data=None, json=None, timeout=None, **kwargs):
+        return self.request("POST", path, timeout, data=data, json=json, **kwargs)
+
+    def request(self, method, path, timeout=None, **kwargs):
+        # Returns the response, raises requests.RequestException (after retries) if mod-ui can't be reached
+        read_timeout = timeout if timeout is not None else self.read_timeout
+        session = self.slow_session if read_timeout > self.read_timeout else self.session
+        error = True
+        start = time.monotonic()
+        try:
+            resp = session.request(method, self.url(path), timeout=(self.connect_timeout, read_timeout),
+                                        **kwargs)
+            error = resp.status_code >= 400
+            return resp
+        finally:
+            elapsed = time.monotonic() - start
+            self.record(endpoint(path), elapsed, error)
+            logging.debug("%s %s %.1fms" % (method, path, elapsed * 1000))
+
+    def get_all(self, paths, timeout=None):
+        # GET all of the paths concurrently.  Returns the list of responses in the same order as paths, None for those
+        # which couldn't be sent.  The time for the whole batch is recorded as "batch <endpoint>"
+        if len(paths) == 0:
+            return []
+        start = time.monotonic()
+        if len(paths) == 1:
+            results = [self._get_or_none(paths[0], timeout)]
+        else:
+            executor = self._get_executor()
+            futures = [executor.submit(self._get_or_none, p, timeout) for p in paths]
+            results = [f.result() for f in futures]
+        self.record("batch " + endpoint(paths[0]), time.monotonic() - start, any(r is None for r in results))
+        return results
+
+    def get_parameter_values(self, params):
+        # params is a list of (instance_id, symbol) tuples.  Returns a dict of (instance_id, symbol) to the value
+        # (response text) for each parameter which could be read
+        paths = ["effect/parameter/pi_stomp_get//graph%s/%s" % (instance_id, symbol) for instance_id, symbol in params]
+        values = {}
+        for param, resp in zip(params, self.get_all(paths)):
+            if resp is not None and resp.status_code == 200:
+                values[param] = resp.text
+        return values
+
+    def _get_or_none(self, path, timeout):
+        try:
+            return self.get(path, timeout)
+        except req.RequestException as e:
+            logging.error("Rest request failed: %s %s" % (path, str(e)))
+            return None
+
+    def _get_executor(self):
+        with self.executor_lock:
+            if self.executor is None:
+                self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=FANOUT,
+                                                                      thread_name_prefix="modclient")
+            return self.executor
+
+    def record(self, name, elapsed, error):
+        with self.stats_lock:
+            stats = self.endpoint_stats.get(name)
+            if stats is None:
+                stats = EndpointStats()
+                self.endpoint_stats[name] = stats
+            stats.add(elapsed, error)
+
+    def stats(self):
+        # Dictionary of endpoint name to its stats dictionary
+        with self.stats_lock:
+            return {name: s.to_dict() for name, s in self.endpoint_stats.items()}
+
+    def reset_stats(self):
+        with self.stats_lock:
+            self.endpoint_stats = {}
+
+    def log_stats(self):
+        stats = self.stats()
+        if len(stats) == 0:
+            return
+        logging.info("mod-ui request latency (ms):")
+        logging.info("  %-32s %7s %6s %8s %8s %8s %8s" % ("endpoint", "count", "errors", "avg", "p50", "p95", "max"))
+        for name in sorted(stats):
+            s = stats[name]
+            logging.info("  %-32s %7d %6d %8.1f %8.1f %8.1f %8.1f" % (name, s['count'], s['errors'], s['avg_ms'],
+                                                                      s['p50_ms'], s['p95_ms'], s['max_ms']))
+
+    def close(self):
+        with self.executor_lock:
+            if self.executor is not None:
+                self.executor.shutdown(wait=False)
+                self.executor = None
+        self.session.close()
+        self.slow_session.close()
@@ -18,15 +18,18 @@ from pistomp.handler import Handler
 import json
 import logging
 import os
-import requests as req
 import subprocess
 import sys
 import yaml
 
 import common.token as Token
 import common.util as util
-import modalapi.pedalboard as Pedalboard
+import modalapi.commandqueue as CommandQueue
+import modalapi.modclient as ModClient
+import modalapi.modsocket as ModSocket
+import modalapi.pedalboardloader as PedalboardLoader
 import modalapi.wifi as Wifi
+import pistomp.filewatcher as FileWatcher
 import pistomp.settings as Settings
 
 from pistomp.analogmidicontrol import AnalogMidiControl
@@ -51,7 +54,8 @@ class Modhandler(Handler):
 
         self.homedir = homedir
         self.username = "pistomp"
-        self.root_uri = "http://localhost:80/"
+        self.client = ModClient.get_client()
+        self.commands = CommandQueue.CommandQueue()  # mod-ui requests which shouldn't block the poll loop
         self.hardware = None
         self.settings = Settings.Settings()
         self.software_version = None
@@ -61,6 +65,7 @@ class Modhandler(Handler):
         self.pedalboards = {}
         self.pedalboard_list = []  # TODO LAME to have two lists
         self.plugin_dict = {}
+        self.pedalboard_loader = None
 
         self.wifi_status = {}
         self.eq_status = {}
@@ -77,14 +82,19 @@ class Modhandler(Handler):
 
         # Banks
         self.banks_file = os.path.join(self.data_dir, "banks.json")
-        self.banks_file_timestamp = os.path.getmtime(self.banks_file) if Path(self.banks_file).exists() else 0
         self.banks = {}
         self.current_bank = None
 
         # This file is modified when the pedalboard is changed via MOD UI
         self.pedalboard_modification_file = os.path.join(self.data_dir, "last.json")
-        self.pedalboard_change_timestamp = os.path.getmtime(self.pedalboard_modification_file)\
-            if Path(self.pedalboard_modification_file).exists() else 0
+
+        # Reports changes to both (see filewatcher.py)
+        self.file_watcher = FileWatcher.FileWatcher([self.pedalboard_modification_file, self.banks_file])
+
+        # Changes made in the MOD UI as they happen (see modsocket.py)
+        self.socket = ModSocket.ModSocket()
+        self.modui_loading = False            # between loading_start and loading_end
+        self.modui_structure_changed = False  # plugins added or removed, or a (re)load, since the pedalboard was loaded
 
         self.wifi_manager = Wifi.WifiManager()
 
@@ -101,7 +111,23 @@ class Modhandler(Handler):
         logging.info("Handler cleanup")
         if self.wifi_manager:
             del self.wifi_manager
+
+    def get_stats(self):
+        return {'mod_ui_requests': self.client.stats(), 'command_queue': self.commands.stats(),
+                'file_watcher': self.file_watcher.stats(), 'mod_ui_websocket': self.socket.stats(),
+                'lcd': self.lcd.get_stats() if self.lcd is not None else {}}
+
+    def frame(self):
+        if self.lcd is None:
+            return super().frame()
+        return self.lcd.frame()
+
     def cleanup(self):
+        self.commands.log_stats()
+        self.client.log_stats()
+        self.client.close()
+        self.file_watcher.close()
+        self.socket.close()
         if self.lcd is not None:
             self.lcd.cleanup()
         if self.hardware is not None:
@@ -125,6 +151,7 @@ class Modhandler(Handler):
         self.lcd = lcd
 
     def poll_controls(self):
+        self.commands.run_callbacks()
         if self.hardware:
             self.hardware.poll_controls()
 
@@ -153,34 +180,96 @@ class Modhandler(Handler):
     def poll_modui_changes(self):
         # This poll looks for changes made via the MOD UI and tries to sync the pi-Stomp hardware
 
+        # Parameter, bypass and snapshot changes pushed by mod-ui
+        if not self.socket.connected:
+            self.modui_loading = False  # a load in progress when the connection dropped won't end
+        for command, args in self.socket.events():
+            self.modui_event(command, args)
+
         # Look for a change of pedalboard
         #
-        # If the pedalboard_modification_file timestamp has changed, extract the bundle path and set current pedalboard
-        #
-        # TODO this is an interim solution until better MOD-UI to pi-stomp event communication is added
+        # If the pedalboard_modification_file has changed, extract the bundle path and set current pedalboard
+        # A change to the current pedalboard is only reloaded if plugins were added or removed or mod-ui (re)loaded
+        # it, otherwise the websocket has already applied parameter changes (a full reload is still done while it's
+        # not connected)
         #
-        if Path(self.pedalboard_modification_file).exists():
-            ts = os.path.getmtime(self.pedalboard_modification_file)
-            if ts != self.pedalboard_change_timestamp:
-                # Timestamp changed
-                self.pedalboard_change_timestamp = ts
-                self.lcd.draw_info_message("Loading...")
+        for path in self.file_watcher.changed():
+            if path == self.pedalboard_modification_file:
                 mod_bundle = self.get_pedalboard_bundle_from_mod()
+                if mod_bundle and self.socket.connected and not self.modui_structure_changed and \
+                        self.current.pedalboard.bundle == mod_bundle:
+                    continue
+                self.lcd.draw_info_message("Loading...")
                 if mod_bundle:
                     logging.info("Pedalboard changed via MOD from: %s to: %s" %
                                  (self.current.pedalboard.bundle, mod_bundle))
                     pb = self.reload_pedalboard(mod_bundle)
                     self.set_current_pedalboard(pb)
+                    self.modui_structure_changed = False
 
-        # Look for a change in banks file
-        if Path(self.banks_file).exists():
-            ts = os.path.getmtime(self.banks_file)
-            if ts != self.banks_file_timestamp:
-                # Timestamp changed
+            # Look for a change in banks file
+            elif path == self.banks_file:
                 logging.info("Reloading banks file: %s" % self.banks_file)
-                self.banks_file_timestamp = ts
                 self.load_banks()
 
+    def modui_event(self, command, args):
+        # A message from the mod-ui websocket
+        if command == "loading_start":
+            # The parameter changes while loading are ignored, so even a reload of the same pedalboard (eg. to
+            # revert unsaved changes) has to be read again
+            self.modui_loading = True
+            self.modui_structure_changed = True
+        elif command == "loading_end":
+            # The pedalboard switch itself is picked up from last.json
+            self.modui_loading = False
+        elif self.modui_loading or self.current is None or self.current.pedalboard is None:
+            return  # messages while loading describe the pedalboard being loaded
+        elif command == "param_set" and len(args) >= 3:
+            self.modui_parameter_set(args[0], args[1], args[2])
+        elif command == "pedal_snapshot" and len(args) >= 1:
+            try:
+                index = int(args[0])
+            except ValueError:
+                return
+            if index != self.current.preset_index and index in self.current.presets:
+                self.current.preset_index = index
+                self.lcd.draw_title()
+        elif command in ("add", "remove"):
+            self.modui_structure_changed = True
+
+    def modui_parameter_set(self, instance, symbol, value):
+        # instance is the path on the graph, eg. "/graph/delay_1"
+        if not instance.startswith("/graph/"):
+            return
+        instance_id = instance[len("/graph"):]
+        plugin = next((p for p in self.current.pedalboard.plugins
+                       if p is not None and p.instance_id == instance_id), None)
+        if plugin is None or plugin.parameters is None:
+            return
+        param = plugin.parameters.get(symbol)
+        if param is None:
+            return
+        try:
+            value = float(value)
+        except ValueError:
+            return
+
+        if symbol == Token.COLON_BYPASS:
+            bypass = (value != 0)
+            if bool(plugin.is_bypassed()) == bypass:
+                return
+            plugin.set_bypass(bypass)  # footswitch LED and LCD, if bound
+            self.lcd.update_plugin(plugin)
+            return
+
+        if param.value == value:
+            return
+        param.value = value
+        for c in plugin.controllers:
+            if c.parameter is param and isinstance(c, (Footswitch, EncoderMidiControl)):
+                c.set_value(value)
+        self.lcd.update_parameter(param)
+
     #
     # Bank Stuff
     #
@@ -211,11 +300,11 @@ class Modhandler(Handler):
     #
     # Pedalboard Stuff
     #
-    def load_pedalboards(self):
-        url = self.root_uri + "pedalboard/list"
+    def load_pedalboards(self, cfg=None, rebuild_cache=False):
+        url = "pedalboard/list"
 
         try:
-            resp = req.get(url)
+            resp = self.client.get(url)
         except:  # TODO
             logging.error("Cannot connect to mod-host")
             sys.exit()
@@ -224,14 +313,12 @@ class Modhandler(Handler):
             logging.error("Cannot connect to mod-host.  Status: %s" % resp.status_code)
             sys.exit()
 
+        self.pedalboard_loader = PedalboardLoader.PedalboardLoader(self.plugin_dict, cfg, rebuild_cache)
+
         pbs = json.loads(resp.text)
-        for pb in pbs:
-            logging.info("Loading pedalboard info: %s" % pb[Token.TITLE])
-            bundle = pb[Token.BUNDLE]
-            title = pb[Token.TITLE]
-            pedalboard = Pedalboard.Pedalboard(title, bundle)
-            pedalboard.load_bundle(bundle, self.plugin_dict)
-            self.pedalboards[bundle] = pedalboard
+        pedalboards = self.pedalboard_loader.load_all([(pb[Token.TITLE], pb[Token.BUNDLE]) for pb in pbs])
+        for pedalboard in pedalboards:
+            self.pedalboards[pedalboard.bundle] = pedalboard
             self.pedalboard_list.append(pedalboard)
             #logging.debug("dump: %s" % pedalboard.to_json())
 
@@ -240,9 +327,8 @@ class Modhandler(Handler):
         old = self.pedalboards[bundle]
         title = old.title
 
-        # create a new one
-        pedalboard = Pedalboard.Pedalboard(title, bundle)
-        pedalboard.load_bundle(bundle, self.plugin_dict)
+        # create a new one (only parsed if the bundle changed since it was cached)
+        pedalboard = self.pedalboard_loader.reload(old)
         self.pedalboards[bundle] = pedalboard
 
         # replace the pedalboard in pedalboard_list with the new one
@@ -271,6 +357,9 @@ class Modhandler(Handler):
         return mod_bundle
 
     def set_current_pedalboard(self, pedalboard):
+        # Make sure the pedalboard data is loaded (it might just be a stub if lazy loading)
+        self.pedalboard_loader.ensure_loaded(pedalboard)
+
         # Delete previous "current"
         del self.current
 
@@ -291,6 +380,26 @@ class Modhandler(Handler):
         self.lcd.link_data(self.pedalboard_list, self.current, self.hardware.footswitches)
         self.lcd.draw_main_panel()
 
+        # Get the neighboring pedalboards ready in the background (if lazy loading)
+        self.prefetch_pedalboards(pedalboard)
+
+    def prefetch_pedalboards(self, pedalboard):
+        # The neighbors are those next to the pedalboard in the current bank, or in the full list if no bank
+        titles = util.DICT_GET(self.banks, self.current_bank) if self.current_bank is not None else None
+        if titles:
+            if pedalboard.title not in titles:
+                return
+            idx = titles.index(pedalboard.title)
+            neighbors = [titles[(idx + 1) % len(titles)], titles[(idx - 1) % len(titles)]]
+            candidates = [pb for pb in self.pedalboard_list if pb.title in neighbors]
+        else:
+            if pedalboard not in self.pedalboard_list:
+                return
+            idx = self.pedalboard_list.index(pedalboard)
+            num = len(self.pedalboard_list)
+            candidates = [self.pedalboard_list[(idx + 1) % num], self.pedalboard_list[(idx - 1) % num]]
+        self.pedalboard_loader.prefetch(candidates)
+
     def bind_current_pedalboard(self):
         # "current" being the pedalboard mod-host says is current
         # The pedalboard data has already been loaded, but this will overlay
@@ -343,25 +452,32 @@ class Modhandler(Handler):
         logging.info("Pedalboard change")
         self.lcd.draw_info_message("Loading...")
 
-        resp1 = req.get(self.root_uri + "reset")
-        if resp1.status_code != 200:
-            logging.error("Bad Reset request")
-
-        uri = self.root_uri + "pedalboard/load_bundle/"
-
         if pedalboard is None:
             pedalboard = self.pedalboard_list[0]
         #self.set_current_pedalboard(pedalboard)  # TODO is this necessary?
+
+        # Commands queued for the old pedalboard mustn't run on the new one.  The load goes through the queue too, so
+        # it runs after whatever is running now and before anything submitted later, without the poll loop waiting
+        self.commands.cancel(("preset", "parameter", "bypass"))
         bundlepath = pedalboard.bundle
-        data = {"bundlepath": bundlepath}
-        resp2 = req.post(uri, data)
-        if resp2.status_code != 200:
-            logging.error("Bad Rest request: %s %s  status: %d" % (uri, data, resp2.status_code))
+        self.commands.submit("pedalboard", lambda: self.pedalboard_load(bundlepath))
 
         # Now that it's presumably changed, load the dynamic "current" data
         # TODO this seems to be no longer required since the MOD pedalboard change will call this via poll_modui_changes()
         #self.set_current_pedalboard(pedalboard)
 
+    def pedalboard_load(self, bundlepath):
+        # Runs on the command thread
+        resp1 = self.client.get("reset", timeout=ModClient.LOAD_TIMEOUT)
+        if resp1.status_code != 200:
+            logging.error("Bad Reset request")
+
+        uri = "pedalboard/load_bundle/"
+        data = {"bundlepath": bundlepath}
+        resp2 = self.client.post(uri, data, timeout=ModClient.LOAD_TIMEOUT)
+        if resp2.status_code != 200:
+            logging.error("Bad Rest request: %s %s  status: %d" % (uri, data, resp2.status_code))
+
     #
     # Preset Stuff
     #
@@ -382,9 +498,9 @@ class Modhandler(Handler):
             return max(indices)
 
     def load_current_presets(self):
-        url = self.root_uri + "snapshot/list"
+        url = "snapshot/list"
         try:
-            resp = req.get(url)
+            resp = self.client.get(url)
             if resp.status_code == 200:
                 pass
         except:
@@ -397,9 +513,9 @@ class Modhandler(Handler):
                 self.current.presets[index] = name
 
         # Get current snapshot (preset) info
-        url = self.root_uri + "snapshot/name?id=current"  # this will fail (500) for non pi-stomp versions of mod-ui
+        url = "snapshot/name?id=current"  # this will fail (500) for non pi-stomp versions of mod-ui
         try:
-            resp = req.get(url)
+            resp = self.client.get(url)
         except:
             return None
         if resp.status_code == 200 and resp.text is not None:
@@ -417,32 +533,53 @@ class Modhandler(Handler):
             self.lcd.draw_message_dialog("Snapshot id %d does not exist for this pedalboard" % index)
             return
         self.lcd.draw_info_message("Loading...")
-        url = (self.root_uri + "snapshot/load?id=%d" % index)
-        # req.get(self.root_uri + "reset")
-        resp = req.get(url)
-        if resp.status_code != 200:
-            logging.error("Bad Rest request: %s status: %d" % (url, resp.status_code))
         self.current.preset_index = index
 
-        # Update name on lcd
-        self.lcd.draw_title()
+        # Repeated changes before the load starts collapse into loading just the last one
+        pedalboard = self.current.pedalboard
+        self.commands.submit("preset", lambda: self.preset_load(index, pedalboard),
+                             lambda bypass: self.preset_change_plugin_update(pedalboard, bypass))
+
+    def preset_load(self, index, pedalboard):
+        # Runs on the command thread.  Returns a dict of plugin instance_id to bypass state after the load
+        url = "snapshot/load?id=%d" % index
+        # self.client.get("reset")
+        resp = self.client.get(url)
+        if resp.status_code != 200:
+            logging.error("Bad Rest request: %s status: %d" % (url, resp.status_code))
 
         # load of the preset might have changed plugin bypass status
-        self.preset_change_plugin_update()
+        return self.preset_bypass_values(pedalboard)
+
+    def preset_bypass_values(self, pedalboard):
+        # Runs on the command thread.  Returns a dict of plugin instance_id to bypass state
+        # (all fetched at once, values which can't be read are left as they are)
+        values = self.client.get_parameter_values([(p.instance_id, ":bypass") for p in pedalboard.plugins])
+        return {instance_id: (value == "true") for (instance_id, symbol), value in values.items()}
 
-    def preset_change_plugin_update(self):
+    def preset_change_plugin_update(self, pedalboard, bypass):
         # Now that the preset has changed on the host, update plugin bypass indicators
-        for p in self.current.pedalboard.plugins:
-            uri = self.root_uri + "effect/parameter/pi_stomp_get//graph" + p.instance_id + "/:bypass"
-            try:
-                resp = req.get(uri)
-                if resp.status_code == 200:
-                    p.set_bypass(resp.text == "true")
-            except:
-                logging.error("failed to get bypass value for: %s" % p.instance_id)
-                continue
+        if pedalboard is not self.current.pedalboard:
+            return  # pedalboard was changed while the preset was loading
+        if bypass is not None:
+            for p in pedalboard.plugins:
+                if p.instance_id in bypass:
+                    p.set_bypass(bypass[p.instance_id])
+
+        # Update name on lcd
+        self.lcd.draw_title()
         self.lcd.refresh_plugins()
 
+    def program_change(self, program):
+        # The host (or a controller) already changed the snapshot, just catch up with it
+        if program == self.current.preset_index or program not in self.current.presets:
+            return
+        logging.info("preset changed by MIDI: %d" % program)
+        self.current.preset_index = program
+        pedalboard = self.current.pedalboard
+        self.commands.submit("preset", lambda: self.preset_bypass_values(pedalboard),
+                             lambda bypass: self.preset_change_plugin_update(pedalboard, bypass))
+
     def preset_incr_and_change(self, *argv):
         index = self.next_preset_index(self.current.presets, self.current.preset_index, True)
         self.preset_change(index)
@@ -466,14 +603,21 @@ class Modhandler(Handler):
                         c.pressed(0)
                         return
             # Regular (non footswitch plugin)
-            url = self.root_uri + "effect/parameter/pi_stomp_set//graph%s/:bypass" % plugin.instance_id
+            url = "effect/parameter/pi_stomp_set//graph%s/:bypass" % plugin.instance_id
             value = plugin.toggle_bypass()
-            code = self.parameter_set_send(url, "1" if value else "0", 200)
-            if (code != 200):
-                plugin.toggle_bypass()  # toggle back to original value since request wasn't successful
+            self.commands.submit(("bypass", plugin.instance_id),
+                                 lambda: self.parameter_set_send(url, "1" if value else "0", 200),
+                                 lambda code: self.toggle_plugin_bypass_complete(widget, plugin, value, code))
 
             #  Indicate change on LCD
             self.lcd.toggle_plugin(widget, plugin)
+
+    def toggle_plugin_bypass_complete(self, widget, plugin, value, code):
+        # Toggle back to original value if the request wasn't successful (and the plugin wasn't toggled again since)
+        if code != 200 and bool(plugin.is_bypassed()) == bool(value):
+            plugin.toggle_bypass()
+            self.lcd.toggle_plugin(widget, plugin)
+
     def update_lcd_fs(self, footswitch=None, bypass_change=False):
         self.lcd.update_footswitch(footswitch)
 
@@ -485,24 +629,31 @@ class Modhandler(Handler):
     #
     def parameter_value_commit(self, param, value):
         param.value = value
-        url = self.root_uri + "effect/parameter/pi_stomp_set//graph%s/%s" % (param.instance_id, param.symbol)
+        url = "effect/parameter/pi_stomp_set//graph%s/%s" % (param.instance_id, param.symbol)
         formatted_value = ("%.1f" % param.value)
-        self.parameter_set_send(url, formatted_value, 200)
+        self.commands.submit(("parameter", param.instance_id, param.symbol),
+                             lambda: self.parameter_set_send(url, formatted_value, 200))
 
     def parameter_set_send(self, url, value, expect_code):
+        # Returns the response status code or None if the request could not be sent
         logging.debug("request: %s" % url)
+        if value is None:
+            return None
+        logging.debug("value: %s" % value)
         try:
-            resp = None
-            if value is not None:
-                logging.debug("value: %s" % value)
-                resp = req.post(url, json={"value": value})
-            if resp.status_code != expect_code:
-                logging.error("Bad Rest request: %s status: %d" % (url, resp.status_code))
-            else:
-                logging.debug("Parameter changed to: %d" % value)
-        except:
-            logging.debug("status: %s" % resp.status_code)
-            return resp.status_code
+            resp = self.client.post(url, json={"value": value})
+        except Exception as e:
+            logging.error("Rest request failed: %s %s" % (url, str(e)))
+            return None
+        if resp.status_code != expect_code:
+            logging.error("Bad Rest request: %s status: %d" % (url, resp.status_code))
+        else:
+            logging.debug("Parameter changed to: %s" % value)
+        return resp.status_code
+
+    def parameter_feedback(self, param):
+        if self.lcd is not None:
+            self.lcd.update_parameter(param)
 
     def parameter_midi_change(self, param, direction):
         if param:
@@ -613,9 +764,10 @@ class Modhandler(Handler):
         # Figure out how to save preset (host.py:preset_save_replace)
         # TODO this also causes a problem if self.current.pedalboard.title != mod-host title
         # which can happen if the pedalboard is changed via MOD UI, not via hardware
-        url = self.root_uri + "pedalboard/save"
+        url = "pedalboard/save"
         try:
-            resp = req.post(url, data={"asNew": "0", "title": self.current.pedalboard.title})
+            resp = self.client.post(url, data={"asNew": "0", "title": self.current.pedalboard.title},
+                                    timeout=ModClient.LOAD_TIMEOUT)
             if resp.status_code != 200:
                 logging.error("Bad Rest request: %s status: %d" % (url, resp.status_code))
             else:
@@ -756,11 +908,14 @@ class Modhandler(Handler):
         return util.DICT_GET(self.callbacks, callback_name)
 
     def set_mod_tap_tempo(self, bpm):
+        self.commands.submit("bpm", lambda: self.mod_tap_tempo_send(bpm))
+
+    def mod_tap_tempo_send(self, bpm):
         try:
             resp = None
             if bpm is not None:
-                url = self.root_uri + "set_bpm"
-                resp = req.post(url, json={"value": bpm})
+                url = "set_bpm"
+                resp = self.client.post(url, json={"value": bpm})
             if resp.status_code != 200:
                 logging.error("Bad Rest request: %s status: %d" % (url, resp.status_code))
             else:
@@ -770,9 +925,9 @@ class Modhandler(Handler):
             return resp.status_code
 
     def get_bpm(self):
-        url = self.root_uri + "get_bpm"
+        url = "get_bpm"
         try:
-            resp = req.get(url)
+            resp = self.client.get(url)
         except:
             logging.debug("status: %s" % resp.status_code)
             return 0
@@ -0,0 +1,248 @@
+# This file is part of pi-stomp.
+#
+# pi-stomp is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pi-stomp is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pi-stomp.  If not, see <https://www.gnu.org/licenses/>.
+
+import base64
+import hashlib
+import logging
+import os
+import socket
+import struct
+import threading
+import time
+
+from collections import deque
+from urllib.parse import urlparse
+
+import pistomp.scheduler as Scheduler
+
+# Subscribes to the state mod-ui broadcasts to its browser clients over its websocket, so changes made in the
+# browser (parameters, bypass, snapshots, pedalboard loads) reach the pi-Stomp as they happen.
+#
+# A thread keeps the connection open (reconnecting with backoff if mod-ui restarts), reads the messages and queues
+# them, then wakes the main loop.  The handler takes them with events() from its modui task, as (command, [args])
+# tuples, eg. ("param_set", ["/graph/delay_1", "time", "0.5"]).  The messages used by the handler:
+#   param_set <instance> <symbol> <value>     a parameter (or :bypass) changed
+#   pedal_snapshot <index> <name>             a snapshot was loaded
+#   loading_start <default> <modified>        a pedalboard load started...
+#   loading_end <snapshot index>              ...and finished
+#   add, remove                               a plugin was added or removed
+# mod-ui paces its stream with "data_ready <n>", which is answered with the same message, and "ping" with "pong".
+#
+# Only the small part of RFC 6455 mod-ui needs is implemented (no extensions, no TLS), using the standard library,
+# so a local fake server (see util/fake_modui_websocket.py) is enough to test the handler against.
+
+WS_URI = "ws://localhost:80/websocket"
+
+CONNECT_TIMEOUT = 2.0   # seconds
+RECONNECT_MIN = 0.5     # seconds, doubled after each failed attempt
+RECONNECT_MAX = 10.0    # seconds
+MAX_QUEUE = 4096        # messages kept while the main loop isn't taking them
+
+GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+OP_CONTINUATION = 0x0
+OP_TEXT = 0x1
+OP_BINARY = 0x2
+OP_CLOSE = 0x8
+OP_PING = 0x9
+OP_PONG = 0xA
+
+
+class ModSocket:
+
+    def __init__(self, uri=WS_URI):
+        self.uri = uri
+        self.sock = None
+        self.buffer = b""
+        self.send_lock = threading.Lock()
+        self.lock = threading.Lock()
+        self.queue = deque(maxlen=MAX_QUEUE)
+        self.running = True
+        self.connected = False
+
+        self.connects = 0
+        self.messages = 0
+        self.dropped = 0
+        self.errors = 0
+
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        delay = RECONNECT_MIN
+        while self.running:
+            try:
+                self._connect()
+                delay = RECONNECT_MIN
+                self._read_loop()
+            except (OSError, ValueError) as e:
+                if self.running:
+                    if self.connected:
+                        logging.warning("mod-ui websocket closed: %s" % str(e))
+                    else:
+                        logging.debug("mod-ui websocket connect failed: %s" % str(e))
+                    self.errors += 1
+            finally:
+                self._disconnect()
+            if self.running:
+                time.sleep(delay)
+                delay = min(delay * 2, RECONNECT_MAX)
+
+    def _connect(self):
+        u = urlparse(self.uri)
+        sock = socket.create_connection((u.hostname, u.port or 80), timeout=CONNECT_TIMEOUT)
+        key = base64.b64encode(os.urandom(16)).decode()
+        request = ("GET %s HTTP/1.1\r\n"
+                   "Host: %s:%d\r\n"
+                   "Upgrade: websocket\r\n"
+                   "Connection: Upgrade\r\n"
+                   "Sec-WebSocket-Key: %s\r\n"
+                   "Sec-WebSocket-Version: 13\r\n\r\n") % (u.path or "/", u.hostname, u.port or 80, key)
+        sock.sendall(request.encode())
+
+        response = b""
+        while b"\r\n\r\n" not in response:
+            data = sock.recv(1024)
+            if not data:
+                raise ValueError("connection closed during handshake")
+            response += data
+        header, rest = response.split(b"\r\n\r\n", 1)
+        lines = header.decode(errors='replace').split("\r\n")
+        if " 101 " not in lines[0] + " ":
+            raise ValueError("handshake refused: %s" % lines[0])
+        accept = base64.b64encode(hashlib.sha1((key + GUID).encode()).digest()).decode()
+        headers = {k.strip().lower(): v.strip() for k, _, v in (l.partition(":") for l in lines[1:])}
+        if headers.get("sec-websocket-accept") != accept:
+            raise ValueError("bad Sec-WebSocket-Accept")
+
+        sock.settimeout(None)
+        self.sock = sock
+        self.buffer = rest
+        self.connected = True
+        self.connects += 1
+        logging.info("mod-ui websocket connected: %s" % self.uri)
+
+    def _disconnect(self):
+        self.connected = False
+        if self.sock is not None:
+            try:
+                self.sock.close()
+            except OSError:
+                pass
+            self.sock = None
+
+    def _recv(self, n):
+        while len(self.buffer) < n:
+            data = self.sock.recv(max(4096, n - len(self.buffer)))
+            if not data:
+                raise ValueError("connection closed")
+            self.buffer += data
+        ret = self.buffer[:n]
+        self.buffer = self.buffer[n:]
+        return ret
+
+    def _read_frame(self):
+        b1, b2 = self._recv(2)
+        fin = bool(b1 & 0x80)
+        opcode = b1 & 0x0F
+        length = b2 & 0x7F
+        if length == 126:
+            length = struct.unpack("!H", self._recv(2))[0]
+        elif length == 127:
+            length = struct.unpack("!Q", self._recv(8))[0]
+        mask = self._recv(4) if b2 & 0x80 else None
+        payload = self._recv(length)
+        if mask is not None:
+            payload = bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+        return fin, opcode, payload
+
+    def _read_loop(self):
+        fragments = []
+        while self.running:
+            fin, opcode, payload = self._read_frame()
+            if opcode == OP_PING:
+                self._send_frame(OP_PONG, payload)
+            elif opcode == OP_CLOSE:
+                self._send_frame(OP_CLOSE, payload[:2])
+                raise ValueError("closed by server")
+            elif opcode in (OP_TEXT, OP_BINARY, OP_CONTINUATION):
+                fragments.append(payload)
+                if fin:
+                    message = b"".join(fragments).decode(errors='replace')
+                    fragments = []
+                    self._message(message)
+
+    def _message(self, message):
+        self.messages += 1
+        parts = message.split(" ")
+        command, args = parts[0], parts[1:]
+        if command == "data_ready":
+            self.send(message)
+            return
+        if command == "ping":
+            self.send("pong")
+            return
+        with self.lock:
+            if len(self.queue) == self.queue.maxlen:
+                self.dropped += 1
+            self.queue.append((command, args))
+        Scheduler.wake()
+
+    def _send_frame(self, opcode, payload):
+        # Client frames are always masked
+        header = bytes([0x80 | opcode])
+        length = len(payload)
+        if length < 126:
+            header += bytes([0x80 | length])
+        elif length < 65536:
+            header += bytes([0x80 | 126]) + struct.pack("!H", length)
+        else:
+            header += bytes([0x80 | 127]) + struct.pack("!Q", length)
+        mask = os.urandom(4)
+        masked = bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+        with self.send_lock:
+            if self.sock is not None:
+                self.sock.sendall(header + mask + masked)
+
+    def send(self, message):
+        try:
+            self._send_frame(OP_TEXT, message.encode())
+        except OSError as e:
+            logging.debug("mod-ui websocket send failed: %s" % str(e))
+
+    def events(self):
+        # Main thread.  Messages received since the last call
+        with self.lock:
+            ret = list(self.queue)
+            self.queue.clear()
+        return ret
+
+    def close(self):
+        self.running = False
+        if self.sock is not None:
+            try:
+                self._send_frame(OP_CLOSE, struct.pack("!H", 1000))
+                self.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        self.thread.join(1.0)
+
+    def stats(self):
+        return {
+            'connected': self.connected,
+            'connects': self.connects,
+            'messages': self.messages,
+            'dropped': self.dropped,
+            'errors': self.errors
+        }
@@ -70,6 +70,27 @@ class Parameter:
             ret.append((util.DICT_GET(v,'label'), util.DICT_GET(v,'value')))
         return ret
 
+    def to_dict(self):
+        return {"name": self.name,
+                "symbol": self.symbol,
+                "minimum": self.minimum,
+                "maximum": self.maximum,
+                "value": self.value,
+                "binding": self.binding,
+                "instance_id": self.instance_id,
+                "type": self.type.name,
+                "enum_values": self.enum_values}
+
+    @classmethod
+    def from_dict(cls, d):
+        info = {Token.SHORTNAME: d["name"],
+                Token.SYMBOL: d["symbol"],
+                Token.RANGES: {Token.MINIMUM: d["minimum"], Token.MAXIMUM: d["maximum"]}}
+        param = cls(info, d["value"], d["binding"], d["instance_id"])
+        param.type = Type[d["type"]]
+        param.enum_values = d["enum_values"]
+        return param
+
     def to_json(self):
         return json.dumps(self, default=lambda o: o.__dict__, sort_keys=True, indent=4)
 
@@ -0,0 +1,147 @@
+# This file is part of pi-stomp.
+#
+# pi-stomp is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pi-stomp is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pi-stomp.  If not, see <https://www.gnu.org/licenses/>.
+
+import json
+import logging
+import os
+import shutil
+
+import common.util as util
+import modalapi.pedalboard as Pedalboard
+
+DATA_DIR = '/home/pistomp/data'
+CACHE_FILE = '.pedalboard_cache.json'
+USER = 'pistomp'
+
+# Bump this whenever the format of the cached data (Pedalboard/Plugin/Parameter.to_dict) changes
+CACHE_VERSION = 1
+
+# Parsing pedalboard bundles with lilv is the most expensive part of startup.  This cache persists the
+# parsed data for each pedalboard, keyed by bundle path.  Each entry carries a signature of the bundle's
+# .ttl files (name, mtime, size) so that only bundles which have changed since they were cached need to be
+# parsed again.  The cache file is plain JSON and can be deleted at any time.
+
+
+class PedalboardCache:
+
+    def __init__(self, cache_file=None, rebuild=False):
+        self.file = cache_file if cache_file is not None else os.path.join(DATA_DIR, CACHE_FILE)
+        self.entries = {}
+        self.dirty = False
+        self.hits = 0
+        self.misses = 0
+        if rebuild:
+            logging.info("Pedalboard cache rebuild requested")
+            self.dirty = True
+        else:
+            self.load()
+
+    def load(self):
+        try:
+            with open(self.file, 'r') as f:
+                j = json.load(f)
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            logging.warning("Pedalboard cache unreadable, will rebuild: %s" % str(e))
+            self.dirty = True
+            return
+
+        if util.DICT_GET(j, 'version') != CACHE_VERSION:
+            logging.info("Pedalboard cache version changed, will rebuild")
+            self.dirty = True
+            return
+        self.entries = j['pedalboards']
+
+    def save(self):
+        if not self.dirty:
+            return
+        tmp_file = self.file + '.tmp'
+        try:
+            with open(tmp_file, 'w') as f:
+                json.dump({'version': CACHE_VERSION, 'pedalboards': self.entries}, f)
+            os.replace(tmp_file, self.file)
+            shutil.chown(self.file, user=USER, group=USER)
+        except Exception as e:
+            logging.error("Cannot save pedalboard cache %s: %s" % (self.file, str(e)))
+            return
+        self.dirty = False
+
+    @staticmethod
+    def signature(bundle):
+        # List of (filename, mtime, size) for every .ttl file in the bundle
+        sig = []
+        try:
+            for entry in sorted(os.scandir(bundle), key=lambda e: e.name):
+                if entry.name.endswith('.ttl') and entry.is_file():
+                    st = entry.stat()
+                    sig.append([entry.name, st.st_mtime_ns, st.st_size])
+        except OSError:
+            return None
+        return sig
+
+    def get(self, bundle, signature):
+        # Return a Pedalboard materialized from the cache or None if the entry is missing or stale
+        entry = util.DICT_GET(self.entries, bundle)
+        if entry is None or signature is None or entry['signature'] != signature:
+            return None
+        try:
+            return Pedalboard.Pedalboard.from_dict(entry['pedalboard'])
+        except (KeyError, TypeError) as e:
+            logging.warning("Pedalboard cache entry for %s is corrupt: %s" % (bundle, str(e)))
+            return None
+
+    def put(self, pedalboard, signature):
+        if signature is None or not pedalboard.complete:
+            # Don't cache pedalboards for which plugin info was missing, they'd stay incomplete forever
+            self.entries.pop(pedalboard.bundle, None)
+        else:
+            self.entries[pedalboard.bundle] = {'signature': signature, 'pedalboard': pedalboard.to_dict()}
+        self.dirty = True
+
+    def load_pedalboard(self, title, bundle, plugin_dict):
+        # Return a Pedalboard for the bundle, from the cache if it's up to date, otherwise parsed via lilv
+        pedalboard = Pedalboard.Pedalboard(title, bundle)
+        self.fill(pedalboard, plugin_dict)
+        return pedalboard
+
+    def fill(self, pedalboard, plugin_dict):
+        # Load the plugin data into an existing (not yet loaded) Pedalboard object
+        signature = self.signature(pedalboard.bundle)
+        if self.fill_cached(pedalboard, signature):
+            return
+        pedalboard.load_bundle(pedalboard.bundle, plugin_dict)
+        self.put(pedalboard, signature)
+
+    def fill_cached(self, pedalboard, signature):
+        # Load the plugin data from the cache if possible.  Returns False if the bundle needs to be parsed
+        cached = self.get(pedalboard.bundle, signature)
+        if cached is None:
+            self.misses += 1
+            return False
+        self.hits += 1
+        pedalboard.plugins = cached.plugins
+        pedalboard.loaded = True
+        return True
+
+    def prune(self, bundles):
+        # Remove entries for pedalboards which no longer exist
+        for b in list(self.entries.keys()):
+            if b not in bundles:
+                del self.entries[b]
+                self.dirty = True
+
+    def log_stats(self):
+        logging.info("Pedalboard cache: %d hits, %d misses" % (self.hits, self.misses))
@@ -0,0 +1,188 @@
+# This file is part of pi-stomp.
+#
+# pi-stomp is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pi-stomp is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pi-stomp.  If not, see <https://www.gnu.org/licenses/>.
+
+import concurrent.futures
+import logging
+import os
+import pickle
+import queue
+import subprocess
+import sys
+import threading
+
+import common.token as Token
+import common.util as util
+import modalapi.lilvparser as LilvParser
+import modalapi.pedalboard as Pedalboard
+import modalapi.pedalboardcache as PedalboardCache
+import modalapi.plugincache as PluginCache
+
+# Loads pedalboard data for the handlers.
+#
+# In the default (eager) mode every pedalboard is loaded at startup.  In lazy mode, only stub Pedalboard
+# objects (title and bundle) are created at startup.  The plugin data for a pedalboard is loaded the first time
+# it's needed (see ensure_loaded) which is usually when it's made current.  Optionally, neighboring
+# pedalboards can be loaded in the background (prefetch) so switching to them doesn't wait on parsing.
+#
+# When loading eagerly, bundles which aren't in the cache are parsed by worker processes (lilv parsing is CPU bound
+# so threads wouldn't help).  Each worker is a fresh interpreter running only the parser (python -m
+# modalapi.lilvparser) rather than a multiprocessing pool, whose workers re-import the main script and with it board,
+# gpiozero, rtmidi, etc.  Workers return plain data (see LilvParser) and the Plugin/Parameter objects are created
+# back in this process, in the original order.
+#
+# The config (default_config.yml) section which controls this:
+#   pedalboards:
+#     lazy_load: <boolean>
+#     prefetch: <boolean>
+#     workers: <integer>
+
+
+class PedalboardLoader:
+
+    def __init__(self, plugin_dict, cfg=None, rebuild_cache=False):
+        self.plugin_dict = plugin_dict
+        self.plugin_cache = PluginCache.PluginCache(plugin_dict, rebuild=rebuild_cache)
+        # Cached pedalboards contain parameter info from the plugin descriptors, so if any plugins have changed,
+        # the pedalboards need to be reparsed
+        self.cache = PedalboardCache.PedalboardCache(rebuild=(rebuild_cache or self.plugin_cache.stale > 0))
+
+        pb_cfg = util.DICT_GET(cfg, Token.PEDALBOARDS) if cfg is not None else None
+        if pb_cfg is None:
+            pb_cfg = {}
+        self.lazy = util.DICT_GET(pb_cfg, Token.LAZY_LOAD) is True
+        self.prefetch_enabled = self.lazy and util.DICT_GET(pb_cfg, Token.PREFETCH) is not False
+        self.workers = util.DICT_GET(pb_cfg, Token.WORKERS)
+        if self.workers is None:
+            self.workers = os.cpu_count() or 1
+
+        # Serializes loading between the main thread and the prefetch thread
+        # (also protects plugin_dict and the cache which are updated while loading)
+        self.lock = threading.Lock()
+        self.prefetch_queue = queue.Queue()
+        self.prefetch_thread = None
+
+    def load_all(self, pbs):
+        # pbs is a list of (title, bundle) tuples. Returns the list of Pedalboard objects in the same order
+        pedalboards = [Pedalboard.Pedalboard(title, bundle) for title, bundle in pbs]
+        with self.lock:
+            if not self.lazy:
+                # Use the cache where possible, collect the rest to be parsed
+                misses = []
+                for pedalboard in pedalboards:
+                    signature = self.cache.signature(pedalboard.bundle)
+                    if not self.cache.fill_cached(pedalboard, signature):
+                        misses.append((pedalboard, signature))
+
+                results = self.parse_bundles([pb.bundle for pb, sig in misses])
+
+                # Get any plugin descriptors we don't have yet all at once, rather than while creating the objects
+                self.plugin_cache.prefetch([block["uri"] for data in results if data is not None
+                                            for block in data["blocks"]])
+                for (pedalboard, signature), data in zip(misses, results):
+                    if data is None:
+                        continue  # failed to parse, stays unloaded (another attempt will be made on demand)
+                    logging.info("Loading pedalboard info: %s" % pedalboard.title)
+                    pedalboard.load_data(data, self.plugin_dict)
+                    self.cache.put(pedalboard, signature)
+
+            self.cache.prune([pb.bundle for pb in pedalboards])
+            self.cache.save()
+            self.plugin_cache.save()
+        if self.lazy:
+            logging.info("Pedalboards will be loaded on demand (%d found)" % len(pedalboards))
+        else:
+            self.cache.log_stats()
+        return pedalboards
+
+    def parse_bundles(self, bundles):
+        # Returns the parsed data for each bundle (None for those which fail), in the same order as bundles
+        if self.workers > 1 and len(bundles) > 1:
+            try:
+                return self._parse_parallel(bundles)
+            except Exception as e:
+                logging.error("Parallel pedalboard parsing failed, parsing serially: %s" % str(e))
+        return [self._parse_serial(b) for b in bundles]
+
+    def _parse_serial(self, bundle):
+        try:
+            return LilvParser.parse_bundle(bundle)
+        except Exception as e:
+            logging.error("Cannot parse pedalboard %s: %s" % (bundle, str(e)))
+            return None
+
+    def _parse_parallel(self, bundles):
+        # Bundles are dealt to the workers in turn, so each gets a similar share
+        workers = min(self.workers, len(bundles))
+        logging.info("Parsing %d pedalboards using %d processes" % (len(bundles), workers))
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        env = dict(os.environ)
+        env["PYTHONPATH"] = os.pathsep.join(p for p in (root, env.get("PYTHONPATH")) if p)
+        chunks = [list(range(i, len(bundles), workers)) for i in range(workers)]
+        procs = []
+        try:
+            for chunk in chunks:
+                procs.append(subprocess.Popen([sys.executable, "-m", "modalapi.lilvparser"] +
+                                              [bundles[i] for i in chunk], stdout=subprocess.PIPE, env=env))
+            with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+                outputs = list(executor.map(lambda p: p.communicate()[0], procs))
+        finally:
+            for p in procs:
+                if p.poll() is None:
+                    p.kill()
+                    p.wait()
+
+        results = [None] * len(bundles)
+        for proc, chunk, output in zip(procs, chunks, outputs):
+            if proc.returncode != 0:
+                raise Exception("pedalboard parser exited with status %d" % proc.returncode)
+            for i, data in zip(chunk, pickle.loads(output)):
+                results[i] = data
+        return results
+
+    def ensure_loaded(self, pedalboard):
+        # Make sure the plugin data for the pedalboard has been loaded, loading it now if necessary
+        if pedalboard.loaded:
+            return pedalboard
+        with self.lock:
+            if not pedalboard.loaded:  # could have been loaded by the prefetch thread while we waited
+                logging.info("Loading pedalboard info: %s" % pedalboard.title)
+                self.cache.fill(pedalboard, self.plugin_dict)
+                self.cache.save()
+                self.plugin_cache.save()
+        return pedalboard
+
+    def reload(self, pedalboard):
+        # Returns a new Pedalboard object for the same bundle, reparsed if the bundle changed
+        new = Pedalboard.Pedalboard(pedalboard.title, pedalboard.bundle)
+        return self.ensure_loaded(new)
+
+    def prefetch(self, pedalboards):
+        # Queue pedalboards to be loaded in the background
+        if not self.prefetch_enabled:
+            return
+        for pb in pedalboards:
+            if pb is not None and not pb.loaded:
+                self.prefetch_queue.put(pb)
+        if self.prefetch_thread is None:
+            self.prefetch_thread = threading.Thread(target=self._prefetch_thread, daemon=True)
+            self.prefetch_thread.start()
+
+    def _prefetch_thread(self):
+        while True:
+            pb = self.prefetch_queue.get()
+            try:
+                self.ensure_loaded(pb)
+            except Exception as e:
+                logging.error("Pedalboard prefetch failed for %s: %s" % (pb.bundle, str(e)))
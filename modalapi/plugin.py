@@ -14,6 +14,7 @@
 # along with pi-stomp.  If not, see <https://www.gnu.org/licenses/>.
 
 import json
+import modalapi.parameter as Parameter
 from pistomp.footswitch import Footswitch
 
 
@@ -52,6 +53,20 @@ class Plugin:
                 if isinstance(c, Footswitch):
                     c.set_value(param.value)
 
+    def to_dict(self):
+        # Only the data obtained from the pedalboard bundle, not the runtime bindings (controllers, lcd, etc.)
+        return {"instance_id": self.instance_id,
+                "category": self.category,
+                "parameters": [p.to_dict() for p in self.parameters.values()]}
+
+    @classmethod
+    def from_dict(cls, d):
+        parameters = {}
+        for p in d["parameters"]:
+            param = Parameter.Parameter.from_dict(p)
+            parameters[param.symbol] = param
+        return cls(d["instance_id"], parameters, None, d["category"])
+
     def to_json(self):
         return json.dumps(self, default=lambda o: o.__dict__, sort_keys=True, indent=4)
 
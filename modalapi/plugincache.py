@@ -0,0 +1,144 @@
+# This file is part of pi-stomp.
+#
+# pi-stomp is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pi-stomp is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pi-stomp.  If not, see <https://www.gnu.org/licenses/>.
+
+import json
+import logging
+import os
+import requests as req
+import shutil
+import urllib.parse
+
+import common.util as util
+import modalapi.modclient as ModClient
+
+DATA_DIR = '/home/pistomp/data'
+CACHE_FILE = '.plugin_cache.json'
+USER = 'pistomp'
+
+# Bump this whenever the format of the cache file changes
+CACHE_VERSION = 1
+
+# Plugin descriptors (as returned by the mod-ui effect/get request) are needed to build the parameters of every
+# plugin in every pedalboard.  Fetching them is one http request per plugin URI, so they're persisted here across
+# restarts.  Each descriptor is stored with the modification time of the manifest of each of its LV2 bundles
+# (descriptor "bundles" field).  Entries whose bundles have been removed or changed (plugin removed, upgraded or
+# reinstalled) are dropped when the cache is loaded, newly installed plugins are fetched when first needed.
+
+
+def get_plugin_data(uri):
+    url = "effect/get?uri=" + urllib.parse.quote(uri)
+    try:
+        resp = ModClient.get_client().get(url, headers={'Cache-Control': 'no-cache', 'Pragma': 'no-cache'})
+    except req.RequestException as e:
+        # May be on the prefetch thread, so don't exit, the pedalboard is left incomplete
+        logging.error("Cannot connect to mod-host: %s" % str(e))
+        return None
+
+    if resp.status_code != 200:
+        logging.error("mod-host not able to get plugin data: %s\nStatus: %s" % (url, resp.status_code))
+        return {}
+
+    return json.loads(resp.text)
+
+
+class PluginCache:
+
+    def __init__(self, plugin_dict, cache_file=None, rebuild=False):
+        # plugin_dict is the handler's dictionary of plugin descriptors (key is plugin URI) which this fills
+        self.plugin_dict = plugin_dict
+        self.file = cache_file if cache_file is not None else os.path.join(DATA_DIR, CACHE_FILE)
+        self.signatures = {}
+        self.stale = 0  # number of cached plugins which were found to be changed or removed
+        self.dirty = rebuild
+        if not rebuild:
+            self.load()
+
+    @staticmethod
+    def signature(info):
+        sig = []
+        bundles = util.DICT_GET(info, 'bundles')
+        if not bundles:
+            return None
+        for bundle in sorted(bundles):
+            try:
+                sig.append([bundle, os.stat(os.path.join(bundle, 'manifest.ttl')).st_mtime_ns])
+            except OSError:
+                return None
+        return sig
+
+    def load(self):
+        try:
+            with open(self.file, 'r') as f:
+                j = json.load(f)
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            logging.warning("Plugin cache unreadable, will rebuild: %s" % str(e))
+            self.dirty = True
+            return
+
+        if util.DICT_GET(j, 'version') != CACHE_VERSION:
+            self.dirty = True
+            return
+
+        for uri, entry in j['plugins'].items():
+            info = entry['info']
+            if self.signature(info) != entry['signature']:
+                self.stale += 1
+                continue
+            self.plugin_dict[uri] = info
+            self.signatures[uri] = entry['signature']
+        if self.stale > 0:
+            logging.info("Plugin cache: %d plugins changed or removed" % self.stale)
+            self.dirty = True
+
+    def save(self):
+        # Add any descriptors which were fetched outside of prefetch (eg. Pedalboard.load_data)
+        for uri, info in self.plugin_dict.items():
+            if uri not in self.signatures and info:
+                sig = self.signature(info)
+                if sig is not None:
+                    self.signatures[uri] = sig
+                    self.dirty = True
+        if not self.dirty:
+            return
+
+        plugins = {}
+        for uri, sig in self.signatures.items():
+            info = util.DICT_GET(self.plugin_dict, uri)
+            if info:
+                plugins[uri] = {'signature': sig, 'info': info}
+        tmp_file = self.file + '.tmp'
+        try:
+            with open(tmp_file, 'w') as f:
+                json.dump({'version': CACHE_VERSION, 'plugins': plugins}, f)
+            os.replace(tmp_file, self.file)
+            shutil.chown(self.file, user=USER, group=USER)
+        except Exception as e:
+            logging.error("Cannot save plugin cache %s: %s" % (self.file, str(e)))
+            return
+        self.dirty = False
+
+    def prefetch(self, uris):
+        # Fetch the descriptors for all of the given URIs which aren't already known, in one pass
+        missing = [u for u in dict.fromkeys(uris) if u is not None and u not in self.plugin_dict]
+        if len(missing) == 0:
+            return
+        logging.info("Fetching %d plugin descriptors" % len(missing))
+        for uri in missing:
+            info = get_plugin_data(uri)
+            if info:
+                logging.debug("added %s" % uri)
+                self.plugin_dict[uri] = info
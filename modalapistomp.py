@@ -18,13 +18,19 @@ import argparse
 import logging
 import os
 import sys
-import time
 
-from rtmidi.midiutil import open_midioutput
+from rtmidi.midiutil import open_midiinput, open_midioutput
 
 import pistomp.audiocardfactory as Audiocardfactory
+import common.token as Token
+import common.util as Util
 import pistomp.config as config
 import pistomp.generichost as Generichost
+import pistomp.latency as Latency
+import pistomp.midiinput as MidiInput
+import pistomp.midioutput as MidiOutput
+import pistomp.scheduler as Scheduler
+import pistomp.spibus as SpiBus
 import pistomp.testhost as Testhost
 import pistomp.handlerfactory as Handlerfactory
 import pistomp.hardwarefactory as Hardwarefactory
@@ -39,6 +45,8 @@ def main():
                         choices=['debug', 'info', 'warning', 'error', 'critical'])
     parser.add_argument("--host", nargs='+', help="Plugin host to use. Example --host mod'", default=['mod'],
                         choices=['mod', 'mod1', 'generic', 'test'])
+    parser.add_argument("--rebuild-cache", action='store_true',
+                        help="Ignore the pedalboard cache and reparse all pedalboard bundles")
 
     args = parser.parse_args()
 
@@ -68,7 +76,7 @@ def main():
     port = 0 # TODO get this (the Midi Through port) programmatically
     #port = sys.argv[1] if len(sys.argv) > 1 else None
     try:
-        midiout, port_name = open_midioutput(port)
+        midi_port, port_name = open_midioutput(port)
     except (EOFError, KeyboardInterrupt):
         sys.exit()
 
@@ -80,6 +88,9 @@ def main():
     # Hardware object uses cfg to know how to initialize the hardware elements
     cfg = config.load_default_cfg()
 
+    # All MIDI output goes through the output service (rate limited, sent from its own thread)
+    midiout = MidiOutput.MidiOutput(midi_port, cfg)
+
     if args.host[0] == 'mod':
 
         # Create singleton Mod handler
@@ -96,7 +107,7 @@ def main():
 
         # Load all pedalboard info from the lilv ttl file
         handler.load_banks()
-        handler.load_pedalboards()
+        handler.load_pedalboards(cfg, rebuild_cache=args.rebuild_cache)
 
         # Load the current pedalboard as "current"
         current_pedal_board_bundle = handler.get_current_pedalboard_bundle_path()
@@ -127,28 +138,48 @@ def main():
         except:
             raise
 
+    # MIDI input (host feedback, external controllers) updates the bound controls, if an input port is configured
+    midiin = None
+    midi_in_port = Util.DICT_GET(Util.DICT_GET(cfg[Token.HARDWARE], Token.MIDI), Token.INPUT_PORT)
+    if midi_in_port is not None:
+        try:
+            port, port_name = open_midiinput(midi_in_port, interactive=False)
+            midiin = MidiInput.MidiInput(port, hw)
+            hw.set_midiinput(midiin)
+            logging.info("MIDI input: %s" % port_name)
+        except Exception as e:
+            logging.error("Cannot open MIDI input port %s: %s" % (midi_in_port, str(e)))
+
+    # Each task runs at its own rate (see main_loop in default_config.yml), GPIO inputs wake the loop
+    scheduler = Scheduler.Scheduler(cfg)
+    scheduler.add_task(Token.CONTROLS, handler.poll_controls, on_wake=True)
+    scheduler.add_task(Token.INDICATORS, handler.poll_indicators)
+    scheduler.add_task(Token.LCD, handler.poll_lcd_updates)
+    scheduler.add_task(Token.MODUI, handler.poll_modui_changes, on_wake=True)  # file watcher wakes it too
+    scheduler.add_task(Token.WIFI, handler.poll_wifi)
+    scheduler.set_frame(handler.frame)
+    scheduler.add_stats('edge_to_midi', Latency.edge_to_midi.to_dict)
+    scheduler.add_stats('midi_out', midiout.stats)
+    if midiin is not None:
+        scheduler.add_stats('midi_in', midiin.stats)
+    scheduler.add_stats('handler', handler.get_stats)
+    scheduler.add_stats('hardware', hw.get_stats)
+    if hw.adc is not None:
+        scheduler.add_stats('adc', hw.adc.stats)
+    scheduler.add_stats('spi_bus', SpiBus.get_bus().stats)
+    scheduler.install_signal_handlers()
+
     logging.info("Entering main loop. Press Control-C to exit.")
-    period = 0
     try:
-        while True:
-            handler.poll_controls()
-            time.sleep(0.01)  # lower to increase responsiveness, but can cause conflict with LCD if too low
-
-            # For less frequent events
-            period += 1
-            if period % 2 == 0:
-                handler.poll_indicators()
-            if period % 20 == 0:
-                handler.poll_lcd_updates()
-            if period > 100:
-                handler.poll_modui_changes()
-                handler.poll_wifi()
-                period = 0
+        scheduler.run()
 
     except KeyboardInterrupt:
         logging.info('keyboard interrupt')
     finally:
         logging.info("Exit.")
+        scheduler.dump_stats()
+        if midiin is not None:
+            midiin.close()
         midiout.close_port()
         handler.cleanup()
         del handler
@@ -0,0 +1,253 @@
+# This file is part of pi-stomp.
+#
+# pi-stomp is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pi-stomp is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pi-stomp.  If not, see <https://www.gnu.org/licenses/>.
+
+import ctypes
+import fcntl
+import logging
+import numpy as np
+import struct
+import threading
+import time
+
+import pistomp.spibus as SpiBus
+
+# Reads all of the MCP3008 channels in use with a single SPI transaction per scan.
+#
+# The MCP3008 needs chip select toggled between conversions, so one long xfer2 can't read several channels.
+# Instead the scan is one SPI_IOC_MESSAGE ioctl containing a 3 byte transfer per channel with cs_change set between
+# them, so the kernel toggles chip select and python makes one system call for all channels.  If that isn't
+# possible (eg. the spi object has no fileno) each channel is read with xfer2 as before.
+#
+# Normally a sampling thread (see start) scans at a fixed rate, independent of the main loop, into a ring buffer
+# per channel holding the last BUFFER_TIME seconds of samples.  Controls register their channel (AnalogControl does
+# this) and read windowed values from the buffers: window() for the most recent samples, since() for the samples
+# added since that control's last read.
+#
+# Without the sampling thread (sample rate 0) the hardware calls scan() at the start of each poll instead and the
+# windows are the single value from that scan.  A control read when no recent sample exists (eg. the hardware
+# test which refreshes controls directly) reads its channel directly.
+#
+# All ADC transfers are done in spibus transactions since the bus is shared with the LCD.
+
+MAX_AGE = 0.05       # seconds a sample is used for before reads go direct to the ADC
+NUM_CHANNELS = 8
+SAMPLE_RATE = 500    # Hz, default rate of the sampling thread
+BUFFER_TIME = 1.0    # seconds of samples kept per channel
+
+# From linux/spi/spidev.h
+SPI_IOC_MAGIC = ord('k')
+SPI_IOC_TRANSFER_FORMAT = "=QQIIHBBBBBB"  # struct spi_ioc_transfer (32 bytes)
+SPI_IOC_TRANSFER_SIZE = struct.calcsize(SPI_IOC_TRANSFER_FORMAT)
+IOC_WRITE = 1
+
+_scanners = {}
+
+
+def SPI_IOC_MESSAGE(n):
+    # _IOW(SPI_IOC_MAGIC, 0, char[SPI_MSGSIZE(n)])
+    return (IOC_WRITE << 30) | ((n * SPI_IOC_TRANSFER_SIZE) << 16) | (SPI_IOC_MAGIC << 8) | 0
+
+
+def get_scanner(spi):
+    # Return the scanner for the spi device, creating it on first use
+    scanner = _scanners.get(id(spi))
+    if scanner is None:
+        scanner = AdcScanner(spi)
+        _scanners[id(spi)] = scanner
+    return scanner
+
+
+def command(channel):
+    # Start bit, single ended mode + channel, then clock out the result
+    return [1, (8 + channel) << 4, 0]
+
+
+def decode(b1, b2):
+    return ((b1 & 3) << 8) + b2
+
+
+class AdcScanner:
+
+    def __init__(self, spi):
+        self.spi = spi
+        self.channels = []
+        self.values = [0] * NUM_CHANNELS
+        self.scan_time = None
+        self.scans = 0
+        self.batched = True  # False once the ioctl has failed, then channels are read individually
+        self.tx_buf = None
+        self.rx_buf = None
+        self.message = None
+        self.device = SpiBus.get_bus().add_device("adc", getattr(spi, 'max_speed_hz', None), spi)
+
+        # Ring buffers, one row per channel.  count is the total number of samples written
+        self.rate = 0
+        self.size = 1
+        self.buffer = np.zeros((NUM_CHANNELS, self.size), dtype=np.int16)
+        self.count = 0
+        self.lock = threading.Lock()
+        self.thread = None
+        self.running = False
+        self.overruns = 0  # samples which couldn't be taken on time
+
+    def add_channel(self, channel):
+        with self.lock:
+            if channel in self.channels:
+                return
+            self.channels.append(channel)
+            self.channels.sort()
+            self._build_message()
+
+    def _build_message(self):
+        n = len(self.channels)
+        tx = bytearray()
+        for c in self.channels:
+            tx += bytes(command(c))
+        self.tx_buf = ctypes.create_string_buffer(bytes(tx), len(tx))
+        self.rx_buf = ctypes.create_string_buffer(len(tx))
+        tx_addr = ctypes.addressof(self.tx_buf)
+        rx_addr = ctypes.addressof(self.rx_buf)
+        message = bytearray()
+        for i in range(n):
+            # cs_change on all but the last transfer deselects the chip in between conversions
+            cs_change = 1 if i < n - 1 else 0
+            # speed_hz and bits_per_word of 0 means use the device settings (spi.max_speed_hz)
+            message += struct.pack(SPI_IOC_TRANSFER_FORMAT, tx_addr + 3 * i, rx_addr + 3 * i, 3, 0, 0, 0,
+                                   cs_change, 0, 0, 0, 0)
+        self.message = bytes(message)
+        self.scan_time = None  # new channel hasn't been read yet
+
+    #
+    # Sampling
+    #
+    def start(self, rate=SAMPLE_RATE):
+        # Start the sampling thread
+        if self.running or rate is None or rate <= 0:
+            return
+        with self.lock:
+            self.rate = rate
+            self.size = max(1, int(rate * BUFFER_TIME))
+            self.buffer = np.zeros((NUM_CHANNELS, self.size), dtype=np.int16)
+            self.count = 0
+        self.running = True
+        self.thread = threading.Thread(target=self._sample_thread, daemon=True)
+        self.thread.start()
+        logging.info("ADC sampling at %gHz" % rate)
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def _sample_thread(self):
+        period = 1.0 / self.rate
+        due = time.monotonic()
+        while self.running:
+            self._scan()
+            due += period
+            delay = due - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            elif delay < -period:
+                # fell behind (eg. SPI bus busy), skip the missed samples rather than bursting
+                self.overruns += int(-delay / period)
+                due = time.monotonic()
+
+    def scan(self):
+        # Called at the start of each poll.  Nothing to do when the sampling thread is running
+        if not self.running:
+            self._scan()
+
+    def _scan(self):
+        if len(self.channels) == 0:
+            return
+        with self.lock, SpiBus.get_bus().transaction(self.device):
+            values = self.values
+            if self.batched:
+                try:
+                    fcntl.ioctl(self.spi.fileno(), SPI_IOC_MESSAGE(len(self.channels)), self.message)
+                    rx = self.rx_buf.raw
+                    for i, c in enumerate(self.channels):
+                        values[c] = decode(rx[3 * i + 1], rx[3 * i + 2])
+                except (AttributeError, OSError) as e:
+                    logging.warning("Batched ADC scan not available, reading channels individually: %s" % str(e))
+                    self.batched = False
+            if not self.batched:
+                for c in self.channels:
+                    values[c] = self._xfer(c)
+            idx = self.count % self.size
+            for c in self.channels:
+                self.buffer[c, idx] = values[c]
+            self.count += 1
+            self.scan_time = time.monotonic()
+            self.scans += 1
+
+    def stats(self):
+        return {'rate_hz': self.rate, 'scans': self.scans, 'overruns': self.overruns, 'batched': self.batched,
+                'channels': self.channels}
+
+    def read_direct(self, channel):
+        with SpiBus.get_bus().transaction(self.device):
+            return self._xfer(channel)
+
+    def _xfer(self, channel):
+        adc = self.spi.xfer2(command(channel))
+        return decode(adc[1], adc[2])
+
+    #
+    # Consumers
+    #
+    def fresh(self):
+        return self.scan_time is not None and (time.monotonic() - self.scan_time) < MAX_AGE
+
+    def read(self, channel):
+        # Most recent value of the channel, or read directly if there's no recent sample
+        if self.fresh() and channel in self.channels:
+            return self.values[channel]
+        return self.read_direct(channel)
+
+    def samples_for(self, seconds):
+        # Number of samples covering the time period
+        if not self.running:
+            return 1
+        return min(self.size, max(1, int(round(seconds * self.rate))))
+
+    def window(self, channel, seconds):
+        # Array of the most recent samples for the channel covering the time period, oldest first
+        if not self.fresh() or channel not in self.channels:
+            return np.array([self.read(channel)], dtype=np.int16)
+        n = self.samples_for(seconds)
+        with self.lock:
+            n = min(n, self.count)
+            return self._last(channel, n, self.count)
+
+    def since(self, channel, marker):
+        # Samples added since marker (as returned by the previous call, None for the first).  Returns (samples, marker)
+        # If there are none yet, the most recent sample is returned
+        if not self.fresh() or channel not in self.channels:
+            return np.array([self.read(channel)], dtype=np.int16), marker
+        with self.lock:
+            count = self.count
+            n = count - marker if marker is not None else 1
+            n = min(max(n, 1), self.size, count)
+            return self._last(channel, n, count), count
+
+    def _last(self, channel, n, count):
+        # Copy of the last n samples ending at count, caller holds the lock
+        end = count % self.size
+        if n <= end:
+            return self.buffer[channel, end - n:end].copy()
+        return np.concatenate((self.buffer[channel, self.size - (n - end):], self.buffer[channel, :end]))
@@ -15,82 +15,29 @@
 
 
 import pistomp.analogcontrol as AnalogControl
-import logging
 
-from collections import deque
-from enum import Enum
+from pistomp.vumeter import VuState
 
-SAMPLE_PERIOD_MS = 10
-AVERAGE_PERIOD_SAMPLES = 4
-AVERAGE_PERIOD_OFF = 50
-
-class VuState(Enum):
-    OFF = 0
-    SIG = 1
-    WARN = 2
-    CLIP = 3
 
 class AnalogVU(AnalogControl.AnalogControl):
 
-    def __init__(self, spi, adc_channel, tolerance, ledstrip, ledstrip_pos, input_gain, adc_baseline):
+    # meter is the VuMeter shared by all the indicators, name is the channel name used for its per channel config
+    def __init__(self, spi, adc_channel, tolerance, ledstrip, ledstrip_pos, meter, name):
         super(AnalogVU, self).__init__(spi, adc_channel, tolerance)
         self.ledstrip = ledstrip
         self.pixel = ledstrip.add_pixel(None, ledstrip_pos)
         self.pixel.set_enable(False)
 
-        # The idea here is to have two sampling windows, one for the "on" states (SIG, WARN, CLIP)
-        # one for the "off" state.  To avoid a flickery display, the off should have a longer period (some delay)
-        # where "on" states should be immediate since they are likely transient and won't last long
-        self.samples = deque([0]*AVERAGE_PERIOD_SAMPLES, maxlen=AVERAGE_PERIOD_SAMPLES)  # Use a deque with a maximum length
-        self.off = deque([0]*AVERAGE_PERIOD_OFF, maxlen=AVERAGE_PERIOD_OFF)  # Use a deque with a maximum length
-
-        self.last_avg = 0
+        self.meter = meter
+        self.channel = meter.add_channel(name)
         self.state = VuState.OFF
         self.color_map = {VuState.OFF: None, VuState.SIG: "forestgreen", VuState.WARN: "orange", VuState.CLIP: "red"}
 
-        self.units_per_volt = 512 / 1.665   # ADC units/2 / supplyVoltage/2
-
-        self.thresh_sig = 0
-        self.thresh_warn = 0
-        self.thresh_clip = 0
-
-        self.input_gain = input_gain
-        self.adc_baseline = adc_baseline
-        self.recalibrate(input_gain, adc_baseline)
-
     def recalibrate_gain(self, input_gain):
-        self.recalibrate(input_gain, self.adc_baseline)
+        self.meter.recalibrate(input_gain, self.meter.adc_baseline)
 
     def recalibrate_baseline(self, adc_baseline):
-        self.recalibrate(self.input_gain, adc_baseline)
-
-    def recalibrate(self, input_gain, adc_baseline):
-        # This should get called when user changes ALSA capture_volume (aka input gain)
-        # Since the ADC reading the input level is before any input gain adjustment,
-        # The thresholds must change to accommodate the input gain.
-        # Positive input gain, means lower thresholds since the input will clip at lower levels
-        # Negative input gain, means higher thresholds since the ADC will receive less signal
-
-        # Threshold in db   dbV = 20 log (db)
-        # TODO Make these threshold values user configurable via default_config.yml
-
-        thresh_sig_db = -39 - input_gain
-        self.thresh_sig = int(adc_baseline + ((10 ** (thresh_sig_db / 20)) * self.units_per_volt))
-
-        thresh_warn_db = -20 - input_gain
-        self.thresh_warn = int(adc_baseline + ((10 ** (thresh_warn_db / 20)) * self.units_per_volt))
-
-        thresh_clip_db = -15 - input_gain
-        self.thresh_clip = int(adc_baseline + ((10 ** (thresh_clip_db / 20)) * self.units_per_volt))
-
-        logging.debug("analogVU: Baseline: %d, Signal Present: %d (%d dB), Warn: %d (%d dB), Clip: %d (%d dB)" %
-                      (adc_baseline, self.thresh_sig, thresh_sig_db, self.thresh_warn, thresh_warn_db,
-                       self.thresh_clip, thresh_clip_db))
-
-    def calculate_average_amplitude(self, samples):
-        if len(samples) == 0:
-            return 0.0
-        return sum(samples) / len(samples)  # TODO keep running sum instead of this O(n)
+        self.meter.recalibrate(self.meter.input_gain, adc_baseline)
 
     def change_color(self, state):
         if self.state is VuState.OFF:
@@ -100,31 +47,8 @@ class AnalogVU(AnalogControl.AnalogControl):
             self.pixel.set_enable(True)
 
     def refresh(self):
-        # read the analog pin
-        value = self.readChannel()
-
-        value = abs(self.adc_baseline - value) + self.adc_baseline
-        self.samples.append(value)
-        self.off.append(value)
-
-        average_amplitude = self.calculate_average_amplitude(self.samples)
-        average_off = self.calculate_average_amplitude(self.off)
-
-        # Off condition (more samples/lag than On)
-        state = self.state
-        if 500 < average_off < self.thresh_sig:
-            state = VuState.OFF
-
-        # On condition
-        elif average_amplitude != self.last_avg:
-            if self.thresh_sig <= average_amplitude < self.thresh_warn:  # was 523, 540, 560
-                state = VuState.SIG
-            elif self.thresh_warn <= average_amplitude < self.thresh_clip:
-                state = VuState.WARN
-            elif average_amplitude >= self.thresh_clip:
-                state = VuState.CLIP
-
-            self.last_avg = average_amplitude
+        # all of the samples taken since the last refresh
+        state = self.meter.process(self.channel, self.readSince())
 
         # Only change LED if the state changed
         if state != self.state:
@@ -18,6 +18,7 @@ import digitalio
 import board
 import adafruit_mcp3xxx.mcp3008 as MCP
 import logging
+import pistomp.adcscanner as AdcScanner
 from adafruit_mcp3xxx.analog_in import AnalogIn
 
 
@@ -27,14 +28,24 @@ class AnalogControl:
 
         self.spi = spi
         self.adc_channel = adc_channel
+        self.adc = AdcScanner.get_scanner(spi)  # shared by all controls on the same spi device
+        self.adc.add_channel(adc_channel)
+        self.marker = None          # sample count at the last readSince
         self.last_read = 0          # this keeps track of the last potentiometer value
         self.tolerance = tolerance  # to keep from being jittery we'll only change the
                                     # value when the control has moved a significant amount
 
     def readChannel(self):
-        adc = self.spi.xfer2([1, (8 + self.adc_channel) << 4, 0])
-        data = ((adc[1] & 3) << 8) + adc[2]
-        return data
+        return self.adc.read(self.adc_channel)
+
+    def readWindow(self, seconds):
+        # numpy array of the samples from the last seconds (a single sample if the ADC isn't being sampled)
+        return self.adc.window(self.adc_channel, seconds)
+
+    def readSince(self):
+        # numpy array of the samples taken since the last call
+        samples, self.marker = self.adc.since(self.adc_channel, self.marker)
+        return samples
 
     def refresh(self):
         logging.error("AnalogControl subclass hasn't overriden the refresh method")
@@ -0,0 +1,181 @@
+# This file is part of pi-stomp.
+#
+# pi-stomp is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pi-stomp is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pi-stomp.  If not, see <https://www.gnu.org/licenses/>.
+
+import logging
+import math
+import time
+
+import common.token as Token
+
+# Turns the readings of an analog control (pot, expression pedal) into the MIDI values to send.
+#
+#   smoothing    the ADC reading is smoothed, either with a one euro filter (heavy smoothing when the control is still,
+#                little lag when it's moving fast) or a plain exponential moving average
+#   curve        the reading is mapped to the output range through a lookup table built once when the control is
+#                created: linear, log (half the output at 10% travel) or audio (audio taper, 10% at half travel)
+#   hysteresis   the output (0-127, or 0-16383 at 14 bit) only moves to a new value once the smoothed input is past the halfway point
+#                between values by this many steps, so a reading sitting on a boundary doesn't flip back and forth
+#   duplicates   a value the same as the last one sent isn't sent again
+#   max_rate     at most this many messages per second are sent, values in between are dropped but the latest is
+#                always sent once the interval has passed, so the control ends up at the right value
+#
+# The settings are per analog_controllers entry in the config (default_config.yml):
+#   smoothing: <one_euro | ema | none>
+#   min_cutoff: <Hz>                  one euro cutoff frequency when the control is still
+#   beta: <number>                    one euro cutoff increase per ADC unit/second of movement
+#   alpha: <0 to 1>                   ema weight of the new reading
+#   curve: <linear | log | audio>
+#   hysteresis: <steps>               in output steps (default 0.25 at 7 bit, 4 at 14 bit)
+#   max_rate: <messages per second>   0 for no limit
+
+DEFAULTS = {
+    Token.SMOOTHING: 'one_euro',
+    Token.MIN_CUTOFF: 1.0,
+    Token.BETA: 0.01,
+    Token.ALPHA: 0.3,
+    Token.CURVE: 'linear',
+    Token.HYSTERESIS: None,
+    Token.MAX_RATE: 50
+}
+
+DEFAULT_HYSTERESIS = {127: 0.25, 16383: 4}
+CURVE_SIZE = 4096  # lookup table entries (interpolated between)
+
+CURVES = {
+    'linear': lambda x: x,
+    'log': lambda x: math.log(1 + 80 * x) / math.log(81),
+    'audio': lambda x: (81 ** x - 1) / 80
+}
+
+D_CUTOFF = 1.0  # Hz, cutoff for the one euro filter's speed estimate
+
+
+def smoothing_factor(dt, cutoff):
+    r = 2 * math.pi * cutoff * dt
+    return r / (r + 1)
+
+
+def make_curve(name):
+    # Lookup table (CURVE_SIZE + 1 entries) of the curve from 0 to 1, None for linear
+    func = CURVES.get(name)
+    if func is None:
+        logging.error("Unknown curve: %s, using linear" % name)
+        return None
+    if name == 'linear':
+        return None
+    return [func(i / CURVE_SIZE) for i in range(CURVE_SIZE + 1)]
+
+
+class AnalogFilter:
+
+    def __init__(self, cfg=None, input_max=1023, output_max=127):
+        settings = DEFAULTS.copy()
+        if cfg is not None:
+            settings.update({k: v for k, v in cfg.items() if k in DEFAULTS})
+        self.smoothing = settings[Token.SMOOTHING]
+        self.min_cutoff = settings[Token.MIN_CUTOFF]
+        self.beta = settings[Token.BETA]
+        self.alpha = settings[Token.ALPHA]
+        self.hysteresis = settings[Token.HYSTERESIS]
+        if self.hysteresis is None:
+            self.hysteresis = DEFAULT_HYSTERESIS.get(output_max, 0.25)
+        self.curve = make_curve(settings[Token.CURVE])
+        self.min_interval = (1.0 / settings[Token.MAX_RATE]) if settings[Token.MAX_RATE] else 0.0
+        self.input_max = input_max
+        self.output_max = output_max
+
+        self.filtered = None   # smoothed reading
+        self.speed = 0.0       # smoothed rate of change (units/second), one euro only
+        self.last_time = None
+        self.current = None    # output value, after hysteresis
+        self.last_candidate = None
+        self.last_sent = None
+        self.last_send_time = 0.0
+
+        # counters
+        self.sent = 0
+        self.held = 0          # output changes (without hysteresis) which hysteresis held back
+        self.duplicates = 0    # values not sent because the output went back to the last value sent
+        self.rate_limited = 0  # values not sent because a newer one replaced them during the rate limit interval
+
+    def smooth(self, value, now):
+        if self.filtered is None or self.smoothing == 'none':
+            self.filtered = float(value)
+            self.last_time = now
+            return self.filtered
+        dt = now - self.last_time
+        self.last_time = now
+        if self.smoothing == 'ema':
+            self.filtered += self.alpha * (value - self.filtered)
+        elif dt > 0:
+            speed = (value - self.filtered) / dt
+            self.speed += smoothing_factor(dt, D_CUTOFF) * (speed - self.speed)
+            cutoff = self.min_cutoff + self.beta * abs(self.speed)
+            self.filtered += smoothing_factor(dt, cutoff) * (value - self.filtered)
+        return self.filtered
+
+    def update(self, value, now=None):
+        # Takes a reading, returns the output value to send or None if nothing should be sent now
+        if now is None:
+            now = time.monotonic()
+        filtered = self.smooth(value, now)
+
+        # Curve
+        x = min(1.0, max(0.0, filtered / self.input_max))
+        if self.curve is not None:
+            pos = x * CURVE_SIZE
+            i = min(int(pos), CURVE_SIZE - 1)
+            x = self.curve[i] + (pos - i) * (self.curve[i + 1] - self.curve[i])
+
+        # Hysteresis
+        level = x * self.output_max
+        candidate = min(self.output_max, max(0, int(round(level))))
+        if self.current is None or abs(level - self.current) > 0.5 + self.hysteresis:
+            if candidate != self.current and self.current != self.last_sent and self.current is not None:
+                # the previous value was never sent (rate limited), it's dropped
+                if candidate == self.last_sent:
+                    self.duplicates += 1
+                else:
+                    self.rate_limited += 1
+            self.current = candidate
+        elif candidate != self.last_candidate and candidate != self.current:
+            self.held += 1
+        self.last_candidate = candidate
+
+        if self.current == self.last_sent or now - self.last_send_time < self.min_interval:
+            return None
+        return self.current
+
+    def sent_value(self, value, now=None):
+        # Called once a value has been sent
+        self.last_sent = value
+        self.last_send_time = time.monotonic() if now is None else now
+        self.sent += 1
+
+    def reset(self):
+        # Send the current value on the next update even if it hasn't changed (eg. the MIDI channel changed)
+        self.last_sent = None
+
+    def suppressed(self):
+        return self.held + self.duplicates + self.rate_limited
+
+    def get_stats(self):
+        return {
+            'sent': self.sent,
+            'suppressed': self.suppressed(),
+            'held': self.held,
+            'duplicates': self.duplicates,
+            'rate_limited': self.rate_limited
+        }
@@ -17,14 +17,19 @@ import adafruit_mcp3xxx.mcp3008 as MCP
 from adafruit_mcp3xxx.analog_in import AnalogIn
 
 from rtmidi.midiutil import open_midioutput
-from rtmidi.midiconstants import CONTROL_CHANGE
 
+import common.token as Token
 import common.util as util
 import json
 import pistomp.analogcontrol as analogcontrol
+import pistomp.analogfilter as AnalogFilter
+import pistomp.midimessage as MidiMessage
 
 import logging
 
+AVERAGE_TIME = 0.01  # seconds of samples averaged for each reading
+OVERSAMPLE_14BIT = 16  # samples averaged for each reading at 14 bit (2 more bits, the filter adds the rest)
+
 
 class AnalogMidiControl(analogcontrol.AnalogControl):
 
@@ -41,7 +46,22 @@ class AnalogMidiControl(analogcontrol.AnalogControl):
         self.value = None
         self.cfg = cfg
 
+        # 7 or 14 bit output (see midimessage.py).  At 14 bit, more samples are averaged (oversampling), keeping the
+        # fraction, so the resolution beyond the ADC's 10 bits is real
+        self.resolution = MidiMessage.Resolution(cfg, midi_CC)
+        oversample = util.DICT_GET(cfg, Token.OVERSAMPLE)
+        if oversample is None and self.resolution.is_high():
+            oversample = OVERSAMPLE_14BIT
+        self.average_time = AVERAGE_TIME
+        if oversample and self.adc.rate:
+            self.average_time = oversample / self.adc.rate
+
+        # smoothing, curve, hysteresis, rate limit (see analogfilter.py)
+        self.filter = AnalogFilter.AnalogFilter(cfg, output_max=self.resolution.max)
+
     def set_midi_channel(self, midi_channel):
+        if midi_channel != self.midi_channel:
+            self.filter.reset()
         self.midi_channel = midi_channel
 
     def set_value(self, value):
@@ -49,20 +69,22 @@ class AnalogMidiControl(analogcontrol.AnalogControl):
 
     # Override of base class method
     def refresh(self):
-        # read the analog pin
-        value = self.readChannel()
+        # average of the recent samples rather than a single (noisy) read
+        value = float(self.readWindow(self.average_time).mean())
 
-        # how much has it changed since the last read?
-        pot_adjust = abs(value - self.last_read)
-        value_changed = (pot_adjust > self.tolerance)
+        # tolerance (threshold in the config) is an optional extra dead band in ADC units
+        if self.tolerance and abs(value - self.last_read) <= self.tolerance:
+            value = self.last_read
 
-        if value_changed:
-            # convert 16bit adc0 (0-65535) trim pot read into 0-100 volume level
-            set_volume = util.renormalize(value, 0, 1023, 0, 127)
-
-            cc = [self.midi_channel | CONTROL_CHANGE, self.midi_CC, set_volume]
-            logging.debug("AnalogControl Sending CC event %s" % cc)
-            self.midiout.send_message(cc)
+        midi_value = self.filter.update(value)
+        if midi_value is not None:
+            msgs = self.resolution.messages(self.midi_channel, self.midi_CC, midi_value)
+            logging.debug("AnalogControl Sending CC event %s" % msgs)
+            self.midiout.send(msgs, key=(self.midi_channel, self.midi_CC))
+            self.filter.sent_value(midi_value)
 
             # save the potentiometer reading for the next loop
             self.last_read = value
+
+    def get_stats(self):
+        return self.filter.get_stats()
@@ -13,6 +13,7 @@
 # You should have received a copy of the GNU General Public License
 # along with pi-stomp.  If not, see <https://www.gnu.org/licenses/>.
 
+import numpy as np
 import time
 import pistomp.analogcontrol as analogcontrol
 import pistomp.switchstate as switchstate
@@ -20,6 +21,7 @@ import pistomp.taptempo as taptempo
 
 LONG_PRESS_TIME = 0.5    # Hold seconds which defines a long press
 FALLING_THRESHOLD = 800  # ASSUMES 10-bit ADC, can be changed for debounce handling
+DEBOUNCE_TIME = 0.005    # seconds of samples, the median of which is compared to the threshold
 
 class AnalogSwitch(analogcontrol.AnalogControl):
 
@@ -34,8 +36,8 @@ class AnalogSwitch(analogcontrol.AnalogControl):
 
     # Override of base class method
     def refresh(self):
-        # read the analog channel
-        new_value = self.readChannel()
+        # median of the recent samples so a single bounce or glitch doesn't change the state
+        new_value = np.median(self.readWindow(DEBOUNCE_TIME))
 
         if new_value <= FALLING_THRESHOLD:
             # switch pressed
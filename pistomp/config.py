@@ -35,6 +35,14 @@ schema = {
         "version": {
           "type": "number"
         },
+        "adc_sample_rate": {
+          "type": "number",
+          "minimum": 0,
+          "maximum": 1000
+        },
+        "framebuffer": {
+          "type": "string"
+        },
         "midi": {
           "type": "object",
           "properties": {
@@ -42,6 +50,14 @@ schema = {
               "type": "integer",
               "minimum": 1,
               "maximum": 16
+            },
+            "max_rate": {
+              "type": "number",
+              "minimum": 0,
+              "exclusiveMinimum": True
+            },
+            "input_port": {
+              "type": ["integer", "string"]
             }
           },
           "required": [
@@ -123,6 +139,46 @@ schema = {
               "midi_CC": {
                 "type": "integer"
               },
+              "alpha": {
+                "type": "number",
+                "minimum": 0,
+                "maximum": 1
+              },
+              "beta": {
+                "type": "number",
+                "minimum": 0
+              },
+              "curve": {
+                "enum": ["linear", "log", "audio"]
+              },
+              "hysteresis": {
+                "type": "number",
+                "minimum": 0
+              },
+              "max_rate": {
+                "type": "number",
+                "minimum": 0
+              },
+              "min_cutoff": {
+                "type": "number",
+                "minimum": 0,
+                "exclusiveMinimum": True
+              },
+              "nrpn": {
+                "type": "integer",
+                "minimum": 0,
+                "maximum": 16383
+              },
+              "oversample": {
+                "type": "integer",
+                "minimum": 1
+              },
+              "resolution": {
+                "enum": [7, 14]
+              },
+              "smoothing": {
+                "enum": ["one_euro", "ema", "none"]
+              },
               "threshold": {
                 "type": "integer",
                 "minimum": 0,
@@ -138,6 +194,63 @@ schema = {
             ]
           }
         },
+        "vu_meter": {
+          "type": "object",
+          "properties": {
+            "detector": {
+              "enum": ["average", "rms"]
+            },
+            "window": {
+              "type": "number",
+              "minimum": 0,
+              "exclusiveMinimum": True
+            },
+            "off_window": {
+              "type": "number",
+              "minimum": 0
+            },
+            "attack": {
+              "type": "number",
+              "minimum": 0
+            },
+            "release": {
+              "type": "number",
+              "minimum": 0
+            },
+            "peak_hold": {
+              "type": "number",
+              "minimum": 0
+            },
+            "peak_decay": {
+              "type": "number",
+              "minimum": 0
+            },
+            "thresholds": {
+              "type": "object",
+              "properties": {
+                "signal": {"type": "number"},
+                "warn": {"type": "number"},
+                "clip": {"type": "number"}
+              }
+            },
+            "channels": {
+              "type": "object",
+              "additionalProperties": {
+                "type": "object",
+                "properties": {
+                  "thresholds": {
+                    "type": "object",
+                    "properties": {
+                      "signal": {"type": "number"},
+                      "warn": {"type": "number"},
+                      "clip": {"type": "number"}
+                    }
+                  }
+                }
+              }
+            }
+          }
+        },
         "encoders": {
           "type": "array",
           "uniqueItems": True,
@@ -155,6 +268,14 @@ schema = {
               },
               "longpress": {
                 "type": "string"
+              },
+              "nrpn": {
+                "type": "integer",
+                "minimum": 0,
+                "maximum": 16383
+              },
+              "resolution": {
+                "enum": [7, 14]
               }
             },
             "required": [
@@ -167,6 +288,37 @@ schema = {
         "version",
         "midi",
       ]
+    },
+    "pedalboards": {
+      "type": "object",
+      "properties": {
+        "lazy_load": {
+          "type": "boolean"
+        },
+        "prefetch": {
+          "type": "boolean"
+        },
+        "workers": {
+          "type": "integer",
+          "minimum": 0
+        }
+      }
+    },
+    "main_loop": {
+      "type": "object",
+      "properties": {
+        "rates": {
+          "type": "object",
+          "additionalProperties": {
+            "type": "number",
+            "minimum": 0,
+            "exclusiveMinimum": True
+          }
+        },
+        "trace": {
+          "type": "boolean"
+        }
+      }
     }
   },
   "required": [
@@ -14,6 +14,10 @@
 # along with pi-stomp.  If not, see <https://www.gnu.org/licenses/>.
 
 import threading
+import time
+
+import pistomp.latency as latency
+import pistomp.scheduler as scheduler
 
 from functools import partial
 from gpiozero import Button   # TODO consider using Encoder class instead
@@ -50,6 +54,9 @@ class Encoder:
         if d != 0:
             with self._lock:
                 self.direction += d
+                if self.edge_tstamp is None:
+                    self.edge_tstamp = time.monotonic()
+            scheduler.wake()
 
     def __init__(self, d_pin, clk_pin, callback, type=None, id=None, **kw):
         self.d_pin = d_pin
@@ -71,6 +78,7 @@ class Encoder:
         self.prevNextCode = 0
         self.store = 0
         self.direction = 0
+        self.edge_tstamp = None  # time of the first detent since the last read_rotary
 
         # 16 possible grey codes.  1=Valid, 0=Invalid (bounce)
         self.rot_enc_table = [0, 1, 1, 0, 1, 0, 0, 1, 1, 0, 0, 1, 0, 1, 1, 0]
@@ -89,6 +97,7 @@ class Encoder:
 
     def read_rotary(self):
         d = 0
+        edge = None
         if self.direction != 0:
             with self._lock:
                 if self.direction > 0:
@@ -96,7 +105,12 @@ class Encoder:
                 elif self.direction < 0:
                     d = -1
                 self.direction -= d
+                edge = self.edge_tstamp
+                self.edge_tstamp = None
         else:
             d = self._process_gpios()
         if d != 0 and self.callback is not None:
+            if edge is not None:
+                latency.input_edge(edge)
             self.callback(d)
+            latency.input_done()
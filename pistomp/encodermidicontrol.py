@@ -13,11 +13,11 @@
 # You should have received a copy of the GNU General Public License
 # along with pi-stomp.  If not, see <https://www.gnu.org/licenses/>.
 
-from rtmidi.midiconstants import CONTROL_CHANGE
-
 import common.util as util
 import pistomp.controller as controller
 import pistomp.encoder as encoder
+import pistomp.latency as latency
+import pistomp.midimessage as MidiMessage
 
 import logging
 
@@ -38,6 +38,7 @@ class EncoderMidiControl(encoder.Encoder, controller.Controller):
         self.cfg = {}
         self.midi_value = 0  # the midi equivalent value
         self.per_click = 8   # resolution (midi values per click)
+        self.resolution = MidiMessage.Resolution(None, midi_CC)
 
         # Override base class to call our update function
         self.callback = self.refresh
@@ -45,6 +46,15 @@ class EncoderMidiControl(encoder.Encoder, controller.Controller):
     def set_midi_channel(self, midi_channel):
         self.midi_channel = midi_channel
 
+    def set_resolution(self, resolution):
+        # At 14 bit a click moves the value the same amount as at 7 bit, but from the exact parameter position
+        # (see set_value) rather than the nearest of 128 values
+        self.midi_value = util.renormalize(self.midi_value, self.midi_min, self.midi_max, 0, resolution.max)
+        self.per_click = round(self.per_click * resolution.max / self.resolution.max)
+        self.resolution = resolution
+        self.midi_min = 0
+        self.midi_max = resolution.max
+
     def set_value(self, value):
         # This gets called during pedalboard load (binding) to initialize the control position
         # TODO call this during snapshot/preset load as well, otherwise initial setting comes from previous snapshot
@@ -55,8 +65,8 @@ class EncoderMidiControl(encoder.Encoder, controller.Controller):
             self.midi_value = util.renormalize(value, self.parameter.minimum, self.parameter.maximum, self.midi_min,
                                                self.midi_max)
         else:
-            # LAME just set to 50%
-            self.midi_value = 64
+            # LAME just set to 50% (64 for 7 bit, 8192 for 14 bit)
+            self.midi_value = (self.midi_min + self.midi_max + 1) // 2
 
     def read_rotary(self):
         # base class read_rotary reads then calls callback which we set above to be this refresh()
@@ -72,9 +82,10 @@ class EncoderMidiControl(encoder.Encoder, controller.Controller):
         if midi_value < self.midi_min:
             midi_value = self.midi_min
 
-        cc = [self.midi_channel | CONTROL_CHANGE, self.midi_CC, midi_value]
-        logging.debug("Encoder Sending CC event %s" % cc)
-        self.midiout.send_message(cc)
+        msgs = self.resolution.messages(self.midi_channel, self.midi_CC, midi_value)
+        logging.debug("Encoder Sending CC event %s" % msgs)
+        self.midiout.send(msgs, key=(self.midi_channel, self.midi_CC))
+        latency.midi_sent()
 
         # Now that the MIDI msg was sent, update our current value
         self.midi_value = midi_value
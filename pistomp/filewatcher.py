@@ -0,0 +1,188 @@
+# This file is part of pi-stomp.
+#
+# pi-stomp is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pi-stomp is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pi-stomp.  If not, see <https://www.gnu.org/licenses/>.
+
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import struct
+import threading
+import time
+
+import pistomp.scheduler as Scheduler
+
+# Reports changes to files written by mod-ui (last.json when the pedalboard changes, banks.json) so the handler
+# doesn't have to stat them every second.
+#
+# A thread waits on inotify events for the files' directories (watching the directory catches the file being
+# replaced by a rename as well as written in place).  A change is reported once the file has been closed after
+# writing (or renamed into place) and no other event arrived for DEBOUNCE, or once it's been quiet for SETTLE if the
+# close was missed, so a file still being written isn't read half done.  Reporting wakes the main loop.
+#
+# The handler calls changed() from its modui task to get the paths which changed since the last call.  Without
+# inotify (not Linux, or too many watches), changed() falls back to comparing the files' mtimes at most every
+# POLL_INTERVAL.
+
+DEBOUNCE = 0.05      # seconds after the last event of a complete write
+SETTLE = 1.0         # seconds after the last event of an incomplete write
+POLL_INTERVAL = 1.0  # seconds between mtime checks without inotify
+
+# inotify (see inotify(7))
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+EVENT_HEADER = struct.Struct('iIII')  # wd, mask, cookie, name length
+COMPLETE = IN_CLOSE_WRITE | IN_MOVED_TO
+
+
+def mtime(path):
+    try:
+        return os.path.getmtime(path)
+    except OSError:
+        return None
+
+
+class FileWatcher:
+
+    def __init__(self, paths, use_inotify=True):
+        self.paths = list(paths)
+        self.mtimes = {p: mtime(p) for p in self.paths}  # as of the last report
+        self.lock = threading.Lock()
+        self.ready = []       # paths changed since the last changed() call
+        self.pending = {}     # path to (time of last event, write complete)
+        self.last_poll = time.monotonic()
+        self.running = True
+
+        self.events = 0
+        self.reported = 0
+        self.polls = 0
+
+        self.fd = None
+        self.dirs = {}        # watch descriptor to directory
+        if use_inotify:
+            self._init_inotify()
+        self.thread = None
+        if self.fd is not None:
+            self.thread = threading.Thread(target=self._watch, daemon=True)
+            self.thread.start()
+        else:
+            logging.info("File changes found by polling every %gs" % POLL_INTERVAL)
+
+    def _init_inotify(self):
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+            fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+            if fd < 0:
+                raise OSError(ctypes.get_errno(), "inotify_init1")
+            for d in set(os.path.dirname(p) for p in self.paths):
+                wd = libc.inotify_add_watch(fd, d.encode(), IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE)
+                if wd < 0:
+                    os.close(fd)
+                    raise OSError(ctypes.get_errno(), "inotify_add_watch %s" % d)
+                self.dirs[wd] = d
+            self.fd = fd
+        except (AttributeError, OSError) as e:
+            logging.warning("inotify unavailable (%s)" % str(e))
+            self.dirs = {}
+
+    def _watch(self):
+        fd = self.fd
+        while self.running:
+            now = time.monotonic()
+            timeout = 1.0
+            with self.lock:
+                for (t, complete) in self.pending.values():
+                    timeout = min(timeout, max(0.0, t + (DEBOUNCE if complete else SETTLE) - now))
+            try:
+                readable, _, _ = select.select([fd], [], [], timeout)
+                if readable:
+                    self._read_events(os.read(fd, 4096))
+            except OSError as e:
+                if self.running:
+                    logging.error("inotify read failed: %s" % str(e))
+                return
+            self._report(time.monotonic())
+
+    def _read_events(self, buf):
+        now = time.monotonic()
+        offset = 0
+        while offset + EVENT_HEADER.size <= len(buf):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(buf, offset)
+            offset += EVENT_HEADER.size
+            name = buf[offset:offset + length].rstrip(b'\0').decode(errors='replace')
+            offset += length
+            d = self.dirs.get(wd)
+            if d is None:
+                continue
+            path = os.path.join(d, name)
+            if path not in self.mtimes:
+                continue
+            self.events += 1
+            with self.lock:
+                self.pending[path] = (now, bool(mask & COMPLETE))
+
+    def _report(self, now):
+        with self.lock:
+            done = [p for p, (t, complete) in self.pending.items() if now - t >= (DEBOUNCE if complete else SETTLE)]
+            for p in done:
+                del self.pending[p]
+                if p not in self.ready:
+                    self.ready.append(p)
+        if len(done) > 0:
+            Scheduler.wake()
+
+    def changed(self):
+        # Main thread.  Paths which changed since the last call
+        if self.thread is None:
+            now = time.monotonic()
+            if now - self.last_poll < POLL_INTERVAL:
+                return []
+            self.last_poll = now
+            self.polls += 1
+            candidates = self.paths
+        else:
+            with self.lock:
+                candidates = self.ready
+                self.ready = []
+
+        ret = []
+        for p in candidates:
+            m = mtime(p)
+            if m is not None and m != self.mtimes[p]:
+                self.mtimes[p] = m
+                ret.append(p)
+        self.reported += len(ret)
+        return ret
+
+    def close(self):
+        self.running = False
+        if self.fd is not None:
+            fd = self.fd
+            self.fd = None
+            if self.thread is not None:
+                self.thread.join(1.5)
+            os.close(fd)
+
+    def stats(self):
+        return {
+            'inotify': self.thread is not None,
+            'events': self.events,
+            'reported': self.reported,
+            'polls': self.polls
+        }
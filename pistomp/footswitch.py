@@ -23,6 +23,7 @@ import common.token as Token
 import pistomp.controller as controller
 import pistomp.analogswitch as analogswitch
 import pistomp.gpioswitch as gpioswitch
+import pistomp.latency as latency
 import pistomp.switchstate as switchstate
 import common.util as util
 
@@ -243,6 +244,7 @@ class Footswitch(controller.Controller):
             cc = [self.midi_channel | CONTROL_CHANGE, self.midi_CC, 127 if self.enabled else 0]
             logging.debug("Sending CC event: %d" % self.midi_CC)
             self.midiout.send_message(cc)
+            latency.midi_sent()
 
         # Update plugin parameter if any
         if self.parameter is not None:
@@ -17,6 +17,8 @@ import logging
 from gpiozero import Button
 
 import pistomp.controller as controller
+import pistomp.latency as latency
+import pistomp.scheduler as scheduler
 import pistomp.switchstate as switchstate
 import pistomp.taptempo as taptempo
 
@@ -29,6 +31,7 @@ class GpioSwitch(controller.Controller):
         super(GpioSwitch, self).__init__(midi_channel, midi_CC)
         self.gpio_input = gpio_input
         self.cur_tstamp = None
+        self.release_tstamp = None
         self.events = queue.Queue()
         self.callback = callback
         self.longpress_callback = longpress_callback
@@ -40,8 +43,10 @@ class GpioSwitch(controller.Controller):
         # TODO with the move to gpiozero.button, we could take advantage of its methods for detecting release,
         # hold, etc. (when_released, when_held).  But experiments with those async events caused issues with
         # the LCD refresh timing.  So for now, we'll just poll like we did before when using RPi.GPIO
+        # (the callbacks only timestamp and wake the main loop so it polls right away)
         self.button = Button(gpio_input, bounce_time=0.008)
         self.button.when_pressed = self._gpio_down
+        self.button.when_released = self._gpio_up
 
     def __del__(self):
         self.button.close()
@@ -59,6 +64,13 @@ class GpioSwitch(controller.Controller):
         self.events.put(t)
         if self.taptempo:
             self.taptempo.stamp(t)
+        scheduler.wake()
+
+    def _gpio_up(self, gpio):
+        # This is run from a separate thread.  Only used to measure latency and wake the poller, the release itself
+        # is detected by polling (see above)
+        self.release_tstamp = time.monotonic()
+        scheduler.wake()
 
     def poll(self):
         # Grab press event if any
@@ -83,15 +95,20 @@ class GpioSwitch(controller.Controller):
         # check the GPIO input
         if time_pressed > self.long_press_threshold:
             state = switchstate.Value.LONGPRESSED
+            edge = self.cur_tstamp + self.long_press_threshold
         elif not self.button.is_pressed:
             state = switchstate.Value.RELEASED
+            edge = self.release_tstamp if self.release_tstamp is not None else time.monotonic()
         else:
             return
         self.cur_tstamp = None
+        self.release_tstamp = None
 
+        latency.input_edge(edge)
         if state == switchstate.Value.LONGPRESSED and self.longpress_callback is not None:
             logging.debug("GPIO Switch %d %s %s" % (self.gpio_input, state, self.longpress_callback))
             self.longpress_callback(state)
         else:
             logging.debug("GPIO Switch %d %s %s" % (self.gpio_input, state, self.callback))
-            self.callback(state)
\ No newline at end of file
+            self.callback(state)
+        latency.input_done()
\ No newline at end of file
@@ -13,6 +13,8 @@
 # You should have received a copy of the GNU General Public License
 # along with pi-stomp.  If not, see <https://www.gnu.org/licenses/>.
 
+import contextlib
+
 
 class Handler:
 
@@ -66,6 +68,22 @@ class Handler:
     def cleanup(self):
         raise NotImplementedError()
 
+    def get_stats(self):
+        # Dictionary of handler specific stats, included in the main loop stats dump
+        return {}
+
+    def frame(self):
+        # Context manager around one pass of the main loop, LCD updates made during it are drawn together at the end
+        return contextlib.nullcontext()
+
+    def parameter_feedback(self, parameter):
+        # A parameter value was changed by MIDI input (see midiinput.py)
+        pass
+
+    def program_change(self, program):
+        # A program change was received on the pi-Stomp MIDI channel (see midiinput.py)
+        pass
+
     def get_num_footswitches(self):
         raise NotImplementedError()
 
@@ -20,8 +20,11 @@ import sys
 
 import common.token as Token
 import common.util as Util
+import pistomp.adcscanner as AdcScanner
 import pistomp.analogmidicontrol as AnalogMidiControl
+import pistomp.encodermidicontrol as EncoderMidiControl
 import pistomp.footswitch as Footswitch
+import pistomp.midimessage as MidiMessage
 import pistomp.taptempo as taptempo
 
 from abc import abstractmethod
@@ -33,8 +36,10 @@ class Hardware:
         logging.info("Init hardware: " + type(self).__name__)
         self.handler = handler
         self.midiout = midiout
+        self.midiin = None
         self.refresh_callback = refresh_callback
         self.spi = None
+        self.adc = None
         self.test_pass = False
         self.test_sentinel = None
 
@@ -66,27 +71,44 @@ class Hardware:
     def init_spi(self):
         self.spi = spidev.SpiDev()
         self.spi.open(0, 1)  # Bus 0, CE1
-        # TODO SPI bus is shared by ADC and LCD.  Ideally, they would use the same frequency.
+        # SPI bus is shared by ADC and LCD, spibus serializes their transfers
         # MCP3008 ADC has a max of 1MHz (higher makes it loose resolution)
         # Color LCD needs to run at 24Mhz
-        # until we can get them on the same, we'll set ADC (the one set here) to be a slower multiple of the LCD
-        #self.spi.max_speed_hz = 24000000
-        #self.spi.max_speed_hz =  1000000
         self.spi.max_speed_hz = 240000
+        self.adc = AdcScanner.get_scanner(self.spi)
+        # Sample the ADC from its own thread unless the rate is 0, then the analog controls are read each poll
+        rate = Util.DICT_GET(self.default_cfg[Token.HARDWARE], Token.ADC_SAMPLE_RATE)
+        self.adc.start(AdcScanner.SAMPLE_RATE if rate is None else rate)
+
+    def set_midiinput(self, midiin):
+        self.midiin = midiin
 
     def poll_controls(self):
         # This is intended to be called periodically from main working loop to poll the instantiated controls
+        # MIDI messages from the controls are sent once the poll is done (see midioutput.py)
+        with self.midiout.batch():
+            if self.midiin is not None:
+                self.midiin.apply()  # MIDI received since the last poll (see midiinput.py)
+            if self.adc is not None:
+                self.adc.scan()  # all ADC channels in one go (unless the sampling thread is doing this)
+            for c in self.analog_controls:
+                c.refresh()
+            for e in self.encoders:
+                e.read_rotary()
+            for es in self.encoder_switches:
+                es.poll()
+            s = None
+            for s in self.footswitches:
+                s.poll()
+            if s:
+                s.check_longpress_events()
+
+    def get_stats(self):
+        analog = {}
         for c in self.analog_controls:
-            c.refresh()
-        for e in self.encoders:
-            e.read_rotary()
-        for es in self.encoder_switches:
-            es.poll()
-        s = None
-        for s in self.footswitches:
-            s.poll()
-        if s:
-            s.check_longpress_events()
+            if isinstance(c, AnalogMidiControl.AnalogMidiControl):
+                analog["%d:%d" % (c.midi_channel, c.midi_CC)] = c.get_stats()
+        return {'analog_midi_controls': analog}
 
     def poll_indicators(self):
         for i in self.indicators:
@@ -104,6 +126,10 @@ class Hardware:
         # reinit hardware as specified by the new cfg context (after pedalboard change, etc.)
         self.cfg = self.default_cfg.copy()
 
+        # A held MSB belongs to the old bindings
+        if self.midiin is not None:
+            self.midiin.reset_msb()
+
         self.__init_midi_default()
 
         # Global footswitch init (callbacks and groups)
@@ -135,7 +161,9 @@ class Hardware:
 
     @abstractmethod
     def cleanup(self):
-        pass
+        # Subclasses should call this to stop the ADC sampling thread
+        if self.adc is not None:
+            self.adc.stop()
 
     @abstractmethod
     def test(self):
@@ -247,7 +275,10 @@ class Hardware:
                 logging.error("Config file error.  Analog control specified without %s" % Token.MIDI_CC)
                 continue
             if threshold is None:
-                threshold = 16  # Default, 1024 is full scale
+                if Util.DICT_GET(c, Token.SMOOTHING) == 'none':
+                    threshold = 16  # Unfiltered, the old default dead band (1024 is full scale)
+                else:
+                    threshold = 0  # No dead band, the filter (see analogfilter.py) takes care of jitter
 
             control = AnalogMidiControl.AnalogMidiControl(self.spi, adc_input, threshold, midi_cc, midi_channel,
                                                           self.midiout, control_type, id, c)
@@ -283,6 +314,9 @@ class Hardware:
 
             control = self.add_encoder(id, type, None, longpress_callback, midi_channel, midi_cc)
             self.encoders.append(control)
+            if isinstance(control, EncoderMidiControl.EncoderMidiControl) and \
+                    (Token.RESOLUTION in c or Token.NRPN in c):
+                control.set_resolution(MidiMessage.Resolution(c, midi_cc))
 
             if midi_cc is not None:
                 key = format("%d:%d" % (midi_channel, midi_cc))
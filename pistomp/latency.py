@@ -0,0 +1,106 @@
+# This file is part of pi-stomp.
+#
+# pi-stomp is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pi-stomp is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pi-stomp.  If not, see <https://www.gnu.org/licenses/>.
+
+import bisect
+import logging
+import time
+
+# Latency histograms with power of 2 millisecond buckets (fixed memory, cheap enough to update on every event)
+#
+# Input edge to MIDI send latency is tracked here too.  The control which detected an input (GPIO) edge calls
+# input_edge() with the edge timestamp before calling its callback, whatever sends the resulting MIDI message calls
+# midi_sent(), then the control calls input_done().  All of these are called from the main loop thread.
+# midi_sent() is called when the message is submitted to the MIDI output (see midioutput.py), which keeps its own
+# histogram of the time from submit to the port.
+
+BUCKETS_MS = [0.125, 0.25, 0.5, 1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024]
+
+
+class Histogram:
+
+    def __init__(self, name):
+        self.name = name
+        self.counts = [0] * (len(BUCKETS_MS) + 1)  # last is overflow
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        ms = seconds * 1000
+        self.counts[bisect.bisect_left(BUCKETS_MS, ms)] += 1
+        self.count += 1
+        self.total += ms
+        if ms > self.max:
+            self.max = ms
+
+    def reset(self):
+        self.counts = [0] * (len(BUCKETS_MS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def percentile(self, pct):
+        # Upper bound (ms) of the bucket containing the percentile
+        if self.count == 0:
+            return 0.0
+        target = self.count * pct / 100
+        running = 0
+        for i, c in enumerate(self.counts):
+            running += c
+            if running >= target:
+                return BUCKETS_MS[i] if i < len(BUCKETS_MS) else self.max
+        return self.max
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'avg_ms': (self.total / self.count) if self.count else 0.0,
+            'p50_ms': self.percentile(50),
+            'p99_ms': self.percentile(99),
+            'max_ms': self.max,
+            'buckets': {("<=%g" % b if i < len(BUCKETS_MS) else ">%g" % BUCKETS_MS[-1]): c
+                        for i, (b, c) in enumerate(zip(BUCKETS_MS + [BUCKETS_MS[-1]], self.counts)) if c > 0}
+        }
+
+    def log(self):
+        if self.count == 0:
+            logging.info("%s: no samples" % self.name)
+            return
+        d = self.to_dict()
+        logging.info("%s (ms): count %d, avg %.2f, p50 <=%g, p99 <=%g, max %.2f" %
+                     (self.name, d['count'], d['avg_ms'], d['p50_ms'], d['p99_ms'], d['max_ms']))
+        logging.info("  %s" % "  ".join("%s: %d" % (k, v) for k, v in d['buckets'].items()))
+
+
+edge_to_midi = Histogram("Input edge to MIDI send")
+_edge_time = None
+
+
+def input_edge(timestamp):
+    global _edge_time
+    _edge_time = timestamp
+
+
+def input_done():
+    global _edge_time
+    _edge_time = None
+
+
+def midi_sent():
+    # Record the latency for the current input edge (only the first message sent for an edge counts)
+    global _edge_time
+    if _edge_time is not None:
+        edge_to_midi.add(time.monotonic() - _edge_time)
+        _edge_time = None
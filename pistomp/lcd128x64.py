@@ -16,7 +16,9 @@
 from abc import ABC, abstractmethod
 import common.token as Token
 import common.util as util
+import numpy as np
 import os
+import pistomp.pageblit as PageBlit
 from board import SCL, SDA
 import busio
 from PIL import Image, ImageDraw, ImageFont
@@ -106,10 +108,13 @@ class Lcd(ABC):
 
 
     def splash_show(self, boot=True):
-        for x in range(0, self.width):
-            for y in range(0, self.height):
-                pixel = self.splash.getpixel((x, y))
-                lcd.pixel(self.width - x - 1, self.height - y, pixel)
+        self.show_bits(PageBlit.to_bits(self.splash), 0)
+
+    def show_bits(self, bits, y_offset):
+        # Shows bits (rows of the image) y_offset rows from the top, in one go rather than pixel() for each pixel at
+        # (width - x - 1, height - y - y_offset).  With lcd.rotation = 2 that's (x, y + y_offset - 1), so the image
+        # isn't flipped and its top row is clipped for the first zone
+        PageBlit.blit(lcd.buf, self.width, self.height, bits, 0, y_offset - 1)
         lcd.show()
 
     def erase_zone(self, zone_idx):
@@ -124,26 +129,20 @@ class Lcd(ABC):
         for i in range(zone_idx):
             y_offset += self.zone_height[i]
 
-        # Set Pixels
-        # TODO make common method
-        for x in range(0, self.width):
-            for y in range(0, self.zone_height[zone_idx]):
-                pixel = flipped.getpixel((x, y))
-                lcd.pixel(self.width - x - 1, self.height - y - y_offset, pixel)
-        lcd.show()
+        self.show_bits(PageBlit.to_bits(flipped), y_offset)
 
     def refresh_menu(self, highlight_range=None, scroll_offset=0):
-        # Set Pixels
         y_offset = self.zone_height[0]
-        for x in range(0, self.width):
-            for y in range(0, self.menu_height):
-                y_draw = y + scroll_offset
-                if y_draw < self.menu_image_height:
-                    pixel = self.menu_image.getpixel((x, y_draw))
-                    if highlight_range and (y_draw >= highlight_range[0]) and (y_draw <= highlight_range[1]):  # TODO LAME
-                         pixel = not pixel
-                    lcd.pixel(self.width - x - 1, self.height - y - y_offset, pixel)
-        lcd.show()
+        end = min(scroll_offset + self.menu_height, self.menu_image_height)
+        if end <= scroll_offset:
+            return
+        pixels = np.asarray(self.menu_image.crop((0, scroll_offset, self.width, end)))
+        bits = (pixels != 0).astype(np.uint8)
+        if highlight_range:  # TODO LAME
+            h0 = max(highlight_range[0] - scroll_offset, 0)
+            h1 = max(highlight_range[1] + 1 - scroll_offset, h0)
+            bits[h0:h1] = (pixels[h0:h1] == 0)
+        self.show_bits(bits, y_offset)
 
     def refresh_plugins(self):
         self.refresh_zone(2)
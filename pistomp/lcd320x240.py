@@ -21,11 +21,13 @@ import common.token as Token
 import modalapi.parameter as Parameter
 import pistomp.category as Category
 import pistomp.lcd as abstract_lcd
+import pistomp.spibus as SpiBus
 import pistomp.switchstate as switchstate
 from PIL import ImageColor
 
 from uilib import *
 from uilib.lcd_ili9341 import *
+from uilib.lcd_framebuffer import LcdFramebuffer
 
 from pistomp.footswitch import Footswitch  # TODO would like to avoid this module knowing such details
 
@@ -33,7 +35,7 @@ from pistomp.footswitch import Footswitch  # TODO would like to avoid this modul
 
 class Lcd(abstract_lcd.Lcd):
 
-    def __init__(self, cwd, handler=None, flip=False):
+    def __init__(self, cwd, handler=None, flip=False, framebuffer=None):
         self.cwd = cwd
         self.imagedir = os.path.join(cwd, "images")
         Config(os.path.join(cwd, 'ui', 'config.json'))
@@ -41,12 +43,17 @@ class Lcd(abstract_lcd.Lcd):
         self.flip = flip
 
         # TODO would be good to decouple the actual LCD hardware.  This file should work for any 320x240 display
-        display = LcdIli9341(board.SPI(),
-                             digitalio.DigitalInOut(board.CE0),
-                             digitalio.DigitalInOut(board.D6),
-                             digitalio.DigitalInOut(board.D5),
-                             24000000,
-                             flip)
+        # framebuffer (eg. /dev/fb1) draws through a kernel display driver instead of over SPI from here
+        if framebuffer:
+            display = LcdFramebuffer(framebuffer, flip=flip)
+        else:
+            display = LcdIli9341(board.SPI(),
+                                 digitalio.DigitalInOut(board.CE0),
+                                 digitalio.DigitalInOut(board.D6),
+                                 digitalio.DigitalInOut(board.D5),
+                                 24000000,
+                                 flip,
+                                 SpiBus.get_bus())
 
         # Colors
         self.background = (0, 0, 0)
@@ -167,6 +174,14 @@ class Lcd(abstract_lcd.Lcd):
     def poll_updates(self):
         self.pstack.poll_updates()
 
+    def frame(self):
+        return self.pstack.frame()
+
+    def get_stats(self):
+        stats = self.pstack.get_stats()
+        stats['display'] = self.pstack.lcd.get_stats()
+        return stats
+
     #
     # Toolbar
     #
@@ -369,6 +384,8 @@ class Lcd(abstract_lcd.Lcd):
 
 
     def color_plugin(self, widget, plugin):
+        # Returns True if the colors changed
+        before = (widget.outline, widget.outline_color, widget.bkgnd_color, widget.fgnd_color)
         color = self.get_plugin_color(plugin)
         if plugin.is_bypassed() == True:
             widget.set_outline(1, color)
@@ -378,16 +395,24 @@ class Lcd(abstract_lcd.Lcd):
             widget.set_outline(2, self.background)
             widget.set_background(color)
             widget.set_foreground(self.background)
+        return before != (widget.outline, widget.outline_color, widget.bkgnd_color, widget.fgnd_color)
 
     def refresh_plugins(self):
+        # Only the plugins whose colors changed are redrawn
         for w in self.w_plugins:
             plugin = w.object
-            self.color_plugin(w, plugin)
-        self.main_panel.refresh()
+            if self.color_plugin(w, plugin):
+                w.refresh()
 
     def toggle_plugin(self, widget, plugin):
         self.color_plugin(widget, plugin)
-        self.main_panel.refresh()
+        widget.refresh()
+
+    def update_plugin(self, plugin):
+        for w in self.w_plugins:
+            if w.object is plugin:
+                self.toggle_plugin(w, plugin)
+                break
 
     # Try to map color to a valid displayable color, if not use foreground
     def valid_color(self, color):
@@ -459,6 +484,12 @@ class Lcd(abstract_lcd.Lcd):
         # (parameter_object, value)
         self.parameter_commit(param_value_tuple[0], param_value_tuple[1])
 
+    def update_parameter(self, parameter):
+        # The value changed elsewhere (eg. MIDI input), update its dialog if it's showing
+        d = util.DICT_GET(self.w_parameter_dialogs, parameter.name)
+        if isinstance(d, Parameterdialog) and d.parent is not None:
+            d.set_value(parameter.value)
+
     #
     # Footswitches
     #
@@ -506,8 +537,8 @@ class Lcd(abstract_lcd.Lcd):
                 if label:
                     wfs.label = label
                 break
-        self.footswitch_panel.refresh()
-        self.refresh_plugins()  # TODO maybe not the most efficient, does exhibit some lag time
+        self.footswitch_panel.refresh()  # the label is drawn outside of the widget's box
+        self.refresh_plugins()
 
     def update_footswitches(self):
         for fs in self.footswitches:
@@ -620,6 +651,8 @@ class Lcd(abstract_lcd.Lcd):
         self.w_splash.set_foreground(self.color_splash_down)
         self.splash_panel.refresh()
         self.pstack.pop_panel(self.main_panel)
+        self.pstack.poll_updates()
+        self.pstack.lcd.close()  # after sending what's left
     
     def clear(self):
         pass
@@ -747,6 +780,7 @@ class Lcd(abstract_lcd.Lcd):
             self.w_info_msg.set_text(text)
         if refresh:
             self.main_panel.refresh()
+        self.pstack.flush()  # show it now, it often comes before something slow
 
     # Plugins
     
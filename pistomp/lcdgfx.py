@@ -15,8 +15,10 @@
 
 import common.token as Token
 import common.util as util
+import numpy as np
 import os
 import pistomp.lcd as abstract_lcd
+import pistomp.pageblit as PageBlit
 
 from gfxhat import touch, lcd, backlight, fonts
 from PIL import Image, ImageFont, ImageDraw
@@ -122,10 +124,14 @@ class Lcd(abstract_lcd.Lcd):
         pass
 
     def splash_show(self, boot=True):
-        for x in range(0, self.width):
-            for y in range(0, self.height):
-                pixel = self.splash.getpixel((x, y))
-                lcd.set_pixel(self.width - x - 1, self.height - y, pixel)
+        self.show_bits(PageBlit.to_bits(self.splash, odd=True), 0)
+
+    def show_bits(self, bits, y_offset):
+        # Shows bits (rows of the image) y_offset rows from the top, in one go rather than set_pixel() for each pixel
+        # at (width - x - 1, height - y - y_offset), ie. rotated 180 degrees
+        width, height = lcd.dimensions()
+        rows = bits.shape[0]
+        PageBlit.blit(lcd.st7567.buf, width, height, bits[::-1, ::-1], 0, self.height - y_offset - rows + 1)
         lcd.show()
 
     def erase_zone(self, zone_idx):
@@ -140,26 +146,20 @@ class Lcd(abstract_lcd.Lcd):
         for i in range(zone_idx):
             y_offset += self.zone_height[i]
 
-        # Set Pixels
-        # TODO make common method
-        for x in range(0, self.width):
-            for y in range(0, self.zone_height[zone_idx]):
-                pixel = flipped.getpixel((x, y))
-                lcd.set_pixel(self.width - x - 1, self.height - y - y_offset, pixel)
-        lcd.show()
+        self.show_bits(PageBlit.to_bits(flipped, odd=True), y_offset)
 
     def refresh_menu(self, highlight_range=None, scroll_offset=0):
-        # Set Pixels
         y_offset = self.zone_height[0]
-        for x in range(0, self.width):
-            for y in range(0, self.menu_height):
-                y_draw = y + scroll_offset
-                if y_draw < self.menu_image_height:
-                    pixel = self.menu_image.getpixel((x, y_draw))
-                    if highlight_range and (y_draw >= highlight_range[0]) and (y_draw <= highlight_range[1]):  # TODO LAME
-                         pixel = not pixel
-                    lcd.set_pixel(self.width - x - 1, self.height - y - y_offset, pixel)
-        lcd.show()
+        end = min(scroll_offset + self.menu_height, self.menu_image_height)
+        if end <= scroll_offset:
+            return
+        pixels = np.asarray(self.menu_image.crop((0, scroll_offset, self.width, end)))
+        bits = pixels & 1
+        if highlight_range:  # TODO LAME
+            h0 = max(highlight_range[0] - scroll_offset, 0)
+            h1 = max(highlight_range[1] + 1 - scroll_offset, h0)
+            bits[h0:h1] = (pixels[h0:h1] == 0)
+        self.show_bits(bits, y_offset)
 
     def refresh_plugins(self):
         self.refresh_zone(2)
@@ -20,8 +20,10 @@ import adafruit_rgb_display.ili9341 as ili9341
 import common.token as Token
 import os
 import pistomp.lcdcolor as lcdcolor
+import pistomp.spibus as SpiBus
 import pistomp.tool as Tool
-import time
+import uilib.framebuffer as Framebuffer
+import uilib.renderthread as RenderThread
 
 # The code in this file should generally be specific to initializing a specific display and rendering (and refreshing)
 # Most draw methods should be implemented in the parent class unless that needs to be overriden for this display
@@ -39,14 +41,22 @@ class Lcd(lcdcolor.Lcdcolor):
         self.reset_pin = digitalio.DigitalInOut(board.D5)
 
         # Config for display baudrate (default max is 24mhz)
-        # Should agree with the SPI rate used in hardware.py for the ADC
+        # The ADC on the same bus runs at its own rate (see spibus.py)
         self.baudrate = 24000000
+        self.bus = SpiBus.get_bus()
+        self.device = self.bus.add_device("lcd", self.baudrate)
 
         # Init SPI and display
         self.spi = None
         self.disp = None
         self.init_spi_display()
 
+        # What's on the glass, in the display's orientation, so only changes are sent.  The render thread owns the
+        # display, render_image() only queues the image for it
+        self.framebuffer = Framebuffer.Framebuffer(self.disp.width, self.disp.height)
+        self.renderer = RenderThread.RenderThread(self.framebuffer, self.send_block)
+        self.clear()  # the framebuffer starts black, the glass has to match
+
         # Fonts
         self.title_font = ImageFont.truetype("DejaVuSans-Bold.ttf", 26)
         self.splash_font = ImageFont.truetype('DejaVuSans.ttf', 48)
@@ -133,7 +143,6 @@ class Lcd(lcdcolor.Lcdcolor):
         self.splash_image = Image.new('RGB', (self.width, 60))
         self.splash_draw = ImageDraw.Draw(self.splash_image)
 
-        self.lock = False
         self.supports_toolbar = True
         self.check_vars_set()
         self.splash_show()
@@ -161,27 +170,21 @@ class Lcd(lcdcolor.Lcdcolor):
         self.refresh_zone(self.ZONE_PLUGINS3)
         #self.refresh_zone(7)
 
-    def wait_lock(self, period, max):
-        # wait for max number of periods (in seconds)
-        count = 0
-        while self.lock and count < max:
-            time.sleep(period)
-            count += 1
-
     def render_image(self, image, y0, x0=0):
         # ONLY THIS METHOD SHOULD BE USED TO PRINT AN IMAGE TO THE DISPLAY
         # TODO check and possibly transform image to assure that it will fit the display without an error
 
-        # Wait if a lock is present (to avoid multiple async refreshes accessing the SPI simultaneously
-        # If the LCD clears out during certain events, might need to increase the max wait
-        self.wait_lock(0.005, 10)
-        self.lock = True
-
         # Since rotating 270 or 90, x becomes y, y becomes x
-        self.disp.image(image, 270 if self.flip else 90, x=y0, y=x0)
+        # Converted here (so later drawing on image doesn't matter), sent by the render thread
+        self.renderer.submit(Framebuffer.to_rgb565(image, 270 if self.flip else 90), y0, x0)
 
-        # unlock so the next refresh can happen
-        self.lock = False
+    def send_block(self, x, y, block):
+        # Render thread.  Only the blocks which changed are sent (see uilib/framebuffer.py), in chunks of rows, one
+        # bus transaction each, so the ADC can be read in between
+        rows = self.bus.chunk_rows(self.device, block.shape[1] * 2)  # 2 bytes (RGB565) per pixel
+        for r in range(0, block.shape[0], rows):
+            with self.bus.transaction(self.device):
+                Framebuffer.send(self.disp, x, y + r, block[r:r + rows])
 
     def refresh_zone(self, zone_idx):
         self.render_image(self.images[zone_idx], self.zone_y[zone_idx])
@@ -311,7 +314,12 @@ class Lcd(lcdcolor.Lcdcolor):
 
     def cleanup(self):
         self.clear()
+        self.renderer.stop()
 
     def clear(self):
-        self.disp.fill(0)
+        self.renderer.fill(0, self.fill_black)
+
+    def fill_black(self):
+        with self.bus.transaction(self.device):
+            self.disp.fill(0)
 
@@ -0,0 +1,304 @@
+# This file is part of pi-stomp.
+#
+# pi-stomp is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pi-stomp is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pi-stomp.  If not, see <https://www.gnu.org/licenses/>.
+
+import logging
+import threading
+import time
+
+from collections import deque, OrderedDict
+
+from rtmidi.midiconstants import (CONTROL_CHANGE, PROGRAM_CHANGE, SONG_CONTINUE, SONG_START, SONG_STOP,
+                                  TIMING_CLOCK)
+
+import common.util as util
+import pistomp.latency as Latency
+import pistomp.midimessage as MidiMessage
+import pistomp.scheduler as Scheduler
+
+from pistomp.analogmidicontrol import AnalogMidiControl
+from pistomp.encodermidicontrol import EncoderMidiControl
+from pistomp.footswitch import Footswitch
+
+# MIDI input.  Messages from the host (MIDI feedback) or an external controller update the controls bound to the
+# same channel:CC (Hardware.controllers) and their parameters, so the LEDs and LCD follow changes made elsewhere
+# without polling mod-ui.
+#
+# The port's callback thread only parses and queues the messages, then wakes the main loop.  They're applied from the
+# controls task (Hardware.poll_controls) so the controls, parameters and LCD are only ever changed from the main
+# thread.  CCs are coalesced per channel:CC while they wait, so a fast sweep applies just the latest value.
+#
+#   CC      Footswitch            on (>= 64) or off, updates the LED, LCD and the bound parameter (:bypass is
+#                                 inverted, any other parameter is set to its minimum or maximum)
+#           EncoderMidiControl    sets the position (14 bit controls combine the MSB and the LSB on CC + 32)
+#           AnalogMidiControl     the parameter only, the pot position is what it is
+#   PC      on the pi-Stomp MIDI channel, the handler's program_change (eg. the snapshot changed)
+#   clock   tempo (24 clocks per beat) is set on the tap tempo, start/stop are logged
+#
+# A value the control already has is ignored, so our own messages coming back (eg. through the Midi Through port)
+# do nothing.  For a 14 bit control the MSB is held until its LSB arrives and the pair is applied together.  An MSB
+# with no LSB by the end of apply() is applied alone, unless it matches the control's current MSB (the LSB is
+# probably on its way), so an echo never truncates the value.  NRPN isn't parsed, controls configured with nrpn
+# aren't updated.
+#
+# The config (default_config.yml) setting, without it no input port is opened:
+#   hardware:
+#     midi:
+#       input_port: <port number or name>
+
+CLOCKS_PER_BEAT = 24
+CLOCK_TIMEOUT = 0.5  # seconds without a clock after which the tempo is measured afresh
+BPM_CHANGE = 0.5     # smallest tempo change applied to the tap tempo
+
+
+class MidiInput:
+
+    def __init__(self, port, hardware):
+        # port is anything with set_callback() and close_port() (an rtmidi MidiIn), or None to inject messages
+        # with receive()
+        self.port = port
+        self.hardware = hardware
+
+        self.lock = threading.Lock()
+        self.pending = OrderedDict()  # (channel, CC) to (receive time, value), or ('pc', channel)
+        self.msb = {}                 # (channel, CC) to the last MSB of a 14 bit control
+        self.msb_pending = {}         # (channel, CC) to an MSB not applied yet, waiting for its LSB
+        self.clocks = deque(maxlen=CLOCKS_PER_BEAT + 1)
+        self.bpm = None
+        self.playing = False
+
+        self.latency = Latency.Histogram("MIDI receive to apply")
+        self.received = {'cc': 0, 'pc': 0, 'clock': 0, 'other': 0}
+        self.coalesced = 0
+        self.applied = 0
+        self.unchanged = 0
+        self.unbound = 0
+
+        if port is not None:
+            port.ignore_types(sysex=True, timing=False, active_sense=True)
+            port.set_callback(self._callback)
+
+    def _callback(self, event, data=None):
+        # rtmidi callback thread
+        message, _ = event
+        self.receive(message)
+
+    def receive(self, message, now=None):
+        if now is None:
+            now = time.monotonic()
+        if len(message) == 0:
+            return
+        status = message[0]
+        if status == TIMING_CLOCK:
+            self.received['clock'] += 1
+            self._clock(now)
+            return
+        if status in (SONG_START, SONG_CONTINUE, SONG_STOP):
+            self.playing = (status != SONG_STOP)
+            self.clocks.clear()
+            logging.debug("MIDI clock %s" % ("start" if self.playing else "stop"))
+            return
+
+        kind = status & 0xF0
+        channel = status & 0x0F
+        if kind == CONTROL_CHANGE and len(message) >= 3:
+            self.received['cc'] += 1
+            self._queue((channel, message[1]), now, message[2])
+        elif kind == PROGRAM_CHANGE and len(message) >= 2:
+            self.received['pc'] += 1
+            self._queue(('pc', channel), now, message[1])
+        else:
+            self.received['other'] += 1
+
+    def _queue(self, key, now, value):
+        with self.lock:
+            if key in self.pending:
+                self.coalesced += 1
+                received, _ = self.pending[key]
+                self.pending[key] = (received, value)
+            else:
+                self.pending[key] = (now, value)
+        Scheduler.wake()
+
+    def _clock(self, now):
+        if len(self.clocks) > 0 and now - self.clocks[-1] > CLOCK_TIMEOUT:
+            self.clocks.clear()
+        self.clocks.append(now)
+        if len(self.clocks) == self.clocks.maxlen:
+            beat = self.clocks[-1] - self.clocks[0]
+            if beat > 0:
+                self.bpm = 60.0 / beat
+            self.clocks.clear()
+            self.clocks.append(now)
+            with self.lock:
+                self.pending[('clock', None)] = (now, self.bpm)
+            Scheduler.wake()
+
+    def apply(self):
+        # Main thread (controls task).  Applies everything received since the last call
+        with self.lock:
+            if len(self.pending) == 0:
+                return
+            pending = self.pending
+            self.pending = OrderedDict()
+        for key, (received, value) in pending.items():
+            if key[0] == 'clock':
+                self._apply_tempo(value)
+            elif key[0] == 'pc':
+                self._apply_program(key[1], value)
+            else:
+                self._apply_cc(key[0], key[1], value)
+            self.latency.add(time.monotonic() - received)
+
+        # MSBs without an LSB
+        for (channel, cc), msb in self.msb_pending.items():
+            controller = self.hardware.controllers.get("%d:%d" % (channel, cc))
+            if controller is None:
+                continue
+            current = self._current(controller, MidiMessage.MAX_14BIT)
+            if current is not None and current >> 7 == msb:
+                self.unchanged += 1
+                continue
+            self._set(controller, msb << 7, MidiMessage.MAX_14BIT)
+        self.msb_pending.clear()
+
+    def _apply_cc(self, channel, cc, value):
+        controller = self.hardware.controllers.get("%d:%d" % (channel, cc))
+        if controller is None and MidiMessage.LSB_OFFSET <= cc < 2 * MidiMessage.LSB_OFFSET:
+            # LSB of a 14 bit control?
+            base = cc - MidiMessage.LSB_OFFSET
+            controller = self.hardware.controllers.get("%d:%d" % (channel, base))
+            if controller is None or not self._is_high(controller):
+                self.unbound += 1
+                return
+            msb = self.msb_pending.pop((channel, base), None)
+            if msb is None:
+                msb = self.msb.get((channel, base))
+                if msb is None:
+                    return  # no MSB yet
+            self._set(controller, (msb << 7) | value, MidiMessage.MAX_14BIT)
+            return
+        if controller is None:
+            self.unbound += 1
+            return
+        if self._is_high(controller):
+            # MSB, held for the LSB which (usually) follows
+            self.msb[(channel, cc)] = value
+            self.msb_pending[(channel, cc)] = value
+        else:
+            self._set(controller, value, MidiMessage.MAX_7BIT)
+
+    def reset_msb(self):
+        # Main thread.  Called when the controls are rebound (Hardware.reinit) so an MSB received for the old binding
+        # isn't paired with the first LSB for the new one
+        self.msb.clear()
+        self.msb_pending.clear()
+
+    @staticmethod
+    def _is_high(controller):
+        resolution = getattr(controller, 'resolution', None)
+        return resolution is not None and resolution.is_high() and resolution.nrpn is None
+
+    @staticmethod
+    def _current(controller, value_max):
+        # The control's current value as a MIDI value from 0 to value_max, None if unknown
+        if isinstance(controller, EncoderMidiControl):
+            return util.renormalize(controller.midi_value, controller.midi_min, controller.midi_max, 0, value_max)
+        param = controller.parameter
+        if isinstance(controller, AnalogMidiControl) and param is not None and param.value is not None \
+                and param.minimum is not None and param.maximum is not None and param.maximum != param.minimum:
+            return round((param.value - param.minimum) * value_max / (param.maximum - param.minimum))
+        return None
+
+    def _set(self, controller, value, value_max):
+        param = controller.parameter
+        if isinstance(controller, Footswitch):
+            enabled = value > value_max // 2
+            if enabled == controller.enabled:
+                self.unchanged += 1
+                return
+            if param is not None:
+                if param.symbol == ":bypass":  # TODO token
+                    param.value = 0.0 if enabled else 1.0
+                else:
+                    # A toggle, minimum when off, maximum when on
+                    param.value = self._scale(param, value_max if enabled else 0, 0, value_max)
+            controller.set_value(0.0 if enabled else 1.0)  # LED and LCD
+
+        elif isinstance(controller, EncoderMidiControl):
+            midi_value = util.renormalize(value, 0, value_max, controller.midi_min, controller.midi_max)
+            if midi_value == controller.midi_value:
+                self.unchanged += 1
+                return
+            controller.midi_value = midi_value
+            if param is not None:
+                param.value = self._scale(param, midi_value, controller.midi_min, controller.midi_max)
+                controller.value = param.value
+                self.hardware.handler.parameter_feedback(param)
+
+        elif isinstance(controller, AnalogMidiControl):
+            if param is None:
+                self.unchanged += 1
+                return
+            param_value = self._scale(param, value, 0, value_max)
+            if param_value == param.value:
+                self.unchanged += 1
+                return
+            param.value = param_value
+            self.hardware.handler.parameter_feedback(param)
+
+        else:
+            controller.set_value(value)
+        self.applied += 1
+
+    @staticmethod
+    def _scale(param, value, value_min, value_max):
+        if param.minimum is None or param.maximum is None or value_max == value_min:
+            return param.value
+        return param.minimum + (param.maximum - param.minimum) * (value - value_min) / (value_max - value_min)
+
+    def _apply_program(self, channel, program):
+        if channel != self.hardware.midi_channel:
+            self.unbound += 1
+            return
+        self.hardware.handler.program_change(program)
+        self.applied += 1
+
+    def _apply_tempo(self, bpm):
+        taptempo = self.hardware.taptempo
+        if bpm is None or taptempo is None:
+            return
+        current = taptempo.get_bpm()
+        if current and abs(bpm - current) < BPM_CHANGE:
+            self.unchanged += 1
+            return
+        taptempo.set_bpm(round(bpm, 1))
+        self.applied += 1
+        logging.debug("MIDI clock tempo: %.1f BPM" % bpm)
+
+    def close(self):
+        if self.port is not None:
+            self.port.cancel_callback()
+            self.port.close_port()
+
+    def stats(self):
+        return {
+            'received': dict(self.received),
+            'coalesced': self.coalesced,
+            'applied': self.applied,
+            'unchanged': self.unchanged,
+            'unbound': self.unbound,
+            'bpm': self.bpm,
+            'latency': self.latency.to_dict()
+        }
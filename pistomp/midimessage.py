@@ -0,0 +1,65 @@
+# This file is part of pi-stomp.
+#
+# pi-stomp is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pi-stomp is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pi-stomp.  If not, see <https://www.gnu.org/licenses/>.
+
+import logging
+
+from rtmidi.midiconstants import CONTROL_CHANGE, DATA_ENTRY_LSB, DATA_ENTRY_MSB, NRPN_LSB, NRPN_MSB
+
+import common.token as Token
+import common.util as util
+
+# Builds the MIDI messages for a controller value at the controller's resolution.
+#
+#   7 bit     one CC message, value 0-127
+#   14 bit    MSB on the controller's CC (0-31) followed by the LSB on CC + 32, value 0-16383
+#   NRPN      parameter number select (CC 99, 98) then data entry MSB (CC 6) and, for 14 bit, LSB (CC 38)
+#
+# Controllers configured with resolution: 14 and/or nrpn: <parameter number> use the extra messages.
+
+MAX_7BIT = 127
+MAX_14BIT = 16383
+LSB_OFFSET = 32  # CC number of the LSB for a 14 bit CC pair
+
+
+class Resolution:
+
+    def __init__(self, cfg=None, midi_CC=None):
+        # cfg is the controller's entry in the config
+        self.bits = util.DICT_GET(cfg, Token.RESOLUTION) if cfg is not None else None
+        if self.bits is None:
+            self.bits = 7
+        self.nrpn = util.DICT_GET(cfg, Token.NRPN) if cfg is not None else None
+        if self.bits == 14 and self.nrpn is None and midi_CC is not None and midi_CC >= LSB_OFFSET:
+            logging.error("14 bit CC needs a %s below %d (got %d), using 7 bit" % (Token.MIDI_CC, LSB_OFFSET, midi_CC))
+            self.bits = 7
+        self.max = MAX_14BIT if self.bits == 14 else MAX_7BIT
+
+    def is_high(self):
+        return self.bits == 14
+
+    def messages(self, channel, cc, value):
+        # List of messages to send for the value (0 to self.max)
+        status = channel | CONTROL_CHANGE
+        if self.nrpn is not None:
+            msgs = [[status, NRPN_MSB, (self.nrpn >> 7) & 0x7F], [status, NRPN_LSB, self.nrpn & 0x7F]]
+            if self.bits == 14:
+                msgs.append([status, DATA_ENTRY_MSB, (value >> 7) & 0x7F])
+                msgs.append([status, DATA_ENTRY_LSB, value & 0x7F])
+            else:
+                msgs.append([status, DATA_ENTRY_MSB, value & 0x7F])
+            return msgs
+        if self.bits == 14:
+            return [[status, cc, (value >> 7) & 0x7F], [status, cc + LSB_OFFSET, value & 0x7F]]
+        return [[status, cc, value]]
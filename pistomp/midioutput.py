@@ -0,0 +1,194 @@
+# This file is part of pi-stomp.
+#
+# pi-stomp is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pi-stomp is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pi-stomp.  If not, see <https://www.gnu.org/licenses/>.
+
+import logging
+import threading
+import time
+
+from collections import OrderedDict
+
+import common.token as Token
+import common.util as util
+import pistomp.latency as Latency
+
+# MIDI output service.  All of the controllers (footswitches, encoders, analog controls) submit their messages here
+# instead of calling the port directly, and a sender thread writes them to the port, so the main loop never waits
+# on MIDI I/O.
+#
+#   send(messages, key)   a group of messages (eg. a 14 bit CC pair or an NRPN sequence) which is sent together.
+#                         If a group with the same key (eg. (channel, CC)) is still waiting to be sent it's replaced,
+#                         keeping its place in the queue, so a fast pot sweep sends the latest value rather than
+#                         every value in between
+#   send_message(msg)     a single message which is always sent (eg. a footswitch toggle)
+#
+# The main loop polls the controls inside batch(), messages submitted during the poll are sent when it's done, so
+# several updates to the same control in one cycle go out as one.
+#
+# The sender writes at most max_rate messages per second to the port (a short burst is allowed) so the ALSA sequencer
+# isn't saturated.  The time from submit to write is kept in a histogram.
+#
+# The port is anything with send_message() and close_port() (an rtmidi MidiOut), MemorySink keeps the messages in a
+# list instead, for tests.
+#
+# The config (default_config.yml) setting:
+#   hardware:
+#     midi:
+#       max_rate: <messages per second>
+
+MAX_RATE = 1000  # messages per second, default
+BURST = 32       # messages which can be sent back to back before the rate limit applies
+
+
+class MemorySink:
+
+    def __init__(self):
+        self.messages = []  # (time, message)
+        self.lock = threading.Lock()
+
+    def send_message(self, message):
+        with self.lock:
+            self.messages.append((time.monotonic(), list(message)))
+
+    def close_port(self):
+        pass
+
+
+class Batch:
+
+    def __init__(self, output):
+        self.output = output
+
+    def __enter__(self):
+        with self.output.cond:
+            self.output.batching += 1
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        with self.output.cond:
+            self.output.batching -= 1
+            self.output.cond.notify()
+        return False
+
+
+class MidiOutput:
+
+    def __init__(self, port, cfg=None):
+        self.port = port
+        hw_cfg = util.DICT_GET(cfg, Token.HARDWARE) if cfg is not None else None
+        midi_cfg = util.DICT_GET(hw_cfg, Token.MIDI) if hw_cfg is not None else None
+        max_rate = util.DICT_GET(midi_cfg, Token.MAX_RATE) if midi_cfg is not None else None
+        self.max_rate = max_rate if max_rate else MAX_RATE
+
+        self.cond = threading.Condition()
+        self.pending = OrderedDict()  # key to (submit time, messages)
+        self.seq = 0                  # for the unique keys of messages which aren't coalesced
+        self.running = True
+        self.batching = 0
+        self.in_flight = False
+        self.tokens = BURST
+
+        self.latency = Latency.Histogram("MIDI submit to send")
+        self.submitted = 0
+        self.coalesced = 0
+        self.sent = 0
+        self.throttled = 0  # times the sender waited for the rate limit
+        self.errors = 0
+
+        self.thread = threading.Thread(target=self._sender, daemon=True)
+        self.thread.start()
+
+    def send(self, messages, key=None):
+        now = time.monotonic()
+        with self.cond:
+            if key is None:
+                self.seq += 1
+                key = (None, self.seq)
+            elif key in self.pending:
+                self.coalesced += 1
+                submitted, _ = self.pending[key]
+                self.pending[key] = (submitted, messages)  # keep the earlier time, that's how long it's waited
+                return
+            self.pending[key] = (now, messages)
+            self.submitted += 1
+            if not self.batching:
+                self.cond.notify()
+
+    def batch(self):
+        return Batch(self)
+
+    def send_message(self, message):
+        self.send([message])
+
+    def _sender(self):
+        last = time.monotonic()
+        while True:
+            with self.cond:
+                while self.running and (len(self.pending) == 0 or self.batching):
+                    self.cond.wait()
+                if len(self.pending) == 0:
+                    return
+                _, (submitted, messages) = self.pending.popitem(last=False)
+                self.in_flight = True
+
+            # Rate limit (token bucket)
+            now = time.monotonic()
+            self.tokens = min(BURST, self.tokens + (now - last) * self.max_rate)
+            last = now
+            if self.tokens < len(messages):
+                self.throttled += 1
+                time.sleep((len(messages) - self.tokens) / self.max_rate)
+                now = time.monotonic()
+                self.tokens = min(BURST, self.tokens + (now - last) * self.max_rate)
+                last = now
+            self.tokens -= len(messages)
+
+            for m in messages:
+                try:
+                    self.port.send_message(m)
+                    self.sent += 1
+                except Exception as e:
+                    self.errors += 1
+                    logging.error("MIDI send failed %s: %s" % (m, str(e)))
+            self.latency.add(time.monotonic() - submitted)
+            self.in_flight = False
+
+    def wait_idle(self, timeout=1.0):
+        # Wait until everything submitted has been sent (for tests)
+        deadline = time.monotonic() + timeout
+        while (len(self.pending) > 0 or self.in_flight) and time.monotonic() < deadline:
+            time.sleep(0.001)
+
+    def close(self):
+        # Send whatever is pending, then close the port
+        with self.cond:
+            self.running = False
+            self.cond.notify()
+        self.thread.join(1.0)
+        self.port.close_port()
+
+    def close_port(self):
+        self.close()
+
+    def stats(self):
+        return {
+            'max_rate': self.max_rate,
+            'submitted': self.submitted,
+            'coalesced': self.coalesced,
+            'sent': self.sent,
+            'throttled': self.throttled,
+            'errors': self.errors,
+            'pending': len(self.pending),
+            'latency': self.latency.to_dict()
+        }
@@ -0,0 +1,60 @@
+# This file is part of pi-stomp.
+#
+# pi-stomp is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pi-stomp is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pi-stomp.  If not, see <https://www.gnu.org/licenses/>.
+
+import numpy as np
+
+# Bulk copy of images to the buffers of monochrome display controllers (SSD1306, ST7567) which use the page format:
+# each byte holds 8 vertical pixels (the top one in the least significant bit) and a page of 8 rows is width bytes.
+#
+# Instead of a set_pixel() call per pixel, the image is converted to an array of bits with to_bits(), flipped or
+# rotated as the display needs with NumPy slicing (eg. bits[::-1, ::-1] for 180 degrees), then blit() packs the rows
+# into the pages it covers and writes them to the driver's buffer in one go.  The display's show() sends the buffer
+# as before.
+
+
+def to_bits(image, odd=False):
+    # 0/1 array (rows of pixels) of an 'L' or '1' image.  A pixel is on if it's not 0, or with odd if its value is
+    # odd (as gfxhat's set_pixel)
+    a = np.asarray(image)
+    if odd:
+        return (a & 1).astype(np.uint8)
+    return (a != 0).astype(np.uint8)
+
+
+def blit(buf, width, height, bits, x, y):
+    # Writes bits with its top left pixel at x, y into buf (a bytearray, memoryview or list of page bytes of a
+    # width x height display).  What's outside of the display is clipped
+    h, w = bits.shape
+    x0 = max(x, 0)
+    y0 = max(y, 0)
+    x1 = min(x + w, width)
+    y1 = min(y + h, height)
+    if x1 <= x0 or y1 <= y0:
+        return
+    bits = bits[y0 - y:y1 - y, x0 - x:x1 - x]
+
+    # Read the pages covered, unpack, replace the pixels, pack and write them back
+    p0 = y0 // 8
+    p1 = (y1 + 7) // 8
+    start = p0 * width
+    end = p1 * width
+    pages = np.array(buf[start:end], dtype=np.uint8).reshape(p1 - p0, 1, width)
+    rows = np.unpackbits(pages, axis=1, bitorder='little').reshape((p1 - p0) * 8, width)
+    rows[y0 - p0 * 8:y1 - p0 * 8, x0:x1] = bits
+    packed = np.packbits(rows.reshape(p1 - p0, 8, width), axis=1, bitorder='little').reshape(-1)
+    if isinstance(buf, list):
+        buf[start:end] = packed.tolist()
+    else:
+        buf[start:end] = packed.tobytes()
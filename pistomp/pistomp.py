@@ -141,7 +141,7 @@ class Pistomp(hardware.Hardware):
         self.relay = Relay.Relay(RELAY_SET_PIN, RELAY_RESET_PIN)
 
     def cleanup(self):
-        pass
+        super().cleanup()
 
     # Test procedure for verifying hardware controls
     def test(self):
@@ -21,6 +21,8 @@
 #
 # A new version with different controls should have a new separate subclass
 
+import common.token as Token
+import common.util as Util
 import pistomp.encoder as Encoder
 import pistomp.gpioswitch as gpioswitch
 import pistomp.hardware as hardware
@@ -73,7 +75,8 @@ class Pistompcore(hardware.Hardware):
         #self.reinit(None)
 
     def init_lcd(self):
-        self.mod.add_lcd(Lcd.Lcd(self.mod.homedir, self.mod, flip=True))
+        framebuffer = Util.DICT_GET(self.default_cfg[Token.HARDWARE], Token.FRAMEBUFFER)
+        self.mod.add_lcd(Lcd.Lcd(self.mod.homedir, self.mod, flip=True, framebuffer=framebuffer))
 
     def init_encoders(self):
         top_enc = Encoder.Encoder(TOP_ENC_PIN_D, TOP_ENC_PIN_CLK, callback=self.mod.universal_encoder_select)
@@ -97,4 +100,4 @@ class Pistompcore(hardware.Hardware):
             self.create_footswitches(cfg)
 
     def cleanup(self):
-        pass
+        super().cleanup()
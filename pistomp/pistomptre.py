@@ -24,6 +24,7 @@ import pistomp.encodermidicontrol as EncoderMidiControl
 import pistomp.gpioswitch as gpioswitch
 import pistomp.hardware as hardware
 import pistomp.ledstrip as Ledstrip
+import pistomp.vumeter as VuMeter
 
 #import pistomp.lcdili9341 as Lcd   # pistompcore UI
 import pistomp.lcd320x240 as Lcd   # Tre UI
@@ -88,7 +89,8 @@ class Pistomptre(hardware.Hardware):
         #self.reinit(None)  # TODO do we still need this?  Maybe after pb load?  mappings?
 
     def init_lcd(self):
-        self.handler.add_lcd(Lcd.Lcd(self.handler.homedir, self.handler, flip=False))
+        framebuffer = Util.DICT_GET(self.default_cfg[Token.HARDWARE], Token.FRAMEBUFFER)
+        self.handler.add_lcd(Lcd.Lcd(self.handler.homedir, self.handler, flip=False, framebuffer=framebuffer))
 
     def add_encoder(self, id, type, callback, longpress_callback, midi_channel, midi_cc):
         enc_pins = Util.DICT_GET(ENC, id)
@@ -156,14 +158,16 @@ class Pistomptre(hardware.Hardware):
         adc_baseline = self.handler.settings.get_setting('analogVU.adc_baseline')
         if adc_baseline is None:
             adc_baseline = 512
-        indicator = AnalogVU.AnalogVU(self.spi, CLIP_L, 4, self.ledstrip, 5, input_gain, adc_baseline)
+        meter = VuMeter.VuMeter(self.default_cfg[Token.HARDWARE], input_gain, adc_baseline)
+        indicator = AnalogVU.AnalogVU(self.spi, CLIP_L, 4, self.ledstrip, 5, meter, Token.LEFT_CHANNEL)
         self.indicators.append(indicator)
-        indicator = AnalogVU.AnalogVU(self.spi, CLIP_R, 4, self.ledstrip, 4, input_gain, adc_baseline)
+        indicator = AnalogVU.AnalogVU(self.spi, CLIP_R, 4, self.ledstrip, 4, meter, Token.RIGHT_CHANNEL)
         self.indicators.append(indicator)
 
     def cleanup(self):
         if self.ledstrip is not None:
             self.ledstrip.cleanup()
+        super().cleanup()
 
     def test(self):
         pass
@@ -0,0 +1,307 @@
+# This file is part of pi-stomp.
+#
+# pi-stomp is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pi-stomp is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pi-stomp.  If not, see <https://www.gnu.org/licenses/>.
+
+import contextlib
+import json
+import logging
+import os
+import signal
+import sys
+import threading
+import time
+
+import common.token as Token
+import common.util as util
+import pistomp.latency as Latency
+
+# The main loop.  Each task (polling controls, VU indicators, LCD updates, etc.) runs at its own rate and the
+# process sleeps until the next task is due.  GPIO inputs (footswitches, encoders) call wake() from their gpiozero
+# callback threads so the tasks added with on_wake=True run immediately instead of waiting for their next tick.
+# ADC inputs have no edge to wake on, they're sampled by their own thread (see adcscanner) and read each controls run.
+#
+# Every task run is timed into a histogram.  A run which takes longer than the task's period is an overrun, ticks
+# skipped because the loop fell behind are counted as missed.  While tracing is enabled, a watchdog thread samples
+# the main thread stack when a run overruns, so the slowest run of each task is recorded with the call (handler
+# method, etc.) it was stuck in.
+#
+# The stats are logged and written to STATS_FILE (json) on exit and whenever the process gets SIGUSR1:
+#   sudo systemctl kill -s USR1 mod-ala-pi-stomp
+# SIGUSR2 resets them.  Other modules can add their stats to the dump with add_stats().
+#
+# The config (default_config.yml) section:
+#   main_loop:
+#     rates:
+#       <task name>: <Hz>
+#     trace: <boolean>
+
+DEFAULT_RATES = {
+    Token.CONTROLS: 100,
+    Token.INDICATORS: 50,
+    Token.LCD: 5,
+    Token.MODUI: 1,
+    Token.WIFI: 1
+}
+
+STATS_FILE = '/home/pistomp/data/.main_loop_stats.json'
+TRACE_DEPTH = 6  # number of stack frames kept for a slow run
+
+_wakeup = threading.Event()
+
+
+def wake():
+    # Safe to call from any thread
+    _wakeup.set()
+
+
+class Task:
+
+    def __init__(self, name, func, rate, on_wake):
+        self.name = name
+        self.func = func
+        self.period = 1.0 / rate
+        self.on_wake = on_wake
+        self.due = 0.0
+        self.histogram = Latency.Histogram(name)
+        self.overruns = 0
+        self.missed = 0
+        self.slowest = 0.0
+        self.slowest_time = None  # wall clock time of the slowest run
+        self.slowest_trace = None
+        self.trace = None         # set by the watchdog while the current run is overrunning
+
+    def run(self, now):
+        self.trace = None
+        self.func()
+        elapsed = time.monotonic() - now
+        self.record(elapsed)
+
+        if self.due > now:
+            # Run early (woken), next run is a full period from now
+            self.due = now + self.period
+        else:
+            # Stay on the grid unless we've fallen behind, then skip the missed ticks rather than running back to back
+            self.due += self.period
+            if self.due <= now:
+                self.missed += int((now - self.due) / self.period) + 1
+                self.due = now + self.period
+
+    def record(self, elapsed):
+        self.histogram.add(elapsed)
+        if elapsed > self.period:
+            self.overruns += 1
+        if elapsed > self.slowest:
+            self.slowest = elapsed
+            self.slowest_time = time.strftime("%Y-%m-%d %H:%M:%S")
+            self.slowest_trace = self.trace if self.trace is not None else [self.func_name()]
+
+    def func_name(self):
+        return getattr(self.func, '__qualname__', str(self.func))
+
+    def reset_stats(self):
+        self.histogram.reset()
+        self.overruns = 0
+        self.missed = 0
+        self.slowest = 0.0
+        self.slowest_time = None
+        self.slowest_trace = None
+
+    def to_dict(self):
+        d = self.histogram.to_dict()
+        d.update({
+            'rate_hz': 1.0 / self.period,
+            'overruns': self.overruns,
+            'missed': self.missed,
+            'slowest_ms': self.slowest * 1000,
+            'slowest_time': self.slowest_time,
+            'slowest_trace': self.slowest_trace
+        })
+        return d
+
+
+class Watchdog:
+    # Samples the main thread's stack when the current task run goes past its period
+
+    def __init__(self):
+        self.thread_id = threading.main_thread().ident
+        self.started = threading.Event()
+        self.done = threading.Event()
+        self.lock = threading.Lock()
+        self.task = None
+        self.runs = 0  # identifies the current run, so a late sample isn't stored against the next one
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def begin(self, task):
+        with self.lock:
+            self.task = task
+            self.runs += 1
+            self.done.clear()
+        self.started.set()
+
+    def end(self):
+        with self.lock:
+            self.done.set()
+
+    def _run(self):
+        while True:
+            self.started.wait()
+            self.started.clear()
+            with self.lock:
+                task = self.task
+                run = self.runs
+            if task is None or self.done.wait(task.period):
+                continue
+            frame = sys._current_frames().get(self.thread_id)
+            trace = []
+            while frame is not None and len(trace) < TRACE_DEPTH:
+                code = frame.f_code
+                if code.co_filename != __file__:
+                    trace.append("%s (%s:%d)" % (code.co_name, os.path.basename(code.co_filename), frame.f_lineno))
+                frame = frame.f_back
+            with self.lock:
+                # Only if the run sampled is still going, otherwise the stack may be from another task
+                if self.runs == run and not self.done.is_set():
+                    task.trace = trace  # innermost call first
+
+
+class Scheduler:
+
+    def __init__(self, cfg=None):
+        self.rates = DEFAULT_RATES.copy()
+        main_cfg = util.DICT_GET(cfg, Token.MAIN_LOOP) if cfg is not None else None
+        rates = util.DICT_GET(main_cfg, Token.RATES) if main_cfg is not None else None
+        if rates is not None:
+            self.rates.update(rates)
+        trace = util.DICT_GET(main_cfg, Token.TRACE) if main_cfg is not None else None
+        self.watchdog = Watchdog() if trace is True else None
+        self.tasks = []
+        self.wakeups = 0
+        self.running = False
+        self.stats_sources = {}  # name to function returning a dictionary of stats
+        self.frame = None        # function returning a context manager around each pass (see set_frame)
+        self.dump_requested = False
+        self.reset_requested = False
+
+    def add_task(self, name, func, on_wake=False):
+        rate = util.DICT_GET(self.rates, name)
+        if not rate or rate <= 0:
+            logging.error("No rate for task %s, not scheduled" % name)
+            return None
+        task = Task(name, func, rate, on_wake)
+        task.due = time.monotonic()
+        self.tasks.append(task)
+        logging.debug("Scheduled %s at %gHz" % (name, rate))
+        return task
+
+    def run_once(self):
+        # Run each task which is due (and the on_wake tasks if woken).  Returns seconds until the next task is due
+        woken = _wakeup.is_set()
+        if woken:
+            _wakeup.clear()
+            self.wakeups += 1
+            if self.dump_requested:
+                self.dump_requested = False
+                self.dump_stats()
+            if self.reset_requested:
+                self.reset_requested = False
+                self.reset_stats()
+        now = time.monotonic()
+        due = [t for t in self.tasks if t.due <= now or (woken and t.on_wake)]
+        if len(due) > 0:
+            with self.frame() if self.frame is not None else contextlib.nullcontext():
+                for task in due:
+                    if self.watchdog is not None:
+                        self.watchdog.begin(task)
+                    task.run(now)
+                    if self.watchdog is not None:
+                        self.watchdog.end()
+                    now = time.monotonic()
+        if len(self.tasks) == 0:
+            return None
+        return max(0.0, min(t.due for t in self.tasks) - now)
+
+    def run(self):
+        self.running = True
+        while self.running:
+            delay = self.run_once()
+            if delay is None or delay > 0:
+                _wakeup.wait(delay)
+
+    def stop(self):
+        self.running = False
+        wake()
+
+    def set_frame(self, func):
+        # The tasks run in a pass of the loop are wrapped in func()'s context, eg. so the LCD updates they make are
+        # drawn once at the end of the pass
+        self.frame = func
+
+    def add_stats(self, name, func):
+        self.stats_sources[name] = func
+
+    def install_signal_handlers(self):
+        # The handlers just set a flag, the work is done by the loop between tasks
+        signal.signal(signal.SIGUSR1, self._request_dump)
+        signal.signal(signal.SIGUSR2, self._request_reset)
+
+    def _request_dump(self, signum, frame):
+        self.dump_requested = True
+        wake()
+
+    def _request_reset(self, signum, frame):
+        self.reset_requested = True
+        wake()
+
+    def stats(self):
+        stats = {
+            'time': time.strftime("%Y-%m-%d %H:%M:%S"),
+            'wakeups': self.wakeups,
+            'tasks': {t.name: t.to_dict() for t in self.tasks}
+        }
+        for name, func in self.stats_sources.items():
+            try:
+                stats[name] = func()
+            except Exception as e:
+                logging.error("Cannot get %s stats: %s" % (name, str(e)))
+        return stats
+
+    def reset_stats(self):
+        logging.info("Main loop stats reset")
+        for t in self.tasks:
+            t.reset_stats()
+        Latency.edge_to_midi.reset()
+
+    def log_stats(self):
+        logging.info("Main loop tasks (ms):")
+        logging.info("  %-12s %7s %8s %8s %8s %8s %8s %8s" %
+                     ("task", "rate", "runs", "avg", "p99", "max", "overrun", "missed"))
+        for t in self.tasks:
+            d = t.histogram.to_dict()
+            logging.info("  %-12s %7g %8d %8.2f %8g %8.2f %8d %8d" % (t.name, 1.0 / t.period, d['count'], d['avg_ms'],
+                                                                   d['p99_ms'], d['max_ms'], t.overruns, t.missed))
+        for t in self.tasks:
+            if t.slowest_trace is not None:
+                logging.info("  slowest %s %.1fms at %s: %s" % (t.name, t.slowest * 1000, t.slowest_time,
+                                                                " < ".join(t.slowest_trace)))
+        Latency.edge_to_midi.log()
+
+    def dump_stats(self, stats_file=STATS_FILE):
+        self.log_stats()
+        try:
+            with open(stats_file, 'w') as f:
+                json.dump(self.stats(), f, indent=2)
+            logging.info("Main loop stats written to %s" % stats_file)
+        except Exception as e:
+            logging.error("Cannot write stats file %s: %s" % (stats_file, str(e)))
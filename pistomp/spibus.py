@@ -0,0 +1,196 @@
+# This file is part of pi-stomp.
+#
+# pi-stomp is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pi-stomp is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pi-stomp.  If not, see <https://www.gnu.org/licenses/>.
+
+import logging
+import threading
+import time
+
+import pistomp.latency as Latency
+
+# Arbitrates SPI bus 0, which is shared by the LCD (CE0, 24MHz or more) and the MCP3008 ADC (CE1, 240kHz).
+#
+# The LCD drivers toggle their chip select with GPIO around each write, so an ADC transfer in the middle of an LCD
+# write clocks garbage into the display (and the LCD's clock rate is too fast for the ADC).  Every user of the bus
+# does its transfers inside a transaction:
+#
+#   with bus.transaction(device):
+#       ...
+#
+# Transactions are granted in the order they're requested (a ticket lock), so a device waiting on the bus gets it as
+# soon as the current transaction ends, even if the holder immediately wants it again.  The LCD drivers split large
+# updates into chunks of chunk_rows() rows, one transaction each, so a transaction never holds the bus much longer
+# than MAX_HOLD and the ADC sampling thread keeps its rate during a full screen refresh.
+#
+# A device added with a spidev handle has its clock rate set when it takes the bus from a different device (the
+# Adafruit display drivers set theirs at the start of every write).
+
+MAX_HOLD = 0.002  # seconds, target maximum transaction time
+
+_bus = None
+
+
+def get_bus():
+    global _bus
+    if _bus is None:
+        _bus = SpiBus()
+    return _bus
+
+
+class Device:
+
+    def __init__(self, name, speed_hz, spi=None):
+        self.name = name
+        self.speed_hz = speed_hz
+        self.spi = spi  # spidev handle, clock rate set by the bus
+        self.wait = Latency.Histogram("SPI %s wait" % name)
+        self.transactions = 0
+        self.busy = 0.0
+        self.longest = 0.0
+
+    def configure(self):
+        if self.spi is not None and self.speed_hz and self.spi.max_speed_hz != self.speed_hz:
+            self.spi.max_speed_hz = self.speed_hz
+
+    def reset_stats(self):
+        self.wait.reset()
+        self.transactions = 0
+        self.busy = 0.0
+        self.longest = 0.0
+
+    def to_dict(self, elapsed):
+        return {
+            'speed_hz': self.speed_hz,
+            'transactions': self.transactions,
+            'busy_pct': (100 * self.busy / elapsed) if elapsed > 0 else 0.0,
+            'longest_ms': self.longest * 1000,
+            'wait': self.wait.to_dict()
+        }
+
+
+class Transaction:
+
+    def __init__(self, bus, device):
+        self.bus = bus
+        self.device = device
+
+    def __enter__(self):
+        self.bus.acquire(self.device)
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.bus.release()
+        return False
+
+
+class SpiBus:
+
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.next_ticket = 0
+        self.serving = 0
+        self.owner = None      # device holding the bus
+        self.owner_thread = None
+        self.last_owner = None
+        self.start = 0.0       # time the current transaction started
+        self.devices = {}
+        self.switches = 0      # clock rate (device) changes
+        self.since = time.monotonic()
+
+    def add_device(self, name, speed_hz, spi=None):
+        device = self.devices.get(name)
+        if device is None:
+            device = Device(name, speed_hz, spi)
+            self.devices[name] = device
+        else:
+            device.speed_hz = speed_hz
+            device.spi = spi
+        return device
+
+    def transaction(self, device):
+        return Transaction(self, device)
+
+    def acquire(self, device):
+        requested = time.monotonic()
+        with self.cond:
+            # Not reentrant, waiting on our own ticket would deadlock
+            if self.owner_thread == threading.get_ident():
+                raise RuntimeError("SPI bus transaction for %s nested in one for %s" %
+                                   (device.name, self.owner.name if self.owner else "?"))
+            ticket = self.next_ticket
+            self.next_ticket += 1
+            while self.serving != ticket:
+                self.cond.wait()
+            self.owner_thread = threading.get_ident()
+        now = time.monotonic()
+        device.wait.add(now - requested)
+        try:
+            if device is not self.last_owner:
+                previous = self.last_owner
+                self.last_owner = None  # clock rate unknown until configure succeeds
+                device.configure()
+                if previous is not None:
+                    self.switches += 1
+                self.last_owner = device
+        except BaseException:
+            # Pass the bus on, otherwise every later transaction waits forever
+            with self.cond:
+                self.owner_thread = None
+                self.serving += 1
+                self.cond.notify_all()
+            raise
+        self.owner = device
+        self.start = now
+
+    def release(self):
+        device = self.owner
+        held = time.monotonic() - self.start
+        device.transactions += 1
+        device.busy += held
+        if held > device.longest:
+            device.longest = held
+        self.owner = None
+        with self.cond:
+            self.owner_thread = None
+            self.serving += 1
+            self.cond.notify_all()
+
+    def chunk_rows(self, device, row_bytes):
+        # Rows of row_bytes each which can be sent to the device in about MAX_HOLD
+        if not device.speed_hz or row_bytes <= 0:
+            return 1
+        return max(1, int(MAX_HOLD * device.speed_hz / 8 / row_bytes))
+
+    def reset_stats(self):
+        for d in self.devices.values():
+            d.reset_stats()
+        self.switches = 0
+        self.since = time.monotonic()
+
+    def stats(self):
+        elapsed = time.monotonic() - self.since
+        busy = sum(d.busy for d in self.devices.values())
+        return {
+            'utilization_pct': (100 * busy / elapsed) if elapsed > 0 else 0.0,
+            'switches': self.switches,
+            'devices': {name: d.to_dict(elapsed) for name, d in self.devices.items()}
+        }
+
+    def log_stats(self):
+        s = self.stats()
+        logging.info("SPI bus: %.1f%% busy, %d device switches" % (s['utilization_pct'], s['switches']))
+        for name, d in s['devices'].items():
+            logging.info("  %-6s %9d transactions, %5.1f%% busy, longest %.2fms, wait p99 <=%gms, max %.2fms" %
+                         (name, d['transactions'], d['busy_pct'], d['longest_ms'], d['wait']['p99_ms'],
+                          d['wait']['max_ms']))
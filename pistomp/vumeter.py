@@ -0,0 +1,238 @@
+# This file is part of pi-stomp.
+#
+# pi-stomp is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pi-stomp is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pi-stomp.  If not, see <https://www.gnu.org/licenses/>.
+
+import logging
+import math
+import time
+
+from collections import deque
+from enum import Enum
+
+import common.token as Token
+import common.util as util
+
+# VU meter engine shared by the clip indicators (AnalogVU).  The meter holds the settings and thresholds, each
+# indicator has a VuChannel holding its running state.
+#
+# Each refresh, an indicator passes the block of ADC samples taken since its previous refresh (see adcscanner).
+# The cost per refresh is one pass over that block plus constant work, however long the averaging window:
+#   - the block's rectified sum and sum of squares are added to running totals for the window, and blocks which have
+#     fallen out of the window are subtracted, giving the average (or RMS) level
+#   - the level goes through attack/release ballistics (one pole smoothing, separate rising and falling times)
+#   - the peak level is held for peak_hold, then decays at peak_decay dB per second (with no hold, the default, the
+#     peak is just the level)
+# The indicator shows CLIP while the held peak is over the clip threshold, otherwise WARN or SIG from the level.
+# Below the signal threshold, it keeps what it's showing until the level over the longer off_window is also below
+# it, so it doesn't flicker off between notes (0 turns it off as soon as the level drops).
+#
+# Thresholds are in dBV at the input jack.  The ADC reads the input before the audio card's input gain, so they're
+# converted to ADC units using the current input gain (higher gain means the signal clips at a lower input level).
+#
+# The config (default_config.yml) section, all optional:
+#   hardware:
+#     vu_meter:
+#       detector: average | rms
+#       window: <ms>
+#       off_window: <ms>
+#       attack: <ms>
+#       release: <ms>
+#       peak_hold: <ms>
+#       peak_decay: <dB per second>
+#       thresholds:
+#         signal: <dBV>
+#         warn: <dBV>
+#         clip: <dBV>
+#       channels:
+#         <channel name>:
+#           thresholds: ...        overrides for one channel (left or right)
+
+UNITS_PER_VOLT = 512 / 1.665   # ADC units/2 / supplyVoltage/2
+
+DEFAULTS = {
+    Token.DETECTOR: 'average',
+    Token.WINDOW: 80,
+    Token.OFF_WINDOW: 1000,
+    Token.ATTACK: 0,
+    Token.RELEASE: 0,
+    Token.PEAK_HOLD: 0,
+    Token.PEAK_DECAY: 20
+}
+
+DEFAULT_THRESHOLDS = {
+    Token.SIGNAL: -39,
+    Token.WARN: -20,
+    Token.CLIP: -15
+}
+
+
+class VuState(Enum):
+    OFF = 0
+    SIG = 1
+    WARN = 2
+    CLIP = 3
+
+
+class RunningWindow:
+    # Running totals of the blocks of samples from the last length seconds
+
+    def __init__(self, length):
+        self.length = length
+        self.blocks = deque()  # (time, count, sum, sum of squares) of the blocks in the window
+        self.count = 0
+        self.sum = 0.0
+        self.sum_sq = 0.0
+
+    def add(self, now, n, s, sq):
+        self.blocks.append((now, n, s, sq))
+        self.count += n
+        self.sum += s
+        self.sum_sq += sq
+        while len(self.blocks) > 1 and self.blocks[0][0] <= now - self.length:
+            _, n, s, sq = self.blocks.popleft()
+            self.count -= n
+            self.sum -= s
+            self.sum_sq -= sq
+
+    def value(self, rms):
+        # Average (or RMS) of the rectified samples, None if there are none
+        if self.count <= 0:
+            return None
+        if rms:
+            return math.sqrt(max(self.sum_sq, 0.0) / self.count)
+        return max(self.sum, 0.0) / self.count
+
+
+class VuChannel:
+
+    def __init__(self, name, thresholds_db, window, off_window):
+        self.name = name
+        self.thresholds_db = thresholds_db
+        # thresholds in ADC units above the baseline, set by VuMeter.recalibrate
+        self.thresh_sig = 0
+        self.thresh_warn = 0
+        self.thresh_clip = 0
+
+        self.window = RunningWindow(window)
+        self.off_window = RunningWindow(off_window) if off_window > 0 else None
+        self.level = 0.0       # after ballistics
+        self.peak = 0.0
+        self.peak_time = 0.0
+        self.last_time = None
+        self.state = VuState.OFF
+
+
+class VuMeter:
+
+    def __init__(self, cfg=None, input_gain=0, adc_baseline=512):
+        vu_cfg = util.DICT_GET(cfg, Token.VU_METER) if cfg is not None else None
+        if vu_cfg is None:
+            vu_cfg = {}
+        settings = DEFAULTS.copy()
+        settings.update({k: v for k, v in vu_cfg.items() if k in DEFAULTS})
+        self.rms = (settings[Token.DETECTOR] == 'rms')
+        self.window = settings[Token.WINDOW] / 1000
+        self.off_window = settings[Token.OFF_WINDOW] / 1000
+        self.attack = settings[Token.ATTACK] / 1000
+        self.release = settings[Token.RELEASE] / 1000
+        self.peak_hold = settings[Token.PEAK_HOLD] / 1000
+        self.peak_decay = settings[Token.PEAK_DECAY]
+
+        self.thresholds_db = DEFAULT_THRESHOLDS.copy()
+        thresholds = util.DICT_GET(vu_cfg, Token.THRESHOLDS)
+        if thresholds is not None:
+            self.thresholds_db.update(thresholds)
+        channels = util.DICT_GET(vu_cfg, Token.CHANNELS)
+        self.channel_cfg = channels if channels is not None else {}
+
+        self.channels = []
+        self.input_gain = input_gain
+        self.adc_baseline = adc_baseline
+
+    def add_channel(self, name):
+        thresholds_db = self.thresholds_db.copy()
+        channel_thresholds = util.DICT_GET(util.DICT_GET(self.channel_cfg, name) or {}, Token.THRESHOLDS)
+        if channel_thresholds is not None:
+            thresholds_db.update(channel_thresholds)
+        channel = VuChannel(name, thresholds_db, self.window, self.off_window)
+        self.channels.append(channel)
+        self._calibrate(channel)
+        return channel
+
+    def recalibrate(self, input_gain, adc_baseline):
+        # This should get called when user changes ALSA capture_volume (aka input gain)
+        # Since the ADC reading the input level is before any input gain adjustment,
+        # The thresholds must change to accommodate the input gain.
+        # Positive input gain, means lower thresholds since the input will clip at lower levels
+        # Negative input gain, means higher thresholds since the ADC will receive less signal
+        self.input_gain = input_gain
+        self.adc_baseline = adc_baseline
+        for c in self.channels:
+            self._calibrate(c)
+
+    def _calibrate(self, channel):
+        # Threshold in db   dbV = 20 log (db)
+        t = channel.thresholds_db
+        channel.thresh_sig = self.db_to_units(t[Token.SIGNAL])
+        channel.thresh_warn = self.db_to_units(t[Token.WARN])
+        channel.thresh_clip = self.db_to_units(t[Token.CLIP])
+        logging.debug("VU %s: Baseline: %d, Signal Present: %d (%d dB), Warn: %d (%d dB), Clip: %d (%d dB)" %
+                      (channel.name, self.adc_baseline, channel.thresh_sig, t[Token.SIGNAL], channel.thresh_warn,
+                       t[Token.WARN], channel.thresh_clip, t[Token.CLIP]))
+
+    def db_to_units(self, db):
+        return int((10 ** ((db - self.input_gain) / 20)) * UNITS_PER_VOLT)
+
+    def process(self, channel, samples, now=None):
+        # samples is a numpy array of ADC readings.  Returns the channel's (possibly new) state
+        if now is None:
+            now = time.monotonic()
+        dt = (now - channel.last_time) if channel.last_time is not None else 0.0
+        channel.last_time = now
+
+        # Running window totals
+        rectified = abs(samples.astype(float) - self.adc_baseline)
+        n = len(rectified)
+        s = float(rectified.sum())
+        sq = float((rectified * rectified).sum()) if self.rms else 0.0
+        channel.window.add(now, n, s, sq)
+        if channel.off_window is not None:
+            channel.off_window.add(now, n, s, sq)
+        value = channel.window.value(self.rms)
+        if value is None:
+            return channel.state
+
+        # Ballistics
+        tau = self.attack if value > channel.level else self.release
+        if tau <= 0 or dt <= 0:
+            channel.level = value
+        else:
+            channel.level += (value - channel.level) * (1 - math.exp(-dt / tau))
+
+        # Peak hold
+        if channel.level >= channel.peak or self.peak_hold <= 0:
+            channel.peak = channel.level
+            channel.peak_time = now
+        elif now - channel.peak_time > self.peak_hold:
+            channel.peak *= 10 ** (-self.peak_decay * dt / 20)
+
+        if channel.peak >= channel.thresh_clip:
+            channel.state = VuState.CLIP
+        elif channel.level >= channel.thresh_warn:
+            channel.state = VuState.WARN
+        elif channel.level >= channel.thresh_sig:
+            channel.state = VuState.SIG
+        elif channel.off_window is None or channel.off_window.value(self.rms) < channel.thresh_sig:
+            channel.state = VuState.OFF
+        return channel.state
@@ -172,6 +172,22 @@ class Box:
     def is_empty(self):
         return self.box[0] >= self.box[2] or self.box[1] >= self.box[3]
 
+    def contains(self, box):
+        """Returns whether box is entirely inside this rectangle"""
+        return (self.box[0] <= box.box[0] and self.box[1] <= box.box[1] and
+                self.box[2] >= box.box[2] and self.box[3] >= box.box[3])
+
+    def union(self, box):
+        """Returns the smallest rectangle containing both rectangles"""
+        return Box(min(self.box[0], box.box[0]), min(self.box[1], box.box[1]),
+                   max(self.box[2], box.box[2]), max(self.box[3], box.box[3]))
+
+    @property
+    def area(self):
+        if self.is_empty():
+            return 0
+        return self.width * self.height
+
     def norm(self):
         """Return a zero based Box of the same width and height"""
         return Box(0,0, self.width, self.height)
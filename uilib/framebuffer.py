@@ -0,0 +1,134 @@
+# This file is part of pi-stomp.
+#
+# pi-stomp is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pi-stomp is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pi-stomp.  If not, see <https://www.gnu.org/licenses/>.
+
+import numpy as np
+
+#
+# Shadow framebuffer for RGB565 displays (ILI9341)
+#
+# Keeps a copy of what is on the glass, in the display's own orientation
+# and pixel format, so an update only sends the parts which changed:
+#
+#   - the image region is converted to RGB565 and rotated to the display's
+#     orientation with NumPy (rather than per pixel by the display driver)
+#   - it's compared with the shadow in TILE x TILE tiles
+#   - each run of changed tiles in a row of tiles is a block, the same run
+#     in consecutive rows is merged into one block
+#
+# The caller sends the blocks (see send()) and the shadow is updated.
+#
+
+TILE = 16  # pixels
+
+def to_rgb565(image, rotation = 0):
+    """Converts a PIL image to a uint16 RGB565 array, rotated counter
+       clockwise by rotation degrees (as image.rotate(rotation, expand=True))
+    """
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    a = np.asarray(image, dtype=np.uint16)
+    c = ((a[:, :, 0] & 0xF8) << 8) | ((a[:, :, 1] & 0xFC) << 3) | (a[:, :, 2] >> 3)
+    return np.rot90(c, (rotation // 90) % 4)
+
+def send(disp, x, y, block):
+    """Sends a block to an adafruit_rgb_display display at x, y (display
+       coordinates)
+    """
+    h, w = block.shape
+    data = block.astype('>u2').tobytes()  # the display takes big endian pixels
+    disp._block(x, y, x + w - 1, y + h - 1, data)
+
+class Framebuffer:
+    def __init__(self, width, height, tile = TILE):
+        """width and height of the display in its own orientation"""
+        self.width = width
+        self.height = height
+        self.tile = tile
+        self.shadow = np.zeros((height, width), dtype=np.uint16)
+
+        # stats
+        self.updates = 0
+        self.blocks = 0
+        self.bytes_sent = 0
+        self.bytes_skipped = 0
+
+    def fill(self, color = 0):
+        """The display was filled with an RGB565 color"""
+        self.shadow.fill(color)
+
+    def diff(self, pixels, x, y):
+        """Returns the blocks of pixels (RGB565 array in display orientation
+           placed at x, y) which differ from the shadow, as (x, y, block)
+           tuples, and updates the shadow
+        """
+        h, w = pixels.shape
+        h = min(h, self.height - y)
+        w = min(w, self.width - x)
+        if h <= 0 or w <= 0:
+            return []
+        pixels = pixels[:h, :w]
+        region = self.shadow[y:y + h, x:x + w]
+
+        t = self.tile
+        th = -(-h // t)
+        tw = -(-w // t)
+        changed = np.zeros((th * t, tw * t), dtype=bool)
+        changed[:h, :w] = (pixels != region)
+        tiles = changed.reshape(th, t, tw, t).any(axis=(1, 3))
+
+        # runs of changed tiles per row of tiles, merged with the same run in
+        # the row above
+        spans = []   # [c0, c1, r0, r1] in pixels
+        above = {}   # (c0, c1) to the span ending at this row
+        for ty in range(th):
+            r0 = ty * t
+            r1 = min(h, r0 + t)
+            cols = np.flatnonzero(tiles[ty])
+            current = {}
+            for run in np.split(cols, np.flatnonzero(np.diff(cols) > 1) + 1):
+                if len(run) == 0:
+                    continue
+                c0 = run[0] * t
+                c1 = min(w, (run[-1] + 1) * t)
+                span = above.get((c0, c1))
+                if span is not None:
+                    span[3] = r1
+                else:
+                    span = [c0, c1, r0, r1]
+                    spans.append(span)
+                current[(c0, c1)] = span
+            above = current
+
+        blocks = []
+        sent = 0
+        for c0, c1, r0, r1 in spans:
+            block = np.ascontiguousarray(pixels[r0:r1, c0:c1])
+            blocks.append((x + c0, y + r0, block))
+            sent += block.size
+        region[...] = pixels
+
+        self.updates += 1
+        self.blocks += len(blocks)
+        self.bytes_sent += sent * 2
+        self.bytes_skipped += (h * w - sent) * 2
+        return blocks
+
+    def get_stats(self):
+        return {
+            'updates': self.updates,
+            'blocks': self.blocks,
+            'bytes_sent': self.bytes_sent,
+            'bytes_skipped': self.bytes_skipped
+        }
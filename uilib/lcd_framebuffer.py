@@ -0,0 +1,130 @@
+# This file is part of pi-stomp.
+#
+# pi-stomp is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pi-stomp is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pi-stomp.  If not, see <https://www.gnu.org/licenses/>.
+
+import mmap
+import os
+
+import numpy as np
+
+from uilib.panel import *
+from uilib.framebuffer import to_rgb565
+
+#
+# LCD backend for a Linux framebuffer device
+#
+# With the display driven by a kernel driver (fbtft, or panel-mipi-dbi
+# through DRM's fbdev emulation) the display is /dev/fbN.  The device is
+# memory mapped and each update writes the RGB565 rows of the box straight
+# into the mapping through a NumPy view of it.  The kernel sends the
+# changed pages to the display (with SPI DMA) on its own, so nothing here
+# waits on the bus.
+#
+# The geometry comes from sysfs (/sys/class/graphics/fbN).  A regular file
+# can stand in for the device (eg. for tests), width and height must then
+# be given and the file is created or extended to fit.
+#
+# Only 16 bits per pixel (RGB565) is supported, which is what the SPI
+# display drivers use.  flip rotates the image 180 degrees, the driver's
+# rotate setting should give a landscape width x height display.
+#
+
+SYSFS = "/sys/class/graphics"
+
+class LcdFramebuffer(LcdBase):
+    def __init__(self, path, width = None, height = None, flip = False):
+        self.path = path
+        self.flip = flip
+        sized = width is not None and height is not None
+        self.fd = os.open(path, os.O_RDWR | (os.O_CREAT if sized else 0), 0o644)
+        try:
+            if not sized:
+                width, height, stride = self._geometry(path)
+            else:
+                stride = width * 2
+                size = stride * height
+                if os.fstat(self.fd).st_size < size:
+                    os.ftruncate(self.fd, size)
+            self.mm = mmap.mmap(self.fd, stride * height, mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+        except Exception:
+            os.close(self.fd)
+            raise
+        self.width = width
+        self.height = height
+
+        # The pixels, rows may be padded to the stride
+        self.fb = np.ndarray((height, stride // 2), dtype=np.uint16, buffer=self.mm)[:, :width]
+
+        # stats
+        self.updates = 0
+        self.bytes = 0
+
+        self.clear()
+
+    @staticmethod
+    def _geometry(path):
+        # width, height and stride (bytes per row) of /dev/fbN
+        sysfs = os.path.join(SYSFS, os.path.basename(path))
+        def read(name):
+            with open(os.path.join(sysfs, name)) as f:
+                return f.read().strip()
+        bpp = int(read("bits_per_pixel"))
+        if bpp != 16:
+            raise ValueError("%s is %d bits per pixel, only 16 (RGB565) is supported" % (path, bpp))
+        width, height = (int(v) for v in read("virtual_size").split(","))
+        return width, height, int(read("stride"))
+
+    def dimensions(self):
+        return (self.width, self.height)
+
+    def default_format(self):
+        return 'RGB'
+
+    def clear(self):
+        self.fb[...] = 0
+
+    def update(self, image, box = None):
+        img_width, img_height = image.size
+        if box is None:
+            box = Box(0,0,img_width,img_height)
+
+        # Crop to the display
+        x1, y1, x2, y2 = box.rect
+        x1 = max(x1, 0)
+        y1 = max(y1, 0)
+        x2 = min(x2, self.width, img_width)
+        y2 = min(y2, self.height, img_height)
+        if x2 <= x1 or y2 <= y1:
+            return
+
+        if self.flip:
+            pixels = to_rgb565(image.crop((x1, y1, x2, y2)), 180)
+            self.fb[self.height - y2:self.height - y1, self.width - x2:self.width - x1] = pixels
+        else:
+            self.fb[y1:y2, x1:x2] = to_rgb565(image.crop((x1, y1, x2, y2)))
+        self.updates += 1
+        self.bytes += (x2 - x1) * (y2 - y1) * 2
+
+    def close(self):
+        if self.mm is not None:
+            self.fb = None
+            self.mm.close()
+            self.mm = None
+            os.close(self.fd)
+
+    def get_stats(self):
+        return {
+            'updates': self.updates,
+            'bytes': self.bytes
+        }
@@ -16,13 +16,19 @@
 import adafruit_rgb_display.ili9341 as ili9341
 
 from uilib.panel import *
-import logging
-import threading
+from uilib.framebuffer import Framebuffer, to_rgb565, send
+from uilib.renderthread import RenderThread, MAX_FPS
 
 class LcdIli9341(LcdBase):
     # XXX
     # TODO: Turn "flip" into all 90deg angle combinations
-    def __init__(self, spi, cs_pin, dc_pin, reset_pin, baudrate, flip = True):
+    # bus (optional) is a pistomp.spibus.SpiBus arbitrating the SPI bus with other devices.  With it, updates are
+    # sent in chunks of rows, one bus transaction per chunk
+    # Updates are sent by a render thread (see renderthread.py), at most max_fps frames a second, and only the parts
+    # which differ from what's on the glass (see framebuffer.py)
+    def __init__(self, spi, cs_pin, dc_pin, reset_pin, baudrate, flip = True, bus = None, max_fps = MAX_FPS):
+        self.bus = bus
+        self.device = bus.add_device("lcd", baudrate) if bus is not None else None
         self.disp = ili9341.ILI9341(
             spi,
             cs=cs_pin,
@@ -31,9 +37,9 @@ class LcdIli9341(LcdBase):
             baudrate=baudrate
         )
 
-        # Use this to assure we don't have multiple threads trying to change the screen
-        # All methods which do change the screen (eg. dist. calls) should acquire/release
-        self.lock = threading.Lock()
+        # What's on the glass, in the display's orientation, and the thread which owns the display
+        self.framebuffer = Framebuffer(self.disp.width, self.disp.height)
+        self.renderer = RenderThread(self.framebuffer, self._send, max_fps)
 
         # Clear the display
         self.clear()
@@ -50,14 +56,16 @@ class LcdIli9341(LcdBase):
         return 'RGB'
 
     def clear(self):
-        self.lock.acquire()
-        self.disp.fill(0)
-        self.lock.release()
+        self.renderer.fill(0, self._fill)
+
+    def _fill(self):
+        if self.bus is not None:
+            with self.bus.transaction(self.device):
+                self.disp.fill(0)
+        else:
+            self.disp.fill(0)
 
     def update(self, image, box = None):
-        if self.lock.locked():
-            logging.debug("LCD update was locked by another thread")
-        self.lock.acquire()
         # LCD coordinates
         #
         # portrait mode, connector = bottom
@@ -75,14 +83,36 @@ class LcdIli9341(LcdBase):
             x2 = self.width
         if y2 > self.height:
             y2 = self.height
-        if x1 != 0 or y1 != 0 or x2 != img_width or y2 != img_width:
-            image = image.crop((x1,y1,x2,y2))
-            if self.flip:
-                x = self.height - y2
-                y = x1
-            else:
-                x = y1
-                y = self.width - x2
-        self.disp.image(image, 270 if self.flip else 90, x, y)
-        self.lock.release()
 
+        if x2 <= x1 or y2 <= y1:
+            return
+
+        # Convert and rotate to the display's orientation, the render thread sends what changed
+        if self.flip:
+            pixels = to_rgb565(image.crop((x1, y1, x2, y2)), 270)
+            x = self.height - y2
+            y = x1
+        else:
+            pixels = to_rgb565(image.crop((x1, y1, x2, y2)), 90)
+            x = y1
+            y = self.width - x2
+        self.renderer.submit(pixels, x, y)
+
+    def _send(self, x, y, block):
+        # Render thread
+        if self.bus is not None:
+            # Send in chunks of rows so other devices on the bus get a turn between them
+            rows = self.bus.chunk_rows(self.device, block.shape[1] * 2)  # 2 bytes (RGB565) per pixel
+            for r in range(0, block.shape[0], rows):
+                with self.bus.transaction(self.device):
+                    send(self.disp, x, y + r, block[r:r + rows])
+        else:
+            send(self.disp, x, y, block)
+
+    def close(self):
+        self.renderer.stop()
+
+    def get_stats(self):
+        stats = self.framebuffer.get_stats()
+        stats.update(self.renderer.get_stats())
+        return stats
@@ -15,6 +15,8 @@
 
 from uilib.container import *
 from pathlib import Path
+import threading
+import time
 
 #
 # Note about coordinates:
@@ -156,6 +158,83 @@ class RoundedPanel(Panel):
                 color = self.fgnd_color
             draw.rounded_rectangle(real_box.PIL_rect, self.radius, None, color, self.outline)
 
+# Damage tracking
+#
+# Widget refreshes reach the PanelStack (via _compose) as dirty rectangles in LCD coordinates. Outside of a frame
+# they're drawn straight away as before. Inside a frame (see PanelStack.frame(), eg. one pass of the main loop)
+# they're collected in a Damage set, which merges overlapping or nearby rectangles, and at the end of the frame
+# only those rectangles are recomposed from the panels and sent to the LCD. Panels underneath an opaque panel
+# that covers a whole rectangle aren't composed at all.
+
+MAX_DAMAGE_RECTS = 8  # beyond this the pair with the smallest union is merged
+MERGE_SLACK = 1.25    # rectangles are merged when their union is no bigger than this times their combined area
+
+class Damage:
+    """A set of dirty rectangles"""
+    def __init__(self, max_rects = MAX_DAMAGE_RECTS):
+        self.max_rects = max_rects
+        self.rects = []
+        self.lock = threading.Lock()  # panels can be popped from timer threads
+        self.merged = 0
+
+    def add(self, box):
+        if box.is_empty():
+            return
+        with self.lock:
+            merging = True
+            while merging:
+                merging = False
+                for r in self.rects:
+                    if r.contains(box):
+                        return
+                    u = r.union(box)
+                    if r.intersects(box) or u.area <= MERGE_SLACK * (r.area + box.area):
+                        self.rects.remove(r)
+                        self.merged += 1
+                        box = u
+                        merging = True
+                        break
+            self.rects.append(box)
+            while len(self.rects) > self.max_rects:
+                self._merge_closest()
+
+    def _merge_closest(self):
+        best = None
+        for i in range(len(self.rects)):
+            for j in range(i + 1, len(self.rects)):
+                u = self.rects[i].union(self.rects[j])
+                if best is None or u.area < best[0].area:
+                    best = (u, i, j)
+        u, i, j = best
+        del self.rects[j]
+        del self.rects[i]
+        self.rects.append(u)
+        self.merged += 1
+
+    def take(self):
+        """Returns the rectangles and clears the set"""
+        with self.lock:
+            rects = self.rects
+            self.rects = []
+        return rects
+
+    def is_empty(self):
+        return len(self.rects) == 0
+
+class Frame:
+    def __init__(self, stack):
+        self.stack = stack
+
+    def __enter__(self):
+        self.stack.framing += 1
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.stack.framing -= 1
+        if self.stack.framing == 0:
+            self.stack.flush()
+        return False
+
 class LcdBase:
     def dimensions(self):
         pass
@@ -166,6 +245,12 @@ class LcdBase:
     def update(self, image, box = None):
         pass
 
+    def close(self):
+        pass
+
+    def get_stats(self):
+        return {}
+
 class PanelStack(ContainerWidget):
     def __init__(self, lcd, box = None, image_format = None, use_dimming = True):
         # XXX This implementation currently assumes box is at (0,0) in the LCD
@@ -196,33 +281,84 @@ class PanelStack(ContainerWidget):
         self._setup()
 
         self.lcd_needs_update = False
+        self.damage = Damage()
+        self.framing = 0
+
+        # stats
+        self.frames = 0
+        self.rects = 0
+        self.pixels = 0
+        self.frame_time = 0.0
+        self.frame_time_max = 0.0
 
     def poll_updates(self):
         if self.lcd_needs_update:
-            self.refresh()
+            self.lcd_needs_update = False
+            self.flush()
 
     def _compose(self, widget, orig_box, real_box):
         # This always called with widget = a Panel which is a direct
         # child of the stack, so we can drop orig_box
-        self._do_refresh(widget, real_box)
+        self.add_damage(real_box)
 
     def refresh(self):
-        self._do_refresh(None, self.box)
+        self.add_damage(self.box)
         self.lcd_needs_update = False
 
-    def _do_refresh(self, panel, box):
-        # XXX TODO: Optimize the case where there is only one panel,
-        # or the refreshed box only intersects the top level one:
-        # go straight to LCD ! (If we want to do stacked panels with
-        # alpha this can get complicated...)
+    def add_damage(self, box):
+        """Mark a region (LCD coordinates) for redraw, drawn now unless inside a frame"""
+        self.damage.add(box.intersection(self.box))
+        if self.framing == 0:
+            self.flush()
+
+    def frame(self):
+        """Context manager. Regions refreshed inside it are drawn together when it ends"""
+        return Frame(self)
+
+    def flush(self):
+        """Recompose and send the dirty regions"""
+        if self.damage.is_empty():
+            return
+        start = time.monotonic()
+        rects = self.damage.take()
+        for r in rects:
+            self._do_refresh(None, r)
+            self.pixels += r.area
+        elapsed = time.monotonic() - start
+        self.frames += 1
+        self.rects += len(rects)
+        self.frame_time += elapsed
+        self.frame_time_max = max(self.frame_time_max, elapsed)
+
+    def get_stats(self):
+        return {
+            'frames': self.frames,
+            'rects': self.rects,
+            'merged': self.damage.merged,
+            'pixels': self.pixels,
+            'bytes': self.pixels * 2,  # RGB565
+            'avg_frame_ms': (self.frame_time / self.frames * 1000) if self.frames else 0.0,
+            'max_frame_ms': self.frame_time_max * 1000
+        }
+
+    def _covers(self, panel, box):
+        # Whether the panel hides everything under it in box
+        if panel.mask is not None or not panel.box.contains(box):
+            return False
+        color = panel.bkgnd_color
+        return not (isinstance(color, tuple) and len(color) == 4 and color[3] < 255)
 
+    def _do_refresh(self, panel, box):
         # Erase image
         self._draw_erase(self.image, self.draw, box)
 
-        # XXX Do some alpha blending to "dim" inactive panels ?
-
-        # Compose panels
-        for p in self.stack:
+        # Compose panels, starting from the top most one which covers the box
+        first = 0
+        for i in range(len(self.stack) - 1, -1, -1):
+            if self._covers(self.stack[i], box):
+                first = i
+                break
+        for p in self.stack[first:]:
             if self.dimmer is not None:
                 self.image.alpha_composite(self.dimmer, box.topleft, box.rect)
             d = p.decorator
@@ -272,7 +408,14 @@ class PanelStack(ContainerWidget):
             else:
                 current = self.stack[-1]
             self.current = current
-        # queue a refresh
+        # queue a refresh of what was under it (this can be called from a timer thread, so not drawn here).
+        # With dimming, every panel below gets brighter so it's all redrawn
+        if self.dimmer is not None:
+            self.damage.add(self.box)
+        else:
+            self.damage.add(panel.box.intersection(self.box))
+            if panel.decorator is not None:
+                self.damage.add(panel.decorator.box.intersection(self.box))
         self.lcd_needs_update = True
         if panel.auto_destroy:
 #            panel.detach()
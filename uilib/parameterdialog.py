@@ -127,6 +127,13 @@ class Parameterdialog(Dialog):
             self.action(self.object, new_value)  # This assumes the method signature
         self._draw_graph()  # TODO XXX redrawing with every tweak produces a shit-load of line widgets
 
+    def set_value(self, value):
+        # Show a value changed elsewhere (doesn't call the action)
+        if value == self.param_value:
+            return
+        self.param_value = min(self.param_max, max(self.param_min, value))
+        self._draw_graph()
+
     def input_event(self, event):
         if event == InputEvent.CLICK:
             self.pop()
@@ -0,0 +1,171 @@
+# This file is part of pi-stomp.
+#
+# pi-stomp is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pi-stomp is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pi-stomp.  If not, see <https://www.gnu.org/licenses/>.
+
+import numpy as np
+import threading
+import time
+
+from uilib.box import Box
+from uilib.panel import Damage
+
+#
+# Render thread for RGB565 displays
+#
+# The thread owns the display: the UI thread only submits pixels (already
+# converted to RGB565 in the display's orientation, see framebuffer.py),
+# which are copied into a pending buffer and their area added to a Damage
+# set, so submitting never waits on the SPI bus.
+#
+# The thread sends the pending areas as one frame, diffed against the
+# shadow framebuffer, at most max_fps times a second.  Whatever is
+# submitted while a frame is being sent (or while waiting for the next
+# one) is merged into the next frame, so a burst of updates (eg. an encoder
+# being turned) sends only the latest pixels.
+#
+# Stats: frames sent, requests merged into a pending frame, requests
+# dropped (their pixels replaced by a later request before being sent)
+# and the latency from the first request of a frame until it's sent.
+#
+
+MAX_FPS = 30
+
+class RenderThread:
+    def __init__(self, framebuffer, send, max_fps = MAX_FPS):
+        """send(x, y, block) writes a block (RGB565 array) to the display at
+           x, y, it's called from the thread
+        """
+        self.framebuffer = framebuffer
+        self.send = send
+        self.min_interval = 1.0 / max_fps if max_fps else 0.0
+
+        self.cond = threading.Condition()  # pending, damage, first, busy
+        self.lock = threading.Lock()       # held while writing to the display
+        self.pending = np.zeros_like(framebuffer.shadow)  # latest pixels submitted
+        self.damage = Damage()
+        self.first = None     # time of the oldest request not sent yet
+        self.busy = False
+        self.generation = 0   # incremented by fill(), frames taken before it aren't sent
+        self.running = True
+
+        # stats
+        self.requests = 0
+        self.frames = 0
+        self.merged = 0
+        self.dropped = 0
+        self.latency = 0.0
+        self.latency_max = 0.0
+        self.render_time = 0.0
+
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def submit(self, pixels, x, y):
+        """Queues pixels (RGB565 array in display orientation) to be shown
+           at x, y
+        """
+        h, w = self.pending.shape
+        pixels = pixels[:max(0, h - y), :max(0, w - x)]
+        ph, pw = pixels.shape
+        if ph == 0 or pw == 0:
+            return
+        box = Box(x, y, x + pw, y + ph)
+        with self.cond:
+            self.requests += 1
+            if self.first is None:
+                self.first = time.monotonic()
+            else:
+                self.merged += 1
+                if any(r.intersects(box) for r in self.damage.rects):
+                    self.dropped += 1
+            self.pending[y:y + ph, x:x + pw] = pixels
+            self.damage.add(box)
+            self.cond.notify()
+
+    def _run(self):
+        last = 0.0
+        while True:
+            with self.cond:
+                while self.running and self.damage.is_empty():
+                    self.cond.wait()
+                if self.damage.is_empty():
+                    return
+
+            # Cap the frame rate, requests arriving meanwhile join this frame
+            wait = last + self.min_interval - time.monotonic()
+            if wait > 0 and self.running:
+                time.sleep(wait)
+
+            with self.cond:
+                rects = self.damage.take()
+                regions = [(r, self.pending[r.y0:r.y1, r.x0:r.x1].copy()) for r in rects]
+                first = self.first
+                self.first = None
+                self.busy = True
+                generation = self.generation
+            last = time.monotonic()
+
+            with self.lock:
+                if generation == self.generation:
+                    for r, pixels in regions:
+                        for bx, by, block in self.framebuffer.diff(pixels, r.x0, r.y0):
+                            self.send(bx, by, block)
+            done = time.monotonic()
+
+            with self.cond:
+                self.busy = False
+                self.frames += 1
+                self.render_time += done - last
+                if first is not None:
+                    self.latency += done - first
+                    self.latency_max = max(self.latency_max, done - first)
+                self.cond.notify_all()
+
+    def fill(self, color, func):
+        """Fills the display with an RGB565 color using func() (called with
+           the display to ourselves), dropping anything not sent yet.  What's
+           submitted while func() runs is sent after it
+        """
+        with self.lock:
+            # cond only for the reset, submit() doesn't wait for the fill
+            with self.cond:
+                self.pending.fill(color)
+                self.damage.take()
+                self.first = None
+                self.generation += 1
+            func()
+            self.framebuffer.fill(color)
+
+    def sync(self, timeout = 1.0):
+        """Waits until everything submitted has been sent"""
+        with self.cond:
+            return self.cond.wait_for(lambda: self.damage.is_empty() and not self.busy, timeout)
+
+    def stop(self):
+        """Sends whatever is pending and stops the thread"""
+        with self.cond:
+            self.running = False
+            self.cond.notify_all()
+        self.thread.join(1.0)
+
+    def get_stats(self):
+        return {
+            'requests': self.requests,
+            'frames': self.frames,
+            'merged': self.merged,
+            'dropped': self.dropped,
+            'avg_latency_ms': (self.latency / self.frames * 1000) if self.frames else 0.0,
+            'max_latency_ms': self.latency_max * 1000,
+            'avg_render_ms': (self.render_time / self.frames * 1000) if self.frames else 0.0
+        }
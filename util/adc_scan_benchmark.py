@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+
+# This file is part of pi-stomp.
+#
+# pi-stomp is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pi-stomp is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pi-stomp.  If not, see <https://www.gnu.org/licenses/>.
+
+# Compares the per poll cycle cost of reading the MCP3008 channels:
+#   per-channel: one xfer2 per channel (the previous approach, each control reading its own channel)
+#   batched:     AdcScanner.scan(), all channels in one SPI_IOC_MESSAGE ioctl
+# Must be run on the pi-Stomp (stop the mod-ala-pi-stomp service first so nothing else is using the ADC).
+#
+# Usage: adc_scan_benchmark.py [--channels 0 1 2 3 4 5 6 7] [--cycles 2000] [--speed 240000]
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+import spidev
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+import pistomp.adcscanner as AdcScanner
+
+
+def per_channel(spi, channels):
+    values = {}
+    for c in channels:
+        adc = spi.xfer2([1, (8 + c) << 4, 0])
+        values[c] = ((adc[1] & 3) << 8) + adc[2]
+    return values
+
+
+def measure(func, cycles):
+    samples = []
+    for i in range(cycles):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000000)
+    samples.sort()
+    return statistics.mean(samples), samples[int(len(samples) * 0.99) - 1]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--channels", nargs='+', type=int, default=list(range(8)))
+    parser.add_argument("--cycles", type=int, default=2000)
+    parser.add_argument("--speed", type=int, default=240000, help="SPI clock (Hz)")
+    args = parser.parse_args()
+
+    spi = spidev.SpiDev()
+    spi.open(0, 1)  # Bus 0, CE1 as in Hardware.init_spi
+    spi.max_speed_hz = args.speed
+
+    scanner = AdcScanner.AdcScanner(spi)
+    for c in args.channels:
+        scanner.add_channel(c)
+    scanner.scan()
+    if not scanner.batched:
+        print("Batched scan not available on this system")
+        return
+
+    # Sanity check, static inputs should read about the same both ways
+    direct = per_channel(spi, args.channels)
+    print("channel  per-channel  batched")
+    for c in args.channels:
+        print("%7d  %11d  %7d" % (c, direct[c], scanner.values[c]))
+    print()
+
+    print("%d channels, %d cycles at %dHz SPI clock" % (len(args.channels), args.cycles, args.speed))
+    print("%-12s %12s %12s" % ("method", "mean us", "p99 us"))
+    for name, func in (("per-channel", lambda: per_channel(spi, args.channels)), ("batched", scanner.scan)):
+        mean, p99 = measure(func, args.cycles)
+        print("%-12s %12.1f %12.1f" % (name, mean, p99))
+
+    spi.close()
+
+
+if __name__ == '__main__':
+    main()
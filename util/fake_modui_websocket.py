@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+
+# This file is part of pi-stomp.
+#
+# pi-stomp is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pi-stomp is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pi-stomp.  If not, see <https://www.gnu.org/licenses/>.
+
+# A stand in for mod-ui's websocket, for trying modalapi/modsocket.py (and the handler using it) without mod-ui.
+# Each line typed (or piped) on stdin is sent to the connected clients as a message, eg.
+#   param_set /graph/delay_1 time 0.5
+#   param_set /graph/delay_1 :bypass 1
+#   pedal_snapshot 2 Lead
+# and the messages the clients send back are printed.  With --check, a ModSocket is connected to it and the
+# messages it receives are printed as well.
+#
+# FakeModUiWebsocket can also be imported by test scripts: start() it, broadcast() messages and look at received.
+#
+# Usage: fake_modui_websocket.py [--port 8888] [--check]
+
+import argparse
+import base64
+import hashlib
+import os
+import socket
+import struct
+import sys
+import threading
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+
+class FakeModUiWebsocket:
+
+    def __init__(self, port=0):
+        self.server = socket.create_server(('127.0.0.1', port))
+        self.port = self.server.getsockname()[1]
+        self.uri = "ws://127.0.0.1:%d/websocket" % self.port
+        self.clients = []
+        self.received = []  # text messages from the clients
+        self.lock = threading.Lock()
+
+    def start(self):
+        threading.Thread(target=self._accept, daemon=True).start()
+        return self
+
+    def _accept(self):
+        while True:
+            conn, _ = self.server.accept()
+            threading.Thread(target=self._client, args=(conn,), daemon=True).start()
+
+    def _client(self, conn):
+        request = b""
+        while b"\r\n\r\n" not in request:
+            data = conn.recv(1024)
+            if not data:
+                return
+            request += data
+        key = None
+        for line in request.decode().split("\r\n"):
+            if line.lower().startswith("sec-websocket-key:"):
+                key = line.split(":", 1)[1].strip()
+        accept = base64.b64encode(hashlib.sha1((key + GUID).encode()).digest()).decode()
+        conn.sendall(("HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                      "Sec-WebSocket-Accept: %s\r\n\r\n" % accept).encode())
+        with self.lock:
+            self.clients.append(conn)
+        try:
+            f = conn.makefile('rb')
+            while True:
+                header = f.read(2)
+                if len(header) < 2:
+                    break
+                opcode = header[0] & 0x0F
+                length = header[1] & 0x7F
+                if length == 126:
+                    length = struct.unpack("!H", f.read(2))[0]
+                elif length == 127:
+                    length = struct.unpack("!Q", f.read(8))[0]
+                mask = f.read(4)
+                payload = bytes(b ^ mask[i % 4] for i, b in enumerate(f.read(length)))
+                if opcode == 0x8:
+                    break
+                if opcode == 0x1:
+                    with self.lock:
+                        self.received.append(payload.decode())
+        except OSError:
+            pass
+        with self.lock:
+            self.clients.remove(conn)
+        conn.close()
+
+    def broadcast(self, message):
+        payload = message.encode()
+        if len(payload) < 126:
+            frame = bytes([0x81, len(payload)]) + payload
+        else:
+            frame = bytes([0x81, 126]) + struct.pack("!H", len(payload)) + payload
+        with self.lock:
+            clients = list(self.clients)
+        for c in clients:
+            try:
+                c.sendall(frame)
+            except OSError:
+                pass
+
+    def disconnect_all(self):
+        with self.lock:
+            clients = list(self.clients)
+        for c in clients:
+            c.shutdown(socket.SHUT_RDWR)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8888)
+    parser.add_argument("--check", action='store_true', help="connect a ModSocket and print what it receives")
+    args = parser.parse_args()
+
+    server = FakeModUiWebsocket(args.port).start()
+    print("Listening on %s" % server.uri)
+
+    if args.check:
+        import modalapi.modsocket as ModSocket
+
+        sock = ModSocket.ModSocket(server.uri)
+
+        def show():
+            while True:
+                for e in sock.events():
+                    print("ModSocket: %s %s" % e)
+                time.sleep(0.05)
+        threading.Thread(target=show, daemon=True).start()
+
+    shown = 0
+    for line in sys.stdin:
+        server.broadcast(line.strip())
+        time.sleep(0.1)
+        with server.lock:
+            for m in server.received[shown:]:
+                print("client: %s" % m)
+            shown = len(server.received)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+
+# This file is part of pi-stomp.
+#
+# pi-stomp is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pi-stomp is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pi-stomp.  If not, see <https://www.gnu.org/licenses/>.
+
+# Measures the frame time and the bytes sent to the LCD for typical UI updates, with the panels refreshed as a whole
+# and each refresh sent straight away (the previous approach), or with only the changed widgets refreshed inside a
+# PanelStack frame, so the dirty rectangles are merged and only they are recomposed and sent.
+#
+# The LCD is a stand in which counts the bytes (RGB565) it's given and, with --spi-mhz, sleeps for as long as they'd
+# take to send, so the numbers approximate the ILI9341 on the pi-Stomp's SPI bus.  The layout is the lcd320x240 one:
+# a main panel with a grid of plugins and a footswitch panel.
+#
+# Usage: lcd_damage_benchmark.py [--plugins 8] [--iterations 50] [--spi-mhz 24]
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from PIL import ImageFont
+
+from uilib.box import Box
+from uilib.footswitch import FootswitchWidget
+from uilib.panel import LcdBase, Panel, PanelStack
+from uilib.text import TextWidget
+
+WIDTH = 320
+HEIGHT = 240
+PLUGIN_WIDTH = 78
+PLUGIN_HEIGHT = 29
+PER_ROW = 4
+
+
+class CountingLcd(LcdBase):
+
+    def __init__(self, spi_hz):
+        self.spi_hz = spi_hz
+        self.updates = 0
+        self.bytes = 0
+
+    def dimensions(self):
+        return (WIDTH, HEIGHT)
+
+    def default_format(self):
+        return 'RGB'
+
+    def update(self, image, box=None):
+        if box is None:
+            box = Box(0, 0, WIDTH, HEIGHT)
+        n = box.width * box.height * 2
+        self.updates += 1
+        self.bytes += n
+        if self.spi_hz:
+            time.sleep(n * 8 / self.spi_hz)
+
+
+class Ui:
+    # Just enough of lcd320x240 to exercise the panels the same way
+
+    def __init__(self, lcd, plugins):
+        try:
+            font = ImageFont.truetype("DejaVuSans.ttf", 12)
+        except OSError:
+            font = ImageFont.load_default()
+        self.pstack = PanelStack(lcd, image_format='RGB', use_dimming=True)
+        self.main_panel = Panel(box=Box.xywh(0, 0, WIDTH, 170))
+        self.footswitch_panel = Panel(box=Box.xywh(0, 176, WIDTH, 64))
+        self.pstack.push_panel(self.main_panel)
+        self.pstack.push_panel(self.footswitch_panel)
+
+        self.bypassed = [False] * plugins
+        self.w_plugins = []
+        for i in range(plugins):
+            x = (PLUGIN_WIDTH + 2) * (i % PER_ROW)
+            y = 78 + (PLUGIN_HEIGHT + 2) * (i // PER_ROW)
+            w = TextWidget(box=Box.xywh(x, y, PLUGIN_WIDTH, PLUGIN_HEIGHT), text="plugin%d" % i, font=font,
+                           outline_radius=5, parent=self.main_panel)
+            self.main_panel.add_sel_widget(w)
+            self.w_plugins.append(w)
+            self.color_plugin(i)
+        self.w_footswitches = []
+        for i in range(min(plugins, 4)):
+            w = FootswitchWidget(Box.xywh(80 * i, 0, PLUGIN_WIDTH, PLUGIN_HEIGHT), font, "fs%d" % i, (0, 255, 0),
+                                 False, parent=self.footswitch_panel)
+            self.footswitch_panel.add_widget(w)
+            self.w_footswitches.append(w)
+        self.main_panel.refresh()
+        self.footswitch_panel.refresh()
+
+    def color_plugin(self, i):
+        w = self.w_plugins[i]
+        before = (w.outline, w.bkgnd_color)
+        if self.bypassed[i]:
+            w.set_outline(1, (0, 255, 0))
+            w.set_background((0, 0, 0))
+        else:
+            w.set_outline(2, (0, 0, 0))
+            w.set_background((0, 255, 0))
+        return before != (w.outline, w.bkgnd_color)
+
+    # The previous approach, whole panels
+    def footswitch_panels(self, i):
+        self.bypassed[i] = not self.bypassed[i]
+        self.w_footswitches[i].toggle(self.bypassed[i])
+        self.footswitch_panel.refresh()
+        for j in range(len(self.w_plugins)):
+            self.color_plugin(j)
+        self.main_panel.refresh()
+
+    def select_panels(self, i):
+        self.w_plugins[i].set_selected(True)
+        self.w_plugins[i - 1].set_selected(False)
+        self.main_panel.refresh()
+
+    # Only what changed, in a frame
+    def footswitch_damage(self, i):
+        with self.pstack.frame():
+            self.bypassed[i] = not self.bypassed[i]
+            self.w_footswitches[i].toggle(self.bypassed[i])
+            self.footswitch_panel.refresh()
+            for j in range(len(self.w_plugins)):
+                if self.color_plugin(j):
+                    self.w_plugins[j].refresh()
+
+    def select_damage(self, i):
+        with self.pstack.frame():
+            self.w_plugins[i].set_selected(True)
+            self.w_plugins[i - 1].set_selected(False)
+
+
+def measure(lcd, ui, action, iterations):
+    # Returns the list of frame times (ms) and the bytes sent per frame
+    times = []
+    lcd.bytes = 0
+    for n in range(iterations):
+        start = time.monotonic()
+        action(ui, n)
+        times.append((time.monotonic() - start) * 1000)
+    return times, lcd.bytes / iterations
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--plugins", type=int, default=8)
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--spi-mhz", type=float, default=0, help="simulate sending at this SPI clock (0: don't)")
+    args = parser.parse_args()
+
+    footswitches = min(args.plugins, 4)
+    scenarios = [
+        ("footswitch toggle", lambda ui, n: ui.footswitch_panels(n % footswitches),
+                              lambda ui, n: ui.footswitch_damage(n % footswitches)),
+        ("plugin selection", lambda ui, n: ui.select_panels(n % args.plugins),
+                             lambda ui, n: ui.select_damage(n % args.plugins)),
+    ]
+
+    print("%-18s %-8s %10s %10s %12s %8s" % ("update", "mode", "mean ms", "max ms", "bytes/frame", "rects"))
+    for name, panels, damage in scenarios:
+        for mode, action in (("panels", panels), ("damage", damage)):
+            lcd = CountingLcd(args.spi_mhz * 1e6)
+            ui = Ui(lcd, args.plugins)
+            lcd.updates = 0
+            times, per_frame = measure(lcd, ui, action, args.iterations)
+            print("%-18s %-8s %10.2f %10.2f %12d %8.1f" % (name, mode, statistics.mean(times), max(times),
+                                                           per_frame, lcd.updates / args.iterations))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+
+# This file is part of pi-stomp.
+#
+# pi-stomp is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pi-stomp is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pi-stomp.  If not, see <https://www.gnu.org/licenses/>.
+
+# Checks the framebuffer LCD backend (uilib/lcd_framebuffer.py): draws panels through a PanelStack onto a framebuffer
+# device (eg. /dev/fb1 from fbtft) or onto a regular file standing in for one, reads the pixels back from the file and
+# compares them with the composed image converted to RGB565.  Prints the update times.
+#
+# Usage: lcd_framebuffer_check.py [--device /dev/fb1 | --file /tmp/fb.raw] [--size 320x240] [--flip]
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from uilib.box import Box
+from uilib.config import Config
+from uilib.framebuffer import to_rgb565
+from uilib.lcd_framebuffer import LcdFramebuffer
+from uilib.panel import Panel, PanelStack
+from uilib.text import TextWidget
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--device", help="framebuffer device, eg. /dev/fb1")
+    parser.add_argument("--file", default="/tmp/pistomp-fb.raw", help="regular file standing in for the device")
+    parser.add_argument("--size", default="320x240", help="width x height when using a file")
+    parser.add_argument("--flip", action='store_true')
+    parser.add_argument("--iterations", type=int, default=50)
+    args = parser.parse_args()
+
+    Config(os.path.join(os.path.dirname(__file__), '..', 'ui', 'config.json'))
+    if args.device:
+        lcd = LcdFramebuffer(args.device, flip=args.flip)
+    else:
+        width, height = (int(v) for v in args.size.split("x"))
+        lcd = LcdFramebuffer(args.file, width, height, flip=args.flip)
+    width, height = lcd.dimensions()
+    print("%s: %dx%d" % (lcd.path, width, height))
+
+    pstack = PanelStack(lcd, image_format='RGB', use_dimming=False)
+    main_panel = Panel(box=Box.xywh(0, 0, width, height - 64))
+    footswitch_panel = Panel(box=Box.xywh(0, height - 64, width, 64))
+    pstack.push_panel(main_panel)
+    pstack.push_panel(footswitch_panel)
+    widgets = []
+    for i in range(8):
+        w = TextWidget(box=Box.xywh((i % 4) * 80, 80 + (i // 4) * 31, 78, 29), text="plugin%d" % i,
+                       outline=1, parent=main_panel)
+        main_panel.add_sel_widget(w)
+        widgets.append(w)
+    main_panel.refresh()
+    footswitch_panel.refresh()
+
+    times = []
+    for n in range(args.iterations):
+        w = widgets[n % len(widgets)]
+        start = time.monotonic()
+        w.set_background((0, 255, 0) if n % 2 else (0, 0, 0))
+        w.refresh()
+        times.append((time.monotonic() - start) * 1000)
+
+    # Read back what's in the framebuffer
+    expected = to_rgb565(pstack.image, 180 if args.flip else 0)
+    stride = lcd.fb.strides[0]
+    raw = np.fromfile(lcd.path, dtype=np.uint16, count=stride // 2 * height).reshape(height, stride // 2)
+    ok = np.array_equal(raw[:, :width], expected)
+    print("widget refresh: mean %.3fms max %.3fms" % (statistics.mean(times), max(times)))
+    print("stats: %s" % lcd.get_stats())
+    print("framebuffer matches the composed image" if ok else "framebuffer DIFFERS from the composed image")
+    lcd.close()
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+
+# This file is part of pi-stomp.
+#
+# pi-stomp is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pi-stomp is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pi-stomp.  If not, see <https://www.gnu.org/licenses/>.
+
+# Measures the time to copy the zones of the monochrome LCDs (lcdgfx, lcd128x64) to the display buffer, with a
+# set_pixel() call per pixel (the previous approach) or with pageblit (NumPy bit packing), and checks that both leave
+# the same bytes in the buffer.
+#
+# The controllers are stand ins with the page format buffer and set_pixel() of the GFX HAT's ST7567 and of the
+# SSD1306 (adafruit_framebuf, rotation 2), so no display is needed.  show() isn't included, it's the same either way.
+#
+# Usage: mono_blit_benchmark.py [--iterations 50]
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from PIL import Image, ImageDraw
+
+import pistomp.pageblit as PageBlit
+
+WIDTH = 128
+HEIGHT = 64
+ZONE_HEIGHT = [12, 8, 2, 13, 2, 13, 2, 12]  # as lcdgfx and lcd128x64
+
+
+class St7567:
+    # gfxhat.st7567
+    def __init__(self):
+        self.buf = [0] * (WIDTH * HEIGHT // 8)
+
+    def set_pixel(self, x, y, value):
+        offset = ((y // 8) * WIDTH) + x
+        bit = y % 8
+        self.buf[offset] &= ~(1 << bit)
+        self.buf[offset] |= (value & 1) << bit
+
+
+class Ssd1306:
+    # adafruit_ssd1306 (adafruit_framebuf MVLSB) with rotation = 2
+    def __init__(self):
+        self.buffer = bytearray(WIDTH * HEIGHT // 8 + 1)
+        self.buf = memoryview(self.buffer)[1:]
+
+    def pixel(self, x, y, color):
+        x = WIDTH - x - 1
+        y = HEIGHT - y - 1
+        if x < 0 or x >= WIDTH or y < 0 or y >= HEIGHT:
+            return
+        index = (y >> 3) * WIDTH + x
+        offset = y & 0x07
+        self.buf[index] = (self.buf[index] & ~(0x01 << offset) & 0xFF) | ((color != 0) << offset)
+
+
+def gfx_loop(lcd, image, y_offset):
+    height = HEIGHT - 1  # as lcdgfx
+    for x in range(0, WIDTH):
+        for y in range(0, image.size[1]):
+            lcd.set_pixel(WIDTH - x - 1, height - y - y_offset, image.getpixel((x, y)))
+
+
+def gfx_blit(lcd, image, y_offset):
+    bits = PageBlit.to_bits(image, odd=True)
+    PageBlit.blit(lcd.buf, WIDTH, HEIGHT, bits[::-1, ::-1], 0, HEIGHT - 1 - y_offset - bits.shape[0] + 1)
+
+
+def ssd_loop(lcd, image, y_offset):
+    for x in range(0, WIDTH):
+        for y in range(0, image.size[1]):
+            lcd.pixel(WIDTH - x - 1, HEIGHT - y - y_offset, image.getpixel((x, y)))
+
+
+def ssd_blit(lcd, image, y_offset):
+    PageBlit.blit(lcd.buf, WIDTH, HEIGHT, PageBlit.to_bits(image), 0, y_offset - 1)
+
+
+def zone_images(rnd):
+    images = []
+    for h in ZONE_HEIGHT:
+        im = Image.new('L', (WIDTH, h))
+        draw = ImageDraw.Draw(im)
+        for _ in range(4):
+            x = rnd.randrange(WIDTH - 20)
+            draw.rectangle((x, 0, x + rnd.randrange(4, 30), rnd.randrange(h)), outline=1, fill=rnd.choice((0, 1)))
+        draw.text((rnd.randrange(40), -2), "zone", 1)
+        images.append(im)
+    return images
+
+
+def measure(make, func, images, iterations):
+    # Returns the refresh times (ms) of each zone and the buffer after refreshing them all
+    lcd = make()
+    times = []
+    for _ in range(iterations):
+        y_offset = 0
+        for im in images:
+            start = time.perf_counter()
+            func(lcd, im, y_offset)
+            times.append((time.perf_counter() - start) * 1000)
+            y_offset += im.size[1]
+    return times, bytes(lcd.buf)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--iterations", type=int, default=50)
+    args = parser.parse_args()
+
+    images = zone_images(random.Random(1))
+    print("%-10s %-6s %10s %10s %10s" % ("display", "mode", "mean ms", "max ms", "screen ms"))
+    for name, make, loop, blit in (("gfxhat", St7567, gfx_loop, gfx_blit), ("ssd1306", Ssd1306, ssd_loop, ssd_blit)):
+        buffers = []
+        for mode, func in (("loop", loop), ("blit", blit)):
+            times, buf = measure(make, func, images, args.iterations)
+            buffers.append(buf)
+            print("%-10s %-6s %10.3f %10.3f %10.3f" % (name, mode, statistics.mean(times), max(times),
+                                                     sum(times) / args.iterations))
+        print("%-10s buffers %s" % (name, "identical" if buffers[0] == buffers[1] else "DIFFER"))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+
+# This file is part of pi-stomp.
+#
+# pi-stomp is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pi-stomp is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pi-stomp.  If not, see <https://www.gnu.org/licenses/>.
+
+# Compares resident memory after parsing N pedalboard bundles:
+#   per-world: the previous approach, one lilv World per pedalboard, kept alive with the Pedalboard object
+#   shared:    the shared LilvParser which unloads each bundle once its data has been extracted
+# Each measurement runs in a fresh process so they don't influence each other.
+#
+# Usage: pedalboard_memory_benchmark.py [pedalboards_dir] [--counts 1 10 50 100]
+
+import argparse
+import os
+import subprocess
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+DEFAULT_DIR = '/home/pistomp/data/.pedalboards'
+
+
+def rss_kb():
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1])
+    return 0
+
+
+def bundles(pb_dir, count):
+    names = sorted(n for n in os.listdir(pb_dir) if n.endswith('.pedalboard'))
+    return [os.path.join(pb_dir, n) for n in names[:count]]
+
+
+def run_per_world(paths):
+    import lilv
+    worlds = []
+    for path in paths:
+        world = lilv.World()
+        world.load_specifications()
+        world.load_plugin_classes()
+        world.load_bundle(world.new_file_uri(None, os.path.join(os.path.abspath(path), '')))
+        worlds.append(world)
+    return worlds
+
+
+def run_shared(paths):
+    import modalapi.lilvparser as LilvParser
+    parser = LilvParser.get_parser()
+    return [parser.parse(path) for path in paths]
+
+
+def child(mode, pb_dir, count):
+    paths = bundles(pb_dir, count)
+    baseline = rss_kb()
+    keep = run_per_world(paths) if mode == 'per-world' else run_shared(paths)
+    print("%d %d %d" % (len(keep), baseline, rss_kb()))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("dir", nargs='?', default=DEFAULT_DIR)
+    parser.add_argument("--counts", nargs='+', type=int, default=[1, 10, 50, 100, 200])
+    parser.add_argument("--child", nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child[0], args.dir, int(args.child[1]))
+        return
+
+    print("%-10s %12s %12s %12s" % ("boards", "per-world kB", "shared kB", "saved kB"))
+    for count in args.counts:
+        results = {}
+        for mode in ('per-world', 'shared'):
+            out = subprocess.check_output([sys.executable, __file__, args.dir, '--child', mode, str(count)])
+            n, baseline, rss = (int(v) for v in out.decode().split()[-3:])
+            results[mode] = (n, rss - baseline)
+        n = results['shared'][0]
+        print("%-10d %12d %12d %12d" % (n, results['per-world'][1], results['shared'][1],
+                                        results['per-world'][1] - results['shared'][1]))
+        if n < count:
+            break  # ran out of pedalboards
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+
+# This file is part of pi-stomp.
+#
+# pi-stomp is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pi-stomp is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pi-stomp.  If not, see <https://www.gnu.org/licenses/>.
+
+# Measures snapshot-change-to-LCD-update latency: the time from submitting a snapshot change until the
+# completion callback (which is what updates the LCD) runs on the main loop, with the bypass state of every plugin
+# fetched either serially (one request after another, the previous approach) or batched (ModClient.get_parameter_values).
+#
+# By default a fake mod-ui is started locally which answers each request after --delay milliseconds, to approximate
+# mod-ui's processing time.  Use --uri to run against a real mod-ui instead, with --instances naming plugin
+# instances of the currently loaded pedalboard (eg. --instances /delay_1 /reverb_1).
+#
+# Usage: snapshot_change_benchmark.py [--plugins 4 8 12 16] [--delay 2] [--iterations 20]
+
+import argparse
+import http.server
+import os
+import statistics
+import sys
+import threading
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+import modalapi.commandqueue as CommandQueue
+import modalapi.modclient as ModClient
+
+
+class FakeModUi(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive
+    disable_nagle_algorithm = True  # as tornado (mod-ui) does, otherwise each response waits on a delayed ACK
+    delay = 0.0
+
+    def do_GET(self):
+        time.sleep(self.delay)
+        body = b'true' if self.path.endswith('/:bypass') else b'{}'
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serial_load(client, index, instances):
+    client.get("snapshot/load?id=%d" % index)
+    bypass = {}
+    for instance_id in instances:
+        resp = client.get("effect/parameter/pi_stomp_get//graph" + instance_id + "/:bypass")
+        if resp.status_code == 200:
+            bypass[instance_id] = (resp.text == "true")
+    return bypass
+
+
+def batched_load(client, index, instances):
+    client.get("snapshot/load?id=%d" % index)
+    values = client.get_parameter_values([(i, ":bypass") for i in instances])
+    return {instance_id: (value == "true") for (instance_id, symbol), value in values.items()}
+
+
+def measure(commands, load, client, instances, iterations):
+    # Returns the list of submit to callback latencies (ms)
+    samples = []
+    for i in range(iterations):
+        done = []
+        start = time.monotonic()
+        commands.submit("preset", lambda: load(client, i % 2, instances), lambda bypass: done.append(bypass))
+        while len(done) == 0:
+            commands.run_callbacks()  # as the main loop would
+            time.sleep(0.0005)
+        samples.append((time.monotonic() - start) * 1000)
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--plugins", nargs='+', type=int, default=[1, 4, 8, 12, 16])
+    parser.add_argument("--delay", type=float, default=2.0, help="fake mod-ui response time (ms)")
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--uri", help="real mod-ui root uri, eg. http://localhost:80/")
+    parser.add_argument("--instances", nargs='+', help="plugin instance ids (with --uri)")
+    args = parser.parse_args()
+
+    if args.uri:
+        if not args.instances:
+            parser.error("--instances is required with --uri")
+        client = ModClient.ModClient(root_uri=args.uri)
+        counts = [len(args.instances)]
+    else:
+        FakeModUi.delay = args.delay / 1000
+        server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), FakeModUi)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        client = ModClient.ModClient(root_uri="http://127.0.0.1:%d/" % server.server_port)
+        counts = args.plugins
+
+    commands = CommandQueue.CommandQueue()
+    print("%-8s %14s %14s %14s %14s" % ("plugins", "serial p50 ms", "serial p95 ms", "batched p50 ms",
+                                        "batched p95 ms"))
+    for count in counts:
+        instances = args.instances if args.uri else ["/plugin_%d" % i for i in range(count)]
+        results = []
+        for load in (serial_load, batched_load):
+            measure(commands, load, client, instances, 2)  # warm up connections
+            samples = sorted(measure(commands, load, client, instances, args.iterations))
+            results.append((statistics.median(samples), samples[int(len(samples) * 0.95) - 1]))
+        print("%-8d %14.1f %14.1f %14.1f %14.1f" % (count, results[0][0], results[0][1], results[1][0], results[1][1]))
+
+    client.close()
+
+
+if __name__ == '__main__':
+    main()